@@ -0,0 +1,178 @@
+"""
+Замеры скорости сверки на синтетических данных.
+
+Входные файлы МГТ и многолистовой отчёт вигитон/антисон создаёт synthetic_inputs.
+Каждый этап замеряется отдельно: обработка файла МГТ, разбор отчёта, сверка, Свод и запись в копию отчёта.
+Обработка МГТ дополнительно разбивается на разбор строк и их свёртку (mgt_parse, mgt_aggregate) - эта разбивка
+в total не входит.
+Результаты дописываются в JSONL-файл; --compare сравнивает запуск с предыдущим при тех же параметрах.
+
+Пример:
+    python benchmark.py --rows 100000 --branches 5 --repeat 3 --compare
+"""
+import argparse
+import importlib
+import json
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from synthetic_inputs import branch_names, make_mgt_file, make_report_file, register_branches
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+# Замедление этапа относительно прошлого запуска, после которого --compare сообщает о регрессии
+REGRESSION_THRESHOLD = 0.2
+# Этапы, из которых складывается total: mgt_parse и mgt_aggregate - часть mgt_file и не суммируются
+TOTAL_STAGES = ('mgt_file', 'report_parse', 'merge', 'svod', 'write_back')
+
+def generate_inputs(workdir, rows, branches, vehicles, year=2024, month=3, seed=0, regenerate=False):
+    """
+    Создаёт (или берёт готовые) входные файлы в workdir/<параметры>.
+    Возвращает (список файлов МГТ, путь к отчёту).
+    """
+    names = branch_names(branches)
+    register_branches(names)
+    vehicles = max(1, min(vehicles, rows // branches))
+    folder = Path(workdir) / f'rows{rows}_br{branches}_veh{vehicles}_{year}{month:02d}_s{seed}'
+    folder.mkdir(parents=True, exist_ok=True)
+    mgt_paths = [folder / f'МГТ_{code}.xlsx' for code, _ in names]
+    report_path = folder / 'Отчет Вигитон.xlsx'
+    for i, ((code, _), path) in enumerate(zip(names, mgt_paths)):
+        if regenerate or not path.exists():
+            make_mgt_file(path, code, vehicles, rows // branches, year, month, seed + i)
+    if regenerate or not report_path.exists():
+        make_report_file(report_path, [sheet for _, sheet in names], vehicles, year, month, seed)
+    return mgt_paths, report_path
+
+def recording_sink(captured):
+    """Приёмник для _scan_mgt_sheet без свёртки: сохраняет раскладку листа и строки с датами в captured"""
+    def make_sink(*layout):
+        rows = []
+        captured.append((layout, rows))
+        return rows.append, lambda row_count: None
+    return make_sink
+
+def aggregate_rows(layout, rows):
+    """Свёртка уже прочитанных строк тем же приёмником, что и при обработке файла"""
+    add, build = app._mgt_aggregate_sink(*layout) or app._mgt_columns_sink(*layout)
+    for row in rows:
+        add(row)
+    return build(len(rows))
+
+def run_once(mgt_paths, report_path, output_dir, engine=None, write_back_engine=None):
+    """Один прогон всех этапов; возвращает {этап: секунды}"""
+    timings = {'mgt_parse': 0.0, 'mgt_aggregate': 0.0, 'mgt_file': 0.0}
+    frames = []
+    for path in mgt_paths:
+        # mgt_parse - один проход по строкам листа без свёртки, mgt_aggregate - свёртка тех же строк,
+        # mgt_file - обработка файла целиком (process_mgt_file)
+        captured = []
+        start = time.perf_counter()
+        app._scan_mgt_sheet(path, engine, recording_sink(captured))
+        parsed = time.perf_counter()
+        aggregate_rows(*captured[-1])
+        aggregated = time.perf_counter()
+        filial, period_display, df, messages, success, stats = app.process_mgt_file(path, engine=engine)
+        timings['mgt_parse'] += parsed - start
+        timings['mgt_aggregate'] += aggregated - parsed
+        timings['mgt_file'] += time.perf_counter() - aggregated
+        frames.append(df)
+    combined_df = app.concat_mgt_frames(frames)
+    start = time.perf_counter()
+    contract_dataframes, _ = app.read_report(report_path, combined_df['Филиал'].unique().tolist())
+    timings['report_parse'] = time.perf_counter() - start
+    profile = app.new_profile()
+    summary = app.new_run_summary()
+    report_rows = len(contract_dataframes)
+    app.write_reconciliation(app.build_mgt_index(combined_df), contract_dataframes, report_path, report_path.name, Path(output_dir), summary, write_back_engine, profile)
+    # Замеры имеют смысл, только если строки отчёта находят пары в МГТ: без совпадений сверка идёт по другой ветке
+    if summary['unmatched_report_rows'] >= report_rows:
+        raise RuntimeError(f"Ни одна из {report_rows} строк отчёта не совпала с данными МГТ - замеры не записываются")
+    stages = {record['name']: record['wall'] for record in profile['spans']}
+    timings['merge'] = stages.get('reconcile', 0.0)
+    timings['svod'] = stages.get('svod', 0.0)
+    timings['write_back'] = stages.get('write_back', 0.0)
+    return {stage: round(seconds, 4) for stage, seconds in timings.items()}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(results_path, params):
+    """Последний записанный результат с теми же параметрами"""
+    previous = None
+    if Path(results_path).exists():
+        with open(results_path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('params') == params:
+                    previous = record
+    return previous
+
+def compare_results(current, previous, threshold=REGRESSION_THRESHOLD):
+    """Этапы, замедлившиеся более чем на threshold: [(этап, было, стало)]"""
+    regressions = []
+    for stage, seconds in current['timings'].items():
+        before = previous['timings'].get(stage)
+        # Этапы короче 10 мс не сравниваем: их время определяется шумом
+        if before and max(before, seconds) >= 0.01 and seconds > before * (1 + threshold):
+            regressions.append((stage, before, seconds))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры скорости сверки на синтетических данных")
+    parser.add_argument('--rows', type=int, default=10000, help="строк с датами во всех файлах МГТ (1 тыс. - 1 млн)")
+    parser.add_argument('--branches', type=int, default=3, help="число филиалов (1-15): файл МГТ и лист отчёта на филиал")
+    parser.add_argument('--vehicles', type=int, default=200, help="ТС на филиал (строк отчёта на лист)")
+    parser.add_argument('--repeat', type=int, default=1, help="число прогонов; записывается лучшее время этапа")
+    parser.add_argument('--engine', choices=['native', 'openpyxl'], default=None, help="движок чтения xlsx")
+    parser.add_argument('--write-back-engine', choices=['xml', 'openpyxl'], default=None, help="движок записи копии отчёта")
+    parser.add_argument('--workdir', type=Path, default=Path(tempfile.gettempdir()) / 'mgt_benchmark', help="папка для входных и выходных файлов")
+    parser.add_argument('--regenerate', action='store_true', help="пересоздать входные файлы")
+    parser.add_argument('--results', type=Path, default=Path('benchmark_results.jsonl'), help="файл с результатами замеров")
+    parser.add_argument('--compare', action='store_true', help="сравнить с прошлым запуском; при регрессии код завершения 1")
+    args = parser.parse_args(argv)
+    if not 1 <= args.branches <= 15:
+        parser.error("число филиалов должно быть от 1 до 15")
+    app.log_to_gui = lambda message: None
+
+    start = time.perf_counter()
+    mgt_paths, report_path = generate_inputs(args.workdir, args.rows, args.branches, args.vehicles, regenerate=args.regenerate)
+    print(f"Входные файлы: {mgt_paths[0].parent} ({time.perf_counter() - start:.1f} сек)")
+    output_dir = args.workdir / 'output'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    best = {}
+    for _ in range(args.repeat):
+        for stage, seconds in run_once(mgt_paths, report_path, output_dir, args.engine, args.write_back_engine).items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+    params = {'rows': args.rows, 'branches': args.branches, 'vehicles': args.vehicles,
+              'engine': args.engine or app.XLSX_ENGINE, 'write_back_engine': args.write_back_engine or app.WRITE_BACK_ENGINE}
+    record = {'time': datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(), 'params': params,
+              'repeat': args.repeat, 'timings': best, 'total': round(sum(best[stage] for stage in TOTAL_STAGES), 4)}
+    for stage, seconds in best.items():
+        print(f"  {stage:<14}{seconds:>10.3f} сек")
+    print(f"  {'total':<14}{record['total']:>10.3f} сек")
+
+    exit_code = 0
+    if args.compare:
+        previous = previous_result(args.results, params)
+        if previous is None:
+            print("Прошлых результатов с такими параметрами нет")
+        else:
+            regressions = compare_results(record, previous)
+            for stage, before, after in regressions:
+                print(f"РЕГРЕССИЯ {stage}: {before:.3f} -> {after:.3f} сек (ревизия {previous.get('revision')})")
+            if regressions:
+                exit_code = 1
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return exit_code
+
+if __name__ == '__main__':
+    raise SystemExit(main())
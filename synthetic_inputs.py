@@ -0,0 +1,77 @@
+"""
+Синтетические входные данные сверки: файлы МГТ и многолистовой отчёт вигитон/антисон.
+
+Файл МГТ - период в C2, организация в C3, заголовок 'Дата', строки с датами и столбцами
+'Гар. №' / VIN / Часы / Пробег. Отчёт - строка 'за период ... г. по ... г.' и заголовок '№' на листе филиала.
+Используется замерами скорости (benchmark.py) и тестами.
+"""
+import calendar
+import importlib
+import random
+
+import openpyxl
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+# Основные филиалы из short_names; остальные получают условные имена
+BRANCHES = [('ФСВ', 'Северо-Восточный'), ('ФСЗ', 'Северо-Западный'), ('ФЮ', 'Южный')]
+RU_MONTHS_GENITIVE = {int(number): name for name, number in app.RU_MONTHS.items()}
+
+def branch_names(count):
+    """(код в файле МГТ, имя листа отчёта) для count филиалов"""
+    names = list(BRANCHES[:count])
+    for i in range(len(names), count):
+        names.append((f'Филиал-{i + 1:02d}', f'Филиал-{i + 1:02d}'))
+    return names
+
+def register_branches(names):
+    """
+    Условные филиалы - в short_names под своим именем: иначе build_mgt_index сводит их к 'Неизвестно'
+    и строки их листов отчёта не находят пары в данных МГТ
+    """
+    for code, sheet in names:
+        if code not in app.short_names and code not in app.short_names.values():
+            app.short_names[code] = sheet
+
+def make_mgt_file(path, code, vehicles, rows, year, month, seed):
+    """Файл МГТ: rows строк с датами, поровну на vehicles ТС"""
+    rnd = random.Random(seed)
+    days = calendar.monthrange(year, month)[1]
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([])
+    ws.append([None, None, f'Период: с 01.{month:02d}.{year} по {days:02d}.{month:02d}.{year}'])
+    ws.append([None, None, f'Организация: {code}'])
+    ws.append([])
+    ws.append(['Дата', 'Гар. №', 'VIN', 'Номер', 'Часы работы', 'Пробег, км'])
+    per_vehicle = max(1, rows // vehicles)
+    for v in range(vehicles):
+        ws.append([f'ТС {v}'])
+        for i in range(per_vehicle):
+            day = i * days // per_vehicle + 1
+            ws.append([f'{day:02d}.{month:02d}.{year}', str(100 + v), f'VIN{v:07d}', f'А{v % 1000:03d}АА',
+                       round(rnd.uniform(0, 6), 2), round(rnd.uniform(0, 80), 1)])
+        ws.append(['Итого', None, None, None, per_vehicle, per_vehicle * 40])
+    ws.append([])
+    ws.append(['Всего', None, None, None, rows, rows * 40])
+    wb.save(path)
+
+def make_report_file(path, sheets, vehicles, year, month, seed):
+    """Отчёт вигитон/антисон: лист на филиал, строка на ТС"""
+    rnd = random.Random(seed)
+    days = calendar.monthrange(year, month)[1]
+    month_name = RU_MONTHS_GENITIVE[month]
+    wb = openpyxl.Workbook(write_only=True)
+    for sheet in sheets:
+        ws = wb.create_sheet(sheet)
+        ws.append([f'Отчет об оказанных услугах за период с 01 {month_name} {year} г. по {days} {month_name} {year} г.'])
+        ws.append(['Договор № 1'])
+        ws.append([])
+        ws.append(['№', 'Наименование услуги', 'Единица измерения', 'Количество ед.', 'Гаражный номер ТС',
+                   'Государственный номер ТС', 'Цена 1 ед., руб.', 'Итого, руб.', 'VIN'])
+        for v in range(vehicles):
+            quantity = rnd.randint(1, days)
+            ws.append([v + 1, 'Услуга', 'сутки', quantity, 100 + v, f'А{v % 1000:03d}АА', 1500.5, quantity * 1500.5, f'VIN{v:07d}'])
+        ws.append([])
+        ws.append([None, 'Итого'])
+    wb.save(path)
@@ -0,0 +1,134 @@
+"""
+Чтение файлов МГТ: потоковое чтение против полной загрузки книги, нативный движок против openpyxl,
+свёртка строк при чтении против группировки прочитанного листа, выгрузка CSV/TSV против того же листа в xlsx.
+
+Запуск:
+    python -m pytest -q test_mgt_reading.py
+"""
+import csv
+import datetime
+import importlib
+import random
+
+import openpyxl
+import pandas as pd
+import pytest
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+VEHICLES = 5
+DAYS = 31
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    monkeypatch.setattr(app, 'log_to_gui', lambda message: None)
+
+def mgt_rows(seed, extra):
+    """Строки листа МГТ начиная с заголовка 'Дата'; extra - строки, которые чтение должно пропускать или разбирать особо"""
+    rnd = random.Random(seed)
+    rows = [['Дата', None, 'Гар. №', 'VIN', 'Номер', 'Часы работы', None, 'Пробег, км']]
+    for v in range(VEHICLES):
+        rows.append([f'ТС {v}'])
+        for day in range(1, DAYS + 1):
+            for _ in range(2):
+                rows.append([f'{day:02d}.03.2024', None, str(100 + v), f'VIN{v:05d}', f'А{v:03d}АА',
+                             round(rnd.uniform(0, 5), 2), None, round(rnd.uniform(0, 60), 1)])
+        rows.append(['Итого', None, None, None, None, 1, None, 2])
+        if extra:
+            rows.append([datetime.datetime(2024, 3, 1), None, str(100 + v), f'VIN{v:05d}', 'x', 5, None, 50])
+            rows.append(['01.03.2024 - 02.03.2024', None, '1', 'V', 'x', 5, None, 50])
+            rows.append([' 3.3.2024', None, str(100 + v), f'VIN{v:05d}', 'x', 'abc', None, 50])
+            rows.append(['05.03.2024', None, None, f'VIN{v:05d}', 'x', 5, None, 50])
+    rows.append([])
+    rows.append(['Всего', None, None, None, None, 100, None, 200])
+    return rows
+
+def make_mgt(path, organization='Организация: ФСВ', seed=0, extra=False):
+    """Файл МГТ: период в C2, организация в C3, заголовок 'Дата' в 6-й строке с объединёнными ячейками"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws['C2'] = 'Период: с 01.03.2024 по 31.03.2024'
+    ws['C3'] = organization
+    ws.append([])
+    ws.append([])
+    for row in mgt_rows(seed, extra):
+        ws.append(row)
+    ws.merge_cells('A6:B6')
+    ws.merge_cells('F6:G6')
+    wb.save(path)
+    return path
+
+@pytest.fixture(params=[False, True], ids=['plain', 'extra'])
+def mgt_path(request, tmp_path):
+    return make_mgt(tmp_path / 'МГТ_ФСВ.xlsx', seed=1, extra=request.param)
+
+def test_streaming_matches_full_load(mgt_path):
+    filial, period_display, streamed = app.read_mgt_workbook(mgt_path, streaming=True)
+    full_filial, full_period, full = app.read_mgt_workbook(mgt_path, streaming=False)
+    assert (filial, period_display) == (full_filial, full_period) == ('Организация: ФСВ', 'Период: с 01.03.2024 по 31.03.2024')
+    assert len(streamed) >= VEHICLES * DAYS * 2
+    pd.testing.assert_frame_equal(streamed.reset_index(drop=True), full.reset_index(drop=True))
+
+def test_native_engine_matches_openpyxl(mgt_path):
+    native = list(app.iter_sheet_rows(mgt_path, engine='native'))
+    assert native == list(app.iter_sheet_rows(mgt_path, engine='openpyxl'))
+    assert native[5][0] == 'Дата' and native[7][0] == '01.03.2024' and isinstance(native[7][5], float)
+    # Число с форматом даты читается как datetime, как и в openpyxl
+    datetimes = [row[0] for row in native if row and isinstance(row[0], datetime.datetime)]
+    assert datetimes == [datetime.datetime(2024, 3, 1)] * len(datetimes)
+    filial, period_display, df = app.read_mgt_workbook(mgt_path, engine='native')
+    openpyxl_filial, openpyxl_period, openpyxl_df = app.read_mgt_workbook(mgt_path, engine='openpyxl')
+    assert (filial, period_display) == (openpyxl_filial, openpyxl_period)
+    pd.testing.assert_frame_equal(df, openpyxl_df)
+
+@pytest.mark.parametrize('daily', [False, True], ids=['counts', 'daily'])
+def test_streaming_aggregation_matches_full_read(mgt_path, daily):
+    filial, period_display, streamed, messages, success, stats = app.process_mgt_file(mgt_path, mgt_streaming=True, daily=daily)
+    assert success and filial == 'Северо-Восточный'
+    full = app.process_mgt_file(mgt_path, mgt_streaming=False, daily=daily)[2]
+    assert not streamed.empty
+    pd.testing.assert_frame_equal(streamed, full)
+
+def test_streaming_aggregation_with_report_period(mgt_path):
+    period = (datetime.datetime(2024, 3, 1), datetime.datetime(2024, 3, 15))
+    streamed = app.process_mgt_file(mgt_path, daily=True, period=period)[2]
+    full = app.process_mgt_file(mgt_path, mgt_streaming=False, daily=True)[2]
+    dates = pd.to_datetime(full['Дата'], format='%d.%m.%Y')
+    expected = full[(dates >= period[0]) & (dates <= period[1])].reset_index(drop=True)
+    assert 0 < len(expected) < len(full)
+    pd.testing.assert_frame_equal(streamed.reset_index(drop=True), expected)
+
+def export_text(xlsx_path, path, encoding, delimiter, decimal, with_metadata=True):
+    """Лист МГТ как текстовая выгрузка: пустые ячейки и даты-числа - пустые поля, дробные числа - с разделителем decimal"""
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True)
+    rows = [list(row) for row in wb.active.iter_rows(values_only=True)]
+    wb.close()
+    if not with_metadata:
+        # Период и организация - только в имени файла
+        rows = rows[next(i for i, row in enumerate(rows) if row[0] == 'Дата'):]
+
+    def field(value):
+        if value is None or isinstance(value, datetime.datetime):
+            return ''
+        if isinstance(value, float):
+            return repr(value).replace('.', decimal)
+        return str(value)
+
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        csv.writer(f, delimiter=delimiter).writerows([field(value) for value in row] for row in rows)
+    return path
+
+@pytest.mark.parametrize('name, encoding, delimiter, decimal, with_metadata', [
+    ('МГТ.csv', 'cp1251', ';', ',', True),
+    ('МГТ.tsv', 'utf-8', '\t', '.', True),
+    ('МГТ_ФСВ_01.03.2024-31.03.2024.csv', 'utf-8-sig', ',', '.', False),
+], ids=['cp1251_semicolon', 'utf8_tab', 'metadata_from_name'])
+@pytest.mark.parametrize('daily', [False, True], ids=['counts', 'daily'])
+def test_text_export_matches_xlsx(mgt_path, tmp_path, name, encoding, delimiter, decimal, with_metadata, daily):
+    text_path = export_text(mgt_path, tmp_path / name, encoding, delimiter, decimal, with_metadata)
+    assert app.is_mgt_file(text_path) and app.is_mgt_text_file(text_path)
+    filial, period_display, df, messages, success, stats = app.process_mgt_file(text_path, daily=daily)
+    xlsx_filial, xlsx_period, xlsx_df = app.process_mgt_file(mgt_path, daily=daily)[:3]
+    assert success and (filial, period_display) == (xlsx_filial, xlsx_period)
+    assert not df.empty
+    pd.testing.assert_frame_equal(df, xlsx_df)
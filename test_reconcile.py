@@ -0,0 +1,76 @@
+"""
+Сверка строк отчёта с индексом МГТ: соединение по составному ключу (join_mgt_counts) против pd.merge
+и имена филиалов в индексе МГТ (build_mgt_index).
+
+Запуск:
+    python -m pytest -q test_reconcile.py
+"""
+import importlib
+
+import numpy
+import pandas as pd
+import pytest
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+def merge_positions(report, mgt_index, keys):
+    """(строки отчёта, строки МГТ или -1, маска строк МГТ без пары) по pd.merge(how='left')"""
+    merged = pd.merge(report[keys].assign(_report=numpy.arange(len(report))),
+                      mgt_index[keys].assign(_mgt=numpy.arange(len(mgt_index))), on=keys, how='left')
+    positions = merged['_mgt'].fillna(-1).astype('int64').to_numpy()
+    return merged['_report'].to_numpy(), positions, ~numpy.isin(numpy.arange(len(mgt_index)), positions)
+
+REPORT = pd.DataFrame({
+    'Филиал': ['Северо-Восточный', 'Северо-Восточный', 'Северо-Западный', 'Южный', 'Северо-Западный', None],
+    'VIN': ['VIN1', 'VIN2', 'VIN3', 'VIN4', 'VIN9', 'VIN5'],
+    'Гаражный номер ТС': [101, 102, 103, 104, 109, 105],
+})
+
+@pytest.mark.parametrize('mgt_index', [
+    # Ключи МГТ уникальны; VIN9 и Южный есть только в отчёте, VIN7 и VIN8 - только в МГТ
+    pd.DataFrame({'Филиал': ['Северо-Западный', 'Северо-Восточный', 'Северо-Восточный', 'Северо-Западный', 'Северо-Восточный'],
+                  'VIN': ['VIN3', 'VIN1', 'VIN7', 'VIN8', 'VIN2'],
+                  'Гаражный номер ТС': [103, 101, 107, 108, 102]}),
+    # Повторы ключа в МГТ и совпадающие пустые филиалы
+    pd.DataFrame({'Филиал': ['Северо-Восточный', 'Северо-Западный', 'Северо-Восточный', None, 'Северо-Западный'],
+                  'VIN': ['VIN1', 'VIN8', 'VIN1', 'VIN5', 'VIN3'],
+                  'Гаражный номер ТС': [101, 108, 101, 105, 104]}),
+    # Нет ни одного совпадения
+    pd.DataFrame({'Филиал': ['Южный'], 'VIN': ['VIN0'], 'Гаражный номер ТС': [100]}),
+], ids=['unique', 'duplicates', 'no_matches'])
+def test_join_matches_merge_with_unmatched_keys_on_both_sides(mgt_index):
+    rows, positions, unmatched_mgt = app.join_mgt_counts(REPORT, mgt_index)
+    expected_rows, expected_positions, expected_unmatched = merge_positions(REPORT, mgt_index, app.RECONCILE_KEYS)
+    numpy.testing.assert_array_equal(rows, expected_rows)
+    numpy.testing.assert_array_equal(positions, expected_positions)
+    numpy.testing.assert_array_equal(unmatched_mgt, expected_unmatched)
+    # Строки отчёта без пары остаются, строки МГТ без пары отмечены
+    assert (positions == -1).any() and unmatched_mgt.any()
+
+def test_join_with_categorical_keys():
+    mgt_index = pd.DataFrame({'Филиал': ['Северо-Восточный', 'Северо-Западный'], 'VIN': ['VIN2', 'VIN8'],
+                              'Гаражный номер ТС': [102, 108]})
+    report, index = REPORT.copy(), mgt_index.copy()
+    for key in ('Филиал', 'VIN'):
+        categories = sorted(set(report[key].dropna()) | set(index[key]))
+        report[key] = pd.Categorical(report[key], categories=categories)
+        index[key] = pd.Categorical(index[key], categories=categories)
+    rows, positions, unmatched_mgt = app.join_mgt_counts(report, index)
+    assert positions.tolist() == [-1, 0, -1, -1, -1, -1]
+    assert unmatched_mgt.tolist() == [False, True]
+
+def test_mgt_index_keeps_full_branch_names():
+    combined = pd.DataFrame({
+        'Гаражный номер ТС': ['000101', '102', '103', '104'],
+        'VIN': ['VIN1', 'VIN2', 'VIN3', 'VIN4'],
+        'Количество по МГТ': [5, 6, 7, 8],
+        'Филиал': pd.Categorical(['Северо-Восточный', 'ФСЗ', 'ООО Ромашка', None]),
+    })
+    mgt_index = app.build_mgt_index(combined)
+    # Полное имя остаётся как есть (раньше сводилось к 'Неизвестно'), код разворачивается через short_names
+    assert mgt_index['Филиал'].tolist() == ['Северо-Восточный', 'Северо-Западный', 'Неизвестно', 'Неизвестно']
+    report = pd.DataFrame({'Филиал': ['Северо-Восточный', 'Северо-Западный'], 'VIN': ['VIN1', 'VIN2'],
+                           'Гаражный номер ТС': app.garage_numbers(pd.Series(['101', '000102']))})
+    rows, positions, unmatched_mgt = app.join_mgt_counts(report, mgt_index)
+    assert positions.tolist() == [0, 1]
+    assert unmatched_mgt.tolist() == [False, False, True, True]
@@ -0,0 +1,110 @@
+"""
+Чтение отчёта вигитон/антисон: потоковая сетка листа, запасной разбор через openpyxl,
+поиск пустой строки и безымянных столбцов с данными.
+
+Запуск:
+    python -m pytest -q test_report.py
+"""
+import importlib
+
+import numpy
+import openpyxl
+import pandas as pd
+import pytest
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+SHEET = 'Северо-Восточный'
+HEADER = ['№', 'Наименование услуги', 'Единица измерения', 'Количество ед.', 'Гаражный номер ТС',
+          'Государственный номер ТС', 'Цена 1 ед., руб.', 'Итого, руб.', 'VIN']
+
+@pytest.fixture(autouse=True)
+def quiet_log(monkeypatch):
+    monkeypatch.setattr(app, 'log_to_gui', lambda message: None)
+
+def make_report(path, footer):
+    """Лист отчёта: строка периода, заголовок '№', три строки данных и подвал footer"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    ws.append(['Отчет об оказанных услугах за период с 01 марта 2024 г. по 31 марта 2024 г.'])
+    ws.append(['Договор № 1'])
+    ws.append([])
+    ws.append(HEADER)
+    for v in range(3):
+        ws.append([v + 1, 'Услуга', 'сутки', 10 + v, 100 + v, f'А{v:03d}АА', 1500.5, (10 + v) * 1500.5, f'VIN{v:07d}'])
+    for row in footer:
+        ws.append(row)
+    wb.save(path)
+    return path
+
+def test_grid_stops_at_first_empty_row_after_data(tmp_path):
+    path = make_report(tmp_path / 'report.xlsx', [[], [None, 'Итого', None, 33], [], ['Подпись']])
+    grid = app.report_sheet_grid(path, SHEET)
+    assert len(grid) == 7
+    assert grid.iloc[-1, 0] == '3'
+
+def test_grid_keeps_empty_rows_before_header(tmp_path):
+    path = make_report(tmp_path / 'report.xlsx', [])
+    grid = app.report_sheet_grid(path, SHEET)
+    # Пустая строка между договором и заголовком не останавливает чтение
+    assert len(grid) == 7 and grid.iloc[3, 0] == '№'
+
+@pytest.mark.parametrize('footer', [
+    [[None, 'Итого', None, 33, None, None, None, 49516.5]],
+    [['Итого', None, None, 33]],
+    [[], [None, 'Итого']],
+])
+def test_openpyxl_fallback_stops_at_totals_row(tmp_path, monkeypatch, footer):
+    path = make_report(tmp_path / 'report.xlsx', footer)
+    # Потоковое чтение не находит период - отчёт читается через openpyxl
+    monkeypatch.setattr(app, 'read_report_sheet', lambda *args, **kwargs: (None, None))
+    df, period = app.read_report(path, [SHEET])
+    assert period is not None and period[2]
+    assert df['№'].tolist() == ['1', '2', '3']
+    assert df['Гаражный номер ТС'].tolist() == ['100', '101', '102']
+
+def test_streaming_and_fallback_read_the_same_rows(tmp_path, monkeypatch):
+    path = make_report(tmp_path / 'report.xlsx', [[None, 'Итого', None, 33]])
+    streamed, _ = app.read_report(path, [SHEET])
+    monkeypatch.setattr(app, 'read_report_sheet', lambda *args, **kwargs: (None, None))
+    fallback, _ = app.read_report(path, [SHEET])
+    assert fallback['№'].tolist() == ['1', '2', '3']
+    assert streamed['Гаражный номер ТС'].tolist()[:3] == fallback['Гаражный номер ТС'].tolist()
+
+def reference_first_empty_row(df):
+    """Первая пустая строка по is_row_empty - построчно, как до блочного поиска"""
+    return next((i for i, row in enumerate(df.to_numpy(dtype=object)) if app.is_row_empty(row)), len(df))
+
+@pytest.mark.parametrize('rows', [
+    [],
+    [['a', 1]],
+    [[None, None]],
+    [['a', None], [None, ' '], ['b', 'c']],
+    [[None, '\xa0\t'], ['a', None]],
+    # NaN, NaT и 0 - не пустые значения
+    [[numpy.nan, None], [None, pd.NaT], [0, ''], ['', None]],
+    [['a', 'b']] * 5 + [[' ', None]] + [['c', 'd']],
+    [['a', 'b']] * 7,
+])
+@pytest.mark.parametrize('block_size', [2, 4096])
+def test_first_empty_row_matches_row_by_row(rows, block_size):
+    df = pd.DataFrame(rows, columns=['x', 'y'], dtype=object)
+    assert app.first_empty_row(df, block_size=block_size) == reference_first_empty_row(df)
+
+def test_first_empty_row_without_columns():
+    assert app.first_empty_row(pd.DataFrame(index=range(3))) == 0
+
+@pytest.mark.parametrize('values, has_data', [
+    ([], False),
+    ([numpy.nan, None], False),
+    (['', '  ', numpy.nan], False),
+    # Строка 'nan' - след str() от пропуска, а не данные
+    (['nan', ' nan '], False),
+    ([numpy.nan] * 5 + ['VIN0000001'], True),
+    (['', 0], True),
+    (['\xa0', 'x'], True),
+])
+@pytest.mark.parametrize('block_size', [2, 4096])
+def test_column_has_data(values, has_data, block_size):
+    assert app.column_has_data(pd.Series(values, dtype=object), block_size=block_size) == has_data
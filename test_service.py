@@ -0,0 +1,127 @@
+"""
+Служба сверки на localhost: одновременные запросы POST /reconcile с отчётами разных раскладок.
+
+Запуск:
+    python -m pytest -q test_service.py
+"""
+import importlib
+import io
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import synthetic_inputs
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+BRANCHES = [('ФСВ', 'Северо-Восточный'), ('ФСЗ', 'Северо-Западный')]
+VEHICLES = 30
+REQUESTS = 8
+
+def make_shifted_report(path, sheets, vehicles, year, month, seed):
+    """Отчёт другой раскладки: строка периода ниже, перед заголовком '№' - шапка договора из нескольких строк"""
+    reference = path.with_name('reference.xlsx')
+    synthetic_inputs.make_report_file(reference, sheets, vehicles, year, month, seed)
+    source = openpyxl.load_workbook(reference)
+    wb = openpyxl.Workbook(write_only=True)
+    for sheet in sheets:
+        rows = list(source[sheet].iter_rows(values_only=True))
+        ws = wb.create_sheet(sheet)
+        ws.append(['Приложение № 2'])
+        ws.append([])
+        ws.append(rows[0])
+        ws.append(['Договор № 1'])
+        ws.append(['Исполнитель: ООО'])
+        ws.append([])
+        for row in rows[3:]:
+            ws.append(row)
+    wb.save(path)
+
+@pytest.fixture(scope='module')
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('service')
+    mgt_paths = []
+    for i, (code, _) in enumerate(BRANCHES):
+        path = folder / f'МГТ_{code}.xlsx'
+        synthetic_inputs.make_mgt_file(path, code, VEHICLES, VEHICLES * 20, 2024, 3, i)
+        mgt_paths.append(path)
+    sheets = [sheet for _, sheet in BRANCHES]
+    reports = [folder / 'Отчет Вигитон.xlsx', folder / 'Отчет Антисон.xlsx']
+    synthetic_inputs.make_report_file(reports[0], sheets, VEHICLES, 2024, 3, 0)
+    make_shifted_report(reports[1], sheets, VEHICLES, 2024, 3, 1)
+    return mgt_paths, reports
+
+@pytest.fixture
+def server(inputs, monkeypatch):
+    monkeypatch.setattr(app, 'log_to_gui', lambda message: None)
+    # Раскладки отчётов узнаются заново во время одновременных запросов
+    app.REPORT_LAYOUTS.clear()
+    service = app.new_reconciliation_service(inputs[0], mgt_workers=1, use_cache=False)
+    server = app.ReconciliationServer(('127.0.0.1', 0), service, workers=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+def post_report(base_url, report_path):
+    request = urllib.request.Request(f'{base_url}/reconcile?name={urllib.parse.quote(report_path.name)}',
+                                     data=report_path.read_bytes(), method='POST')
+    with urllib.request.urlopen(request) as response:
+        return response.status, response.read()
+
+def read_result(payload):
+    with zipfile.ZipFile(io.BytesIO(payload)) as zf:
+        summary = json.loads(zf.read('run_summary.json'))
+        svod = pd.read_excel(io.BytesIO(zf.read(summary['outputs']['svod'])), dtype=str)
+    return summary, svod
+
+def test_concurrent_reconcile_with_different_layouts(server, inputs):
+    reports = inputs[1]
+    expected = [read_result(post_report(server, report)[1]) for report in reports]
+    for summary, svod in expected:
+        assert summary['status'] == 'ok'
+        assert summary['unmatched_report_rows'] < summary['report_rows']
+    # Раскладки листов - разные, строки данных - те же
+    assert expected[0][1].columns.tolist() == expected[1][1].columns.tolist()
+
+    app.REPORT_LAYOUTS.clear()
+    results = [None] * REQUESTS
+    errors = []
+
+    def worker(i):
+        try:
+            results[i] = post_report(server, reports[i % len(reports)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    for i, (status, payload) in enumerate(results):
+        assert status == 200
+        summary, svod = read_result(payload)
+        expected_summary, expected_svod = expected[i % len(reports)]
+        pd.testing.assert_frame_equal(svod, expected_svod)
+        assert summary['total_difference'] == expected_summary['total_difference']
+        assert summary['unmatched_report_rows'] == expected_summary['unmatched_report_rows']
+    assert len(app.REPORT_LAYOUTS) == len(reports)
+
+def test_status_and_bad_requests(server):
+    with urllib.request.urlopen(f'{server}/status') as response:
+        status = json.loads(response.read())
+    assert status['status'] == 'ok' and status['mgt_files'] == len(BRANCHES)
+    for path, data in (('/reconcile', b''), ('/unknown', b'x')):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(urllib.request.Request(f'{server}{path}?name=r.xlsx', data=data, method='POST'))
+        assert error.value.code in (400, 404)
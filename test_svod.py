@@ -0,0 +1,68 @@
+"""
+Потоковая запись листа Свод (write_svod_xlsx): книга читается openpyxl и совпадает с записью pd.ExcelWriter.
+
+Запуск:
+    python -m pytest -q test_svod.py
+"""
+import importlib
+from datetime import datetime
+
+import numpy
+import openpyxl
+import pandas as pd
+import pytest
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+def sheet_values(path):
+    wb = openpyxl.load_workbook(path)
+    try:
+        assert wb.sheetnames == ['Свод']
+        return [list(row) for row in wb['Свод'].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+def mixed_frame(rows=25):
+    """Столбцы всех видов, что встречаются в Своде: числа numpy, строки, пропуски, смешанные значения, даты"""
+    return pd.DataFrame({
+        '№': numpy.arange(1, rows + 1),
+        'Наименование услуги': [f'Услуга {i % 3}' if i % 5 else ' с пробелом ' for i in range(rows)],
+        'Количество ед.': [float(i) if i % 4 else numpy.nan for i in range(rows)],
+        'Гаражный номер ТС': [f'{100 + i:06d}' for i in range(rows)],
+        'VIN': [f'VIN{i:07d}' if i % 6 else None for i in range(rows)],
+        'Количество по МГТ': [str(i) if i % 2 else 0 for i in range(rows)],
+        'Цена': [1500.5, 0.1, 1e-7, -3, 2 ** 40] * (rows // 5),
+        'Смешанный': [1, 1.0, True, 'текст', datetime(2024, 3, 1, 12, 30)] * (rows // 5),
+        'Флаг': [bool(i % 2) for i in range(rows)],
+        'Филиал': 'Северо-Восточный',
+    })
+
+@pytest.mark.parametrize('chunk_rows', [7, 100000])
+def test_streamed_svod_matches_excel_writer(tmp_path, chunk_rows):
+    svod = mixed_frame()
+    streamed = tmp_path / 'streamed.xlsx'
+    reference = tmp_path / 'reference.xlsx'
+    app.write_svod_xlsx(streamed, svod, chunk_rows=chunk_rows)
+    with pd.ExcelWriter(reference) as writer:
+        svod.to_excel(writer, index=False, sheet_name='Свод')
+    values = sheet_values(streamed)
+    assert values == sheet_values(reference)
+    assert values[0] == list(svod.columns) and len(values) == len(svod) + 1
+    assert values[1][1] == ' с пробелом ' and values[2][2] == 1 and values[4][7] == 'текст'
+
+def test_streamed_svod_drops_illegal_characters(tmp_path):
+    # pd.ExcelWriter на такой строке падает, потоковая запись убирает управляющие символы
+    path = tmp_path / 'svod.xlsx'
+    app.write_svod_xlsx(path, pd.DataFrame({'Наименование услуги': ['Услуга\x07 1', '\x00', 'x']}))
+    # Строка только из управляющих символов - пустая ячейка, как пустая строка у pd.ExcelWriter
+    assert sheet_values(path) == [['Наименование услуги'], ['Услуга 1'], [None], ['x']]
+
+def test_empty_svod_has_header_only(tmp_path):
+    path = tmp_path / 'svod.xlsx'
+    app.write_svod_xlsx(path, mixed_frame().iloc[:0])
+    assert sheet_values(path) == [list(mixed_frame().columns)]
+
+def test_svod_too_large_for_sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'XLSX_MAX_ROWS', 10)
+    with pytest.raises(ValueError):
+        app.write_svod_xlsx(tmp_path / 'svod.xlsx', mixed_frame())
@@ -0,0 +1,113 @@
+"""
+Запись разницы с МГТ в копию отчёта правкой xml (write_back_xml): книга открывается openpyxl,
+цепочка вычислений удаляется, styles.xml правится и в записи с префиксом пространства имён.
+
+Запуск:
+    python -m pytest -q test_write_back.py
+"""
+import importlib
+import re
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+app = importlib.import_module('Сравнение_вигитон_антисон')
+
+SHEET = 'Северо-Восточный'
+CALC_CHAIN_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/calcChain'
+CALC_CHAIN_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml'
+
+def make_report(path):
+    """Лист отчёта из трёх строк; в K1 - формула, которую заменит общая сумма разницы"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    ws.append(['Отчет об оказанных услугах за период с 01 марта 2024 г. по 31 марта 2024 г.'])
+    ws['K1'] = '=SUM(D5:D7)'
+    ws.append(['Договор № 1'])
+    ws.append([])
+    ws.append(['№', 'Наименование услуги', 'Единица измерения', 'Количество ед.', 'Гаражный номер ТС',
+               'Государственный номер ТС', 'Цена 1 ед., руб.', 'Итого, руб.', 'VIN'])
+    for v in range(3):
+        ws.append([v + 1, 'Услуга', 'сутки', 10 + v, 100 + v, f'А{v:03d}АА', 1500.5, (10 + v) * 1500.5, f'VIN{v:07d}'])
+    wb.save(path)
+
+def rewrite_parts(path, rewrite):
+    """Переписывает части книги: rewrite(имя части, текст) возвращает новый текст"""
+    with zipfile.ZipFile(path) as zf:
+        parts = {info.filename: zf.read(info.filename) for info in zf.infolist()}
+    parts = rewrite(parts)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+def add_calc_chain(parts):
+    """Цепочка вычислений, как её сохраняет Excel: calcChain.xml, связь книги и тип содержимого"""
+    parts['xl/calcChain.xml'] = (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                                 b'<calcChain xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><c r="K1" i="1"/></calcChain>')
+    parts['xl/_rels/workbook.xml.rels'] = parts['xl/_rels/workbook.xml.rels'].replace(
+        b'</Relationships>', f'<Relationship Id="rIdCalc" Type="{CALC_CHAIN_TYPE}" Target="calcChain.xml"/></Relationships>'.encode())
+    parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace(
+        b'</Types>', f'<Override PartName="/xl/calcChain.xml" ContentType="{CALC_CHAIN_CONTENT_TYPE}"/></Types>'.encode())
+    return parts
+
+def prefixed_styles(xml):
+    """styles.xml с префиксом пространства имён у каждого элемента ('<x:cellXfs>')"""
+    xml = re.sub(r'<(/?)(\w+)([\s/>])', r'<\1x:\2\3', xml)
+    return xml.replace('xmlns=', 'xmlns:x=')
+
+def empty_cell_xfs(xml):
+    """styles.xml с пустым <cellXfs/>"""
+    return re.sub(r'<cellXfs\b.*?</cellXfs>', '<cellXfs count="0"/>', xml, flags=re.S)
+
+def checking_frame():
+    return pd.DataFrame({'№': ['1', '2', '3'], 'Разница в количестве с МГТ': [1, -2, 0],
+                         'Разница по сумме с МГТ': [1500.5, -3001.0, 0.0], 'Филиал': SHEET})
+
+@pytest.mark.parametrize('styles', [None, prefixed_styles, empty_cell_xfs])
+def test_patched_copy_opens_in_openpyxl(tmp_path, styles):
+    src, dst = tmp_path / 'report.xlsx', tmp_path / 'copy.xlsx'
+    make_report(src)
+
+    def rewrite(parts):
+        parts = add_calc_chain(parts)
+        if styles is not None:
+            parts['xl/styles.xml'] = styles(parts['xl/styles.xml'].decode('utf-8')).encode('utf-8')
+        return parts
+
+    rewrite_parts(src, rewrite)
+    processed_filials, messages, written = app.write_back_xml(src, dst, checking_frame(), 123.5)
+    assert written == {SHEET: 3}
+
+    with zipfile.ZipFile(dst) as zf:
+        names = zf.namelist()
+        rels = zf.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+        content_types = zf.read('[Content_Types].xml').decode('utf-8')
+        workbook = zf.read('xl/workbook.xml').decode('utf-8')
+    assert 'xl/calcChain.xml' not in names
+    assert 'calcChain' not in rels and 'calcChain' not in content_types
+    assert re.search(r'<calcPr\b[^>]*fullCalcOnLoad="1"', workbook)
+
+    wb = openpyxl.load_workbook(dst)
+    ws = wb[SHEET]
+    # Формула в K1 заменена общей суммой разницы
+    assert ws['K1'].value == 123.5
+    assert ws['J4'].value == 'Разница в количестве с МГТ'
+    assert [ws.cell(row=r, column=10).value for r in range(5, 8)] == ['1', '-2', '0']
+    assert [ws.cell(row=r, column=11).value for r in range(5, 8)] == [1500.5, -3001, 0]
+    for cell in (ws['J5'], ws['K7']):
+        assert cell.font.name == app.WRITE_BACK_FONT['name'] and cell.font.sz == app.WRITE_BACK_FONT['size']
+        assert cell.alignment.horizontal == 'center' and cell.alignment.vertical == 'center'
+    # Ячейки без записи сохраняют стиль по умолчанию
+    assert ws['B5'].font.name != app.WRITE_BACK_FONT['name']
+    wb.close()
+
+def test_book_without_calc_chain_keeps_workbook_xml(tmp_path):
+    src, dst = tmp_path / 'report.xlsx', tmp_path / 'copy.xlsx'
+    make_report(src)
+    app.write_back_xml(src, dst, checking_frame(), 123.5)
+    with zipfile.ZipFile(src) as before, zipfile.ZipFile(dst) as after:
+        for name in ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels', '[Content_Types].xml'):
+            assert before.read(name) == after.read(name)
@@ -4,23 +4,78 @@ import xml.etree.ElementTree as ET
 from pathlib import Path
 import pandas as pd
 import openpyxl
-import tkinter as tk
-from tkinter import Label, filedialog, scrolledtext, messagebox
 import threading
+import queue
+import multiprocessing
 import numpy
 import re
 from datetime import datetime
-#print(pd.__version__)
-import pandas as pd
-from datetime import datetime
 from openpyxl import load_workbook
 import shutil
-#import os
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import csv
+import codecs
+import cProfile
+import tracemalloc
+import hashlib
+import pickle
+import io
+import tempfile
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures.process import BrokenProcessPool
 from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
+from openpyxl.utils.datetime import from_excel, to_excel, from_ISO8601, WINDOWS_EPOCH, MAC_EPOCH
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE, ERROR_CODES
+from pandas.io.parsers import TextParser
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+# Необязательные модули для замера памяти процесса
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+# Необязательный модуль для записи Свода в Parquet
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
-contract_beg = datetime.now()
-
-contract_end = datetime.now()
+# Число процессов для чтения файлов МГТ: None - по числу ядер, 1 - последовательно
+MGT_WORKERS = None
+# Движок чтения xlsx: 'native' - zip + iterparse, 'openpyxl' - через openpyxl
+XLSX_ENGINE = 'native'
+# Файлы МГТ: книги xlsx и текстовые выгрузки (CSV/TSV) той же раскладки
+MGT_FILE_SUFFIXES = ('.xlsx', '.csv', '.tsv')
+# Кэш разобранных файлов МГТ: ключ - хэш содержимого файла и версия разбора
+MGT_CACHE_DIR = Path(os.environ.get('LOCALAPPDATA') or Path.home()) / 'mgt_cache'
+MGT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# Увеличивать при любом изменении разбора или агрегации файлов МГТ
+MGT_PARSER_VERSION = 2
+# Хранилище суточного использования ТС для сверки по периоду отчёта (--store)
+USAGE_STORE_PATH = Path(os.environ.get('LOCALAPPDATA') or Path.home()) / 'mgt_usage.sqlite'
+# Запись результатов в копию отчёта: 'xml' - правка только xml изменяемых листов, 'openpyxl' - через openpyxl
+WRITE_BACK_ENGINE = 'xml'
+# Запись листа Свод: 'xml' - потоковая запись xml листа блоками строк, 'openpyxl' - через pd.ExcelWriter
+SVOD_ENGINE = 'xml'
+# Форматы файла Свод: 'xlsx', 'csv' (разделитель ';', UTF-8 с BOM - открывается в Excel), 'parquet' (нужен pyarrow)
+SVOD_FORMATS = ('xlsx',)
+# Строк листа Свод в одном блоке потоковой записи
+SVOD_CHUNK_ROWS = 20000
+# Конвейер: отчёт (листы и модели листов для копии) читается в отдельных процессах одновременно с файлами МГТ
+REPORT_PREFETCH = True
 
 def is_row_empty(row):
     """
@@ -40,16 +95,67 @@ def is_row_empty(row):
             return False
     return True
 
+def _empty_cells_mask(values):
+    """Маска пустых ячеек по правилам is_row_empty: None или строка только из пробельных символов"""
+    empty = numpy.zeros(len(values), dtype=bool)
+    na = pd.isna(values)
+    if na.any():
+        # NaN/NaT считаются непустыми (как в is_row_empty), пустым считается только None
+        empty[na] = [value is None for value in values[na]]
+    rest = ~na
+    if rest.any():
+        values = values[rest]
+        is_str = numpy.array([isinstance(value, str) for value in values], dtype=bool)
+        stripped = numpy.char.strip(values[is_str].astype(str))
+        rest_empty = numpy.zeros(len(values), dtype=bool)
+        rest_empty[is_str] = stripped == ''
+        empty[rest] = rest_empty
+    return empty
+
+def first_empty_row(df, block_size=4096):
+    """
+    Позиция первой полностью пустой строки DataFrame (по правилам is_row_empty) или len(df).
+    Строки проверяются блоками сверху вниз, внутри блока - по столбцам: каждый следующий столбец
+    проверяется только для строк, оставшихся кандидатами. Поиск заканчивается на первом блоке с пустой строкой.
+    """
+    n_rows, n_cols = df.shape
+    if n_cols == 0:
+        return 0
+    columns = {}
+    for start in range(0, n_rows, block_size):
+        candidates = numpy.arange(start, min(start + block_size, n_rows))
+        for j in range(n_cols):
+            if j not in columns:
+                columns[j] = df.iloc[:, j].to_numpy(dtype=object)
+            candidates = candidates[_empty_cells_mask(columns[j][candidates])]
+            if not len(candidates):
+                break
+        if len(candidates):
+            return int(candidates[0])
+    return n_rows
+
+def column_has_data(column, block_size=4096):
+    """Есть ли в столбце значение, отличное от пустого, пробелов и 'nan'; проверка останавливается на первом найденном"""
+    values = column.to_numpy(dtype=object)
+    for start in range(0, len(values), block_size):
+        block = values[start:start + block_size]
+        block = block[~pd.isna(block)]
+        if not len(block):
+            continue
+        stripped = numpy.char.strip(block.astype(str))
+        if ((stripped != '') & (stripped != 'nan')).any():
+            return True
+    return False
+
 def clean_columns(df):
     new_columns = []
     rename_map = {}
     for i, col in enumerate(df.columns):
         # Определяем, является ли имя "пустым"
         is_empty_name = (pd.isna(col) or (isinstance(col, str) and 'Unnamed' in col.strip() ) )
-        # Проверяем, есть ли непустые данные в столбце
-        has_data = (not df[col].isnull().all() and not (df[col].astype(str).str.strip().replace('nan', '').eq('').all()))
         if is_empty_name:
-            if has_data:
+            # Проверяем, есть ли непустые данные в столбце (только для безымянных столбцов)
+            if column_has_data(df.iloc[:, i]):
                 # Столбец без имени, но с данными → переименовываем
                 new_name = "VIN"
                 new_columns.append(new_name)
@@ -176,6 +282,16 @@ def normalize_date(val):
         return val.strftime('%d.%m.%Y')    
     # По умолчанию — вернуть строку
     return str(val).strip()
+def normalize_dates(values):
+    """
+    normalize_date для целого столбца: каждое уникальное значение нормализуется один раз,
+    результат раскладывается обратно по кодам значений. Результат совпадает с .apply(normalize_date).
+    """
+    values = pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(values)
+    # Пустые значения (None/NaN) получают код -1, для них normalize_date возвращает ''
+    normalized = numpy.array([normalize_date(val) for val in uniques] + [''], dtype=object)
+    return pd.Series(normalized[codes], index=values.index, dtype=object)
 def extract_number_from_result(val):
     if pd.isna(val) or val == '':
         return 0
@@ -186,15 +302,276 @@ def extract_number_from_result(val):
     # Ищем первое число в строке (может быть отрицательным)
     else:
         return val
-def read_excel_as_strings(file_path, sheet_name=None):
+# === Быстрое чтение xlsx напрямую из zip (zipfile + ElementTree.iterparse) ===
+# Значения ячеек совпадают с openpyxl(data_only=True, read_only=True).iter_rows(values_only=True)
+
+# Ошибки, при которых быстрый движок уступает место openpyxl
+NATIVE_READER_ERRORS = (zipfile.BadZipFile, KeyError, IndexError, ValueError, ET.ParseError)
+
+REL_OFFICE_DOCUMENT = 'officeDocument'
+
+def _xml_local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _xlsx_rels_path(part_path):
+    """Путь к файлу связей части книги внутри zip"""
+    folder, name = part_path.rsplit('/', 1) if '/' in part_path else ('', part_path)
+    return f"{folder}/_rels/{name}.rels" if folder else f"_rels/{name}.rels"
+
+def _xlsx_rels(zf, part_path):
+    """Связи части книги: {Id: (тип, путь внутри zip)}"""
+    folder = part_path.rsplit('/', 1)[0] if '/' in part_path else ''
+    rels_path = _xlsx_rels_path(part_path)
+    rels = {}
+    if rels_path not in zf.namelist():
+        return rels
+    root = ET.fromstring(zf.read(rels_path))
+    for rel in root:
+        target = rel.get('Target', '')
+        if target.startswith('/'):
+            target = target[1:]
+        elif folder:
+            target = f"{folder}/{target}"
+        # Нормализуем '..' в относительных путях
+        parts = []
+        for part in target.split('/'):
+            if part == '..':
+                if parts:
+                    parts.pop()
+            elif part and part != '.':
+                parts.append(part)
+        rels[rel.get('Id')] = (rel.get('Type', '').rsplit('/', 1)[-1], '/'.join(parts))
+    return rels
+
+def _xlsx_workbook_path(zf):
+    for rel_type, target in _xlsx_rels(zf, '.rels').values():
+        if rel_type == REL_OFFICE_DOCUMENT:
+            return target
+    return 'xl/workbook.xml'
+
+def read_xlsx_metadata(zf):
+    """
+    Разбирает workbook.xml и связи книги.
+    Возвращает словарь: sheets - список (имя листа, путь к xml листа), active - индекс активного листа,
+    epoch - эпоха дат, workbook - путь к workbook.xml, shared_strings / styles / calc_chain - пути к частям книги (или None).
+    """
+    workbook_path = _xlsx_workbook_path(zf)
+    rels = _xlsx_rels(zf, workbook_path)
+    root = ET.fromstring(zf.read(workbook_path))
+    sheets = []
+    active = 0
+    date1904 = False
+    for el in root.iter():
+        name = _xml_local_name(el.tag)
+        if name == 'sheet':
+            # Атрибут r:id (пространство имен отличается в strict-формате)
+            rel_id = next((value for key, value in el.attrib.items() if key.endswith('}id')), None)
+            rel = rels.get(rel_id)
+            sheets.append((el.get('name'), rel[1] if rel else None))
+        elif name == 'workbookView':
+            active = int(el.get('activeTab', 0) or 0)
+        elif name == 'workbookPr':
+            date1904 = el.get('date1904') in ('1', 'true')
+    parts = {rel_type: target for rel_type, target in rels.values()}
+    return {
+        'sheets': sheets,
+        'active': active if active < len(sheets) else 0,
+        'epoch': MAC_EPOCH if date1904 else WINDOWS_EPOCH,
+        'workbook': workbook_path,
+        'shared_strings': parts.get('sharedStrings'),
+        'styles': parts.get('styles'),
+        'calc_chain': parts.get('calcChain'),
+    }
+
+def read_xlsx_shared_strings(zf, path):
+    """Таблица общих строк в виде списка (индекс -> строка), элементы очищаются по ходу разбора"""
+    strings = []
+    if not path or path not in zf.namelist():
+        return strings
+    with zf.open(path) as src:
+        for _, el in ET.iterparse(src):
+            if _xml_local_name(el.tag) == 'si':
+                # Текст ячейки: <t> напрямую и <t> внутри <r>; фонетика (<rPh>) не учитывается
+                snippets = []
+                for child in el:
+                    child_name = _xml_local_name(child.tag)
+                    if child_name == 't':
+                        snippets.append(child.text or '')
+                    elif child_name == 'r':
+                        for t in child:
+                            if _xml_local_name(t.tag) == 't':
+                                snippets.append(t.text or '')
+                strings.append(''.join(snippets).replace('x005F_', ''))
+                el.clear()
+    return strings
+
+def read_xlsx_date_styles(zf, path):
+    """Индексы стилей ячеек (cellXfs), которые openpyxl считает датами и интервалами времени"""
+    date_styles, timedelta_styles = set(), set()
+    if not path or path not in zf.namelist():
+        return date_styles, timedelta_styles
+    root = ET.fromstring(zf.read(path))
+    custom = {}
+    cell_xfs = None
+    for el in root:
+        name = _xml_local_name(el.tag)
+        if name == 'numFmts':
+            for fmt in el:
+                custom[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+        elif name == 'cellXfs':
+            cell_xfs = el
+    if cell_xfs is None:
+        return date_styles, timedelta_styles
+    for idx, xf in enumerate(cell_xfs):
+        num_fmt_id = int(xf.get('numFmtId', 0) or 0)
+        fmt = custom[num_fmt_id] if num_fmt_id in custom else builtin_format_code(num_fmt_id)
+        if is_date_format(fmt):
+            date_styles.add(idx)
+        if is_timedelta_format(fmt):
+            timedelta_styles.add(idx)
+    return date_styles, timedelta_styles
+
+def _cast_xlsx_number(value):
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+def _xlsx_inline_string(el, text_tag):
+    return ''.join(t.text or '' for t in el.iter(text_tag))
+
+def iter_xlsx_rows(file_path, sheet_name=None, skip_row=None):
+    """
+    Построчно читает лист xlsx через iterparse без openpyxl.
+    Возвращает кортежи значений строк (как iter_rows(values_only=True) в режиме read_only):
+    пропущенные строки отдаются пустыми, ширина строк выравнивается по <dimension>.
+    sheet_name=None - активный лист.
+    skip_row(значение ячейки A) - если истинно, остальные ячейки строки не разбираются,
+    а строка отдаётся кортежем из одного этого значения.
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        meta = read_xlsx_metadata(zf)
+        if sheet_name is None:
+            sheet_path = meta['sheets'][meta['active']][1]
+        else:
+            sheet_path = dict(meta['sheets'])[sheet_name]
+        if not sheet_path:
+            raise KeyError(f"Не найден xml листа {sheet_name or meta['active']}")
+        shared_strings = read_xlsx_shared_strings(zf, meta['shared_strings'])
+        date_styles, timedelta_styles = read_xlsx_date_styles(zf, meta['styles'])
+        epoch = meta['epoch']
+        max_col = max_row = None
+        empty_row = ()
+        row_counter = 0
+        counter = 1
+        sheet_data = None
+        ns = None
+        column_cache = {}
+        with zf.open(sheet_path) as src:
+            for event, el in ET.iterparse(src, events=('start', 'end')):
+                tag = el.tag
+                if event == 'start':
+                    if ns is None:
+                        # Пространство имен берем из корневого элемента (обычное или strict)
+                        ns = tag[:tag.index('}') + 1] if '}' in tag else ''
+                        row_tag, cell_tag, value_tag, inline_tag, text_tag = ns + 'row', ns + 'c', ns + 'v', ns + 'is', ns + 't'
+                        dimension_tag, sheet_data_tag = ns + 'dimension', ns + 'sheetData'
+                    elif tag == sheet_data_tag:
+                        sheet_data = el
+                    continue
+                if tag == dimension_tag:
+                    _, _, max_col, max_row = range_boundaries(el.get('ref'))
+                    if max_col is not None:
+                        empty_row = (None,) * max_col
+                elif tag == row_tag:
+                    r = el.get('r')
+                    row_counter = int(float(r)) if r else row_counter + 1
+                    # Строки за пределами <dimension> openpyxl не отдает
+                    if max_row is not None and row_counter > max_row:
+                        break
+                    values = {}
+                    col_counter = 0
+                    skipped = False
+                    for c in el.iterfind(cell_tag):
+                        coordinate = c.get('r')
+                        if coordinate:
+                            letters = coordinate.rstrip('0123456789')
+                            col_counter = column_cache.get(letters)
+                            if col_counter is None:
+                                col_counter = column_cache[letters] = column_index_from_string(letters)
+                        else:
+                            col_counter += 1
+                        data_type = c.get('t', 'n')
+                        if data_type == 'inlineStr':
+                            child = c.find(inline_tag)
+                            value = _xlsx_inline_string(child, text_tag) if child is not None else None
+                        else:
+                            value = c.findtext(value_tag) or None
+                            if value is not None:
+                                if data_type == 'n':
+                                    value = _cast_xlsx_number(value)
+                                    style_id = c.get('s')
+                                    if style_id and int(style_id) in date_styles:
+                                        try:
+                                            value = from_excel(value, epoch, timedelta=int(style_id) in timedelta_styles)
+                                        except (OverflowError, ValueError):
+                                            value = '#VALUE!'
+                                elif data_type == 's':
+                                    value = shared_strings[int(value)]
+                                elif data_type == 'b':
+                                    value = bool(int(value))
+                                elif data_type == 'd':
+                                    value = from_ISO8601(value)
+                        values[col_counter] = value
+                        if col_counter == 1 and skip_row is not None and skip_row(value):
+                            skipped = True
+                            break
+                    # Пропущенные строки отдаем пустыми
+                    while counter < row_counter:
+                        counter += 1
+                        yield empty_row
+                    if skipped and counter <= row_counter:
+                        counter += 1
+                        yield (values[1],)
+                    elif counter <= row_counter:
+                        counter += 1
+                        width = max_col or (max(values) if values else 0)
+                        row = [None] * width
+                        for col, value in values.items():
+                            if col <= width:
+                                row[col - 1] = value
+                        yield tuple(row)
+                    if sheet_data is not None:
+                        sheet_data.clear()
+        if max_row is not None and max_row < row_counter:
+            while counter <= max_row:
+                counter += 1
+                yield empty_row
+
+def read_excel_as_strings(file_path, sheet_name=None, engine=None):
+    """
+    engine='native' - быстрое чтение через zip/iterparse, engine='openpyxl' - через openpyxl.
+    По умолчанию используется XLSX_ENGINE; при ошибке быстрого чтения - openpyxl.
+    """
+    engine = engine or XLSX_ENGINE
+    if engine == 'native':
+        try:
+            return _rows_as_strings_frame(iter_xlsx_rows(file_path, sheet_name))
+        except NATIVE_READER_ERRORS:
+            pass
     from openpyxl import load_workbook
     wb = load_workbook(file_path, data_only=True, read_only=True)
     if sheet_name is None:
         ws = wb.active
     else:
         ws = wb[sheet_name]
+    try:
+        return _rows_as_strings_frame(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+def _rows_as_strings_frame(rows):
     data = []
-    for row in ws.iter_rows(values_only=True):
+    for row in rows:
         # Проверка на полностью пустую строку
         if all(cell is None or (isinstance(cell, str) and not cell.strip()) for cell in row):
             if data: # если уже есть данные — останавливаемся
@@ -220,7 +597,6 @@ def read_excel_as_strings(file_path, sheet_name=None):
             else:
                 cleaned_row.append(str(cell))
         data.append(cleaned_row)
-    wb.close()
     if not data:
         return pd.DataFrame()
     headers = data[0]
@@ -234,49 +610,1536 @@ def read_excel_as_strings(file_path, sheet_name=None):
 RU_MONTHS = {'января': '01','февраля': '02','марта': '03','апреля': '04','мая': '05','июня': '06','июля': '07','августа': '08','сентября': '09','октября': '10','ноября': '11','декабря': '12'}
 short_names = {'ФСВ':'Северо-Восточный','ФСЗ':'Северо-Западный','ФЮ':'Южный','СВ':'Северо-Восточный','СЗ':'Северо-Западный', 'Северо-восточный':'Северо-Восточный','Северо-западный':'Северо-Западный', 'северо-восточный':'Северо-Восточный','северо-западный':'Северо-Западный','южный':'Южный'}
 
+DATE_PATTERN = r'\b\d{1,2}\.\d{1,2}\.\d{4}\b'
+DATE_RE = re.compile(DATE_PATTERN, re.IGNORECASE)
+
+def is_mgt_date_value(value):
+    """Значение первого столбца строки МГТ с данными: ровно одна дата формата ДД.ММ.ГГГГ"""
+    return isinstance(value, str) and '.' in value and len(DATE_RE.findall(value)) == 1
+
+def is_mgt_date_row(row):
+    return bool(row) and is_mgt_date_value(row[0])
+
+def is_mgt_row_empty(row):
+    return all(cell is None or (isinstance(cell, str) and cell.strip() == '') for cell in row)
+
+def mgt_value_date(value):
+    """Дата из значения первого столбца строки МГТ ('ДД.ММ.ГГГГ' внутри строки) или None"""
+    match = DATE_RE.search(value) if isinstance(value, str) else None
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(), '%d.%m.%Y')
+    except ValueError:
+        return None
+
+def mgt_date_in_period(value, period):
+    """Строка МГТ с датой value входит в период (начало, конец) включительно; строки с неразобранной датой не отбрасываются"""
+    date = mgt_value_date(value)
+    return date is None or period[0] <= date <= period[1]
+
+def mgt_header_period(text):
+    """Период файла МГТ из ячейки C2 ('Период: с ДД.ММ.ГГГГ по ДД.ММ.ГГГГ'): (начало, конец) или None"""
+    if not isinstance(text, str):
+        return None
+    dates = [mgt_value_date(match) for match in DATE_RE.findall(text)]
+    dates = [date for date in dates if date is not None]
+    if len(dates) < 2:
+        return None
+    return min(dates), max(dates)
+
+def mgt_period_overlaps(period_display, period):
+    """Период файла МГТ (текст C2) пересекается с периодом (начало, конец); файл без разобранного периода считается пересекающимся"""
+    header = mgt_header_period(period_display)
+    return header is None or (header[0] <= period[1] and header[1] >= period[0])
+
+def iter_sheet_rows(file_path, sheet_name=None, engine=None, skip_row=None):
+    """
+    Строки листа как кортежи значений. engine: 'native' или 'openpyxl' (по умолчанию XLSX_ENGINE).
+    skip_row - см. iter_xlsx_rows; openpyxl всегда отдаёт строки целиком.
+    """
+    if (engine or XLSX_ENGINE) == 'native':
+        yield from iter_xlsx_rows(file_path, sheet_name, skip_row)
+        return
+    wb = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
+    try:
+        ws = wb.active if sheet_name is None else wb[sheet_name]
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def xlsx_sheet_names(file_path, engine=None):
+    """Имена листов книги по порядку без чтения листов: 'native' - из workbook.xml, 'openpyxl' - через read_only"""
+    if (engine or XLSX_ENGINE) == 'native':
+        with zipfile.ZipFile(file_path) as zf:
+            return [name for name, _ in read_xlsx_metadata(zf)['sheets']]
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+# === Текстовые выгрузки МГТ (CSV/TSV) ===
+# Выгрузка читается потоково и отдаётся строками в раскладке листа МГТ (период - C2, организация - C3,
+# затем заголовок 'Дата' и строки данных), поэтому дальше работает тот же разбор, что и для xlsx.
+
+# Строк в начале выгрузки, среди которых ищется заголовок 'Дата'
+MGT_TEXT_HEADER_ROWS = 30
+# Начало файла для определения кодировки и разделителя
+MGT_TEXT_SAMPLE_BYTES = 64 * 1024
+MGT_TEXT_DELIMITERS = (';', '\t', ',')
+DECIMAL_COMMA_RE = re.compile(r'-?\d+,\d+')
+
+def is_mgt_file(path):
+    return Path(path).suffix.lower() in MGT_FILE_SUFFIXES
+
+def is_mgt_text_file(path):
+    return Path(path).suffix.lower() in ('.csv', '.tsv')
+
+def detect_text_encoding(sample):
+    """Кодировка выгрузки по её началу: UTF-8 (с BOM или без), иначе cp1251"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Обрезанный на границе выборки символ ошибкой не считается
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'cp1251'
+    return 'utf-8'
+
+def detect_text_delimiter(text):
+    """Разделитель из MGT_TEXT_DELIMITERS, чаще всех встречающийся в строке заголовка ('Дата') или в первой непустой строке"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return MGT_TEXT_DELIMITERS[0]
+    line = next((line for line in lines if 'Дата' in line), lines[0])
+    return max(MGT_TEXT_DELIMITERS, key=line.count)
+
+def mgt_text_file_metadata(file_path):
+    """
+    Период и организация из имени выгрузки, например 'МГТ_ФСВ_01.03.2024-31.03.2024.csv':
+    даты ДД.ММ.ГГГГ и код или имя филиала из short_names. Возвращает (текст периода или None, текст организации или '').
+    """
+    stem = Path(file_path).stem
+    # '_' для \b - часть слова, поэтому даты ищем в имени с пробелами вместо '_'
+    dates = DATE_RE.findall(stem.replace('_', ' '))
+    period = f"Период: с {dates[0]} по {dates[-1]}" if dates else None
+    # Имя филиала - отдельным словом: соседние символы не буквы и не цифры ('_' - разделитель)
+    filial = next((key for key in sorted(short_names, key=len, reverse=True)
+                   if re.search(rf'(?<![^\W_]){re.escape(key)}(?![^\W_])', stem)), '')
+    return period, f"Организация: {filial}" if filial else ''
+
+def _mgt_text_cell(value):
+    if value == '':
+        return None
+    if DECIMAL_COMMA_RE.fullmatch(value):
+        return value.replace(',', '.')
+    return value
+
+def iter_mgt_text_rows(file_path):
+    """
+    Строки текстовой выгрузки МГТ в раскладке листа МГТ (см. выше). Кодировка (UTF-8/cp1251) и разделитель
+    определяются по началу файла, для .tsv разделитель - табуляция. Период и организация берутся из строк
+    над заголовком 'Дата' (ячейки с 'Период' и 'Организация'), иначе из имени файла (mgt_text_file_metadata).
+    Если заголовка 'Дата' в первых MGT_TEXT_HEADER_ROWS строках нет, строки отдаются как есть.
+    Пустые ячейки - None, десятичная запятая в числах заменяется точкой.
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(MGT_TEXT_SAMPLE_BYTES)
+    encoding = detect_text_encoding(sample)
+    with open(file_path, encoding=encoding, newline='') as f:
+        if Path(file_path).suffix.lower() == '.tsv':
+            delimiter = '\t'
+        else:
+            delimiter = detect_text_delimiter(f.read(MGT_TEXT_SAMPLE_BYTES))
+            f.seek(0)
+        reader = csv.reader(f, delimiter=delimiter)
+        head = []
+        for row in reader:
+            head.append(tuple(_mgt_text_cell(value) for value in row))
+            if 'Дата' in head[-1] or len(head) >= MGT_TEXT_HEADER_ROWS:
+                break
+        if head and 'Дата' in head[-1]:
+            period, filial = mgt_text_file_metadata(file_path)
+            block = [value for row in head[:-1] for value in row if isinstance(value, str)]
+            period = next((value for value in block if 'период' in value.lower()), period)
+            filial = next((value for value in block if 'организация' in value.lower()), filial)
+            head = [(), (None, None, period), (None, None, filial), (), head[-1]]
+        yield from head
+        for row in reader:
+            yield tuple(_mgt_text_cell(value) for value in row)
+
+def _mgt_columns_frame(headers, columns, row_count):
+    """DataFrame из массивов столбцов (без промежуточного списка строк)"""
+    if not (row_count and headers):
+        return pd.DataFrame()
+    df = pd.DataFrame(dict(enumerate(columns)))
+    df.columns = headers
+    return df
+
+def mgt_column_roles(headers):
+    """Назначение столбцов файла МГТ по заголовкам: {заголовок: 'Дата'/'Гаражный номер ТС'/'VIN'/'Номер'/'Часы'/'Пробег'}"""
+    col_map = {}
+    for col in headers:
+        col_str = str(col).strip().lower()
+        if 'часы' in col_str or 'длительн' in col_str :
+            col_map[col] = 'Часы'
+        if 'гар.' in col_str or  'гаражн' in col_str:
+            col_map[col] = 'Гаражный номер ТС'
+        if 'vin' in col_str:
+            col_map[col] = 'VIN'
+        if 'пробег' in col_str or 'длин' in col_str:
+            col_map[col] = 'Пробег'
+        if 'дата' == col_str:
+            col_map[col] = 'Дата'
+        if 'номер' == col_str:
+            col_map[col] = 'Номер'
+    return col_map
+
+# === Раскладки листов ===
+# Выгрузки филиалов приходят в нескольких постоянных раскладках. Разбор блока заголовка (строка заголовка,
+# сохраняемые столбцы, назначение столбцов) кэшируется по отпечатку раскладки - номеру строки заголовка
+# и её значениям, - и следующие файлы той же раскладки его не повторяют. Кэш свой в каждом процессе.
+# Кэши общие для потоков процесса (предварительное чтение отчёта, служба сверки): запись - под LAYOUTS_LOCK,
+# перебор - по снимку.
+MGT_LAYOUTS = {}
+# Раскладки листов отчёта: (строка заголовка '№', её значения) -> строка периода
+REPORT_LAYOUTS = {}
+LAYOUTS_LOCK = threading.Lock()
+
+def mgt_sheet_layout(header_row, row):
+    """Раскладка листа МГТ с заголовком row в строке header_row: (сохраняемые столбцы, заголовки, назначение столбцов)"""
+    fingerprint = (header_row, tuple(row))
+    layout = MGT_LAYOUTS.get(fingerprint)
+    if layout is None:
+        keep_columns = [i for i, value in enumerate(row) if value is not None]
+        headers = [row[i] for i in keep_columns]
+        layout = (keep_columns, headers, mgt_column_roles(headers))
+        with LAYOUTS_LOCK:
+            MGT_LAYOUTS[fingerprint] = layout
+    return layout
+
+# Ключ свёртки строк МГТ при чтении и суммируемые столбцы
+MGT_AGGREGATE_KEYS = ('Дата', 'Гаражный номер ТС', 'VIN')
+MGT_AGGREGATE_SUMS = ('Часы', 'Пробег')
+
+def _mgt_columns_sink(keep_columns, headers, roles=None):
+    """Приёмник строк с датами: значения столбцов keep_columns копятся в массивах"""
+    columns = [[] for _ in keep_columns]
+
+    def add(row):
+        width = len(row)
+        for column, i in zip(columns, keep_columns):
+            column.append(row[i] if i < width else None)
+
+    def build(row_count):
+        return _mgt_columns_frame(headers, columns, row_count)
+    return add, build
+
+def _mgt_number(value, cache):
+    """Значение ячейки как число по правилам pd.to_numeric(errors='coerce'); разбор строк кэшируется"""
+    if type(value) is float or type(value) is int:
+        return float(value)
+    if value is None:
+        return numpy.nan
+    number = cache.get(value)
+    if number is None:
+        number = cache[value] = float(pd.to_numeric(pd.Series([value], dtype=object), errors='coerce').iat[0])
+    return number
+
+def _mgt_aggregate_sink(keep_columns, headers, roles=None):
+    """
+    Приёмник строк с датами со свёрткой при чтении: строка сразу добавляется к суммам часов и пробега
+    своего ключа (Дата, Гаражный номер ТС, VIN) в исходных значениях ячеек. Память - по числу ТС x дней,
+    а не по числу строк. build возвращает DataFrame с теми же заголовками, что и без свёртки, - одна строка
+    на ключ, поэтому дальнейшая агрегация в process_mgt_file даёт тот же результат.
+    roles - назначение столбцов из раскладки листа (mgt_sheet_layout), по умолчанию определяется по заголовкам.
+    Возвращает None, если столбцы ключа и сумм не определяются однозначно.
+    """
+    if roles is None:
+        roles = mgt_column_roles(headers)
+    positions = {}
+    for i, header in zip(keep_columns, headers):
+        if header in roles:
+            positions.setdefault(roles[header], []).append((i, header))
+    if any(len(positions.get(role, ())) != 1 for role in MGT_AGGREGATE_KEYS + MGT_AGGREGATE_SUMS):
+        return None
+    key_columns = [positions[role][0][0] for role in MGT_AGGREGATE_KEYS]
+    hours_column, mileage_column = (positions[role][0][0] for role in MGT_AGGREGATE_SUMS)
+    # Суммы с компенсацией (Кэхэн), как в groupby().sum(): [часы, поправка, пробег, поправка]
+    sums = {}
+    numbers = {}
+    nan = numpy.nan
+
+    def add(row):
+        width = len(row)
+        key = tuple(row[i] if i < width else None for i in key_columns)
+        acc = sums.get(key)
+        if acc is None:
+            acc = sums[key] = [0.0, 0.0, 0.0, 0.0]
+        for value, j in ((row[hours_column] if hours_column < width else None, 0),
+                         (row[mileage_column] if mileage_column < width else None, 2)):
+            value = _mgt_number(value, numbers)
+            if value == value:
+                y = value - acc[j + 1]
+                t = acc[j] + y
+                acc[j + 1] = t - acc[j] - y
+                acc[j] = t
+
+    def build(row_count):
+        if not (row_count and sums):
+            return pd.DataFrame()
+        keys = list(sums)
+        data = {positions[role][0][1]: [key[k] for key in keys] for k, role in enumerate(MGT_AGGREGATE_KEYS)}
+        totals = list(sums.values())
+        for role, j in zip(MGT_AGGREGATE_SUMS, (0, 2)):
+            data[positions[role][0][1]] = numpy.fromiter((acc[j] for acc in totals), dtype=float, count=len(totals))
+        return pd.DataFrame(data)
+    return add, build
+
+def read_mgt_workbook(file_path, streaming=True, engine=None):
+    """
+    Читает лист файла МГТ.
+    Возвращает (значение C3, значение C2, DataFrame строк с датами).
+    streaming=True - один проход по листу без загрузки книги целиком;
+    engine - движок чтения ('native' или 'openpyxl' в режиме read_only), по умолчанию XLSX_ENGINE.
+    streaming=False - прежний режим с полной загрузкой книги через openpyxl.
+    """
+    if not streaming:
+        return _read_mgt_workbook_full(file_path)
+    filial, period_display, df, _, _ = _scan_mgt_sheet(file_path, engine, _mgt_columns_sink)
+    return filial, period_display, df
+
+def aggregate_mgt_workbook(file_path, engine=None, period=None):
+    """
+    Читает лист файла МГТ со свёрткой строк при чтении (_mgt_aggregate_sink): память не зависит от числа строк.
+    period=(начало, конец) - строки с датами вне периода отбрасываются при чтении, а файл, период которого
+    в C2 не пересекается с period, дальше строки 3 не читается.
+    Возвращает (значение C3, значение C2, DataFrame сумм часов и пробега по (Дата, Гаражный номер ТС, VIN),
+    число прочитанных строк с датами, число отброшенных строк вне периода).
+    Если столбцы не распознаны, строки копятся целиком, как в read_mgt_workbook.
+    """
+    def make_sink(keep_columns, headers, roles=None):
+        return _mgt_aggregate_sink(keep_columns, headers, roles) or _mgt_columns_sink(keep_columns, headers)
+    return _scan_mgt_sheet(file_path, engine, make_sink, period)
+
+def _scan_mgt_sheet(file_path, engine, make_sink, period=None):
+    """
+    Один проход по листу МГТ или текстовой выгрузке (iter_mgt_text_rows). make_sink(индексы столбцов, заголовки[,
+    назначение столбцов]) создаёт приёмник строк с датами (add, build); раскладка заголовка берётся из кэша MGT_LAYOUTS.
+    period=(начало, конец) - фильтр строк и файла по периоду (см. aggregate_mgt_workbook).
+    Возвращает (значение C3, значение C2, DataFrame, число строк с датами, число строк вне периода).
+    """
+    filial = None
+    period_display = None
+    sink = None
+    row_count = 0
+    # Если строки с 'Дата' нет, заголовком считается 2-я строка (как в полном режиме),
+    # поэтому параллельно копим данные и для этого случая, пока заголовок не найден
+    fallback_sink = None
+    fallback_count = 0
+    fallback_active = True
+    # Проверка первого столбца выполняется один раз на каждое уникальное значение
+    # (в месячном файле это ~31 дата и названия ТС), дальше - поиск в словаре
+    date_values = {}
+    # Даты вне периода: проверяются так же один раз на значение
+    outside = set()
+    skipped = 0
+
+    def is_outside(value):
+        # Строка с датой вне периода: остальные её ячейки нативный читатель не разбирает
+        if not isinstance(value, str):
+            return False
+        if value not in date_values:
+            is_date = date_values[value] = is_mgt_date_value(value)
+            if is_date and not mgt_date_in_period(value, period):
+                outside.add(value)
+        return value in outside
+
+    if is_mgt_text_file(file_path):
+        rows = iter_mgt_text_rows(file_path)
+    else:
+        rows = iter_sheet_rows(file_path, engine=engine, skip_row=is_outside if period is not None else None)
+    try:
+        for row_idx, row in enumerate(rows, start=1):
+            if row_idx == 2:
+                period_display = row[2] if len(row) > 2 else None
+                fallback_columns = [i for i, value in enumerate(row) if value is not None]
+                fallback_sink = make_sink(fallback_columns, [row[i] for i in fallback_columns])
+            elif row_idx == 3:
+                filial = row[2] if len(row) > 2 else None
+                if period is not None and not mgt_period_overlaps(period_display, period):
+                    break
+            first = row[0] if row else None
+            is_date = False
+            if isinstance(first, str):
+                is_date = date_values.get(first)
+                if is_date is None:
+                    is_date = date_values[first] = is_mgt_date_value(first)
+                    if is_date and period is not None and not mgt_date_in_period(first, period):
+                        outside.add(first)
+                if is_date and outside and first in outside:
+                    skipped += 1
+                    continue
+            if sink is None:
+                if 'Дата' in row:
+                    sink = make_sink(*mgt_sheet_layout(row_idx, row))
+                    fallback_active = False
+                    fallback_sink = None
+                elif fallback_active and row_idx > 2:
+                    if is_date:
+                        fallback_sink[0](row)
+                        fallback_count += 1
+                    elif is_mgt_row_empty(row):
+                        fallback_active = False
+                continue
+            # Фильтр: только строки с датой в первом столбце, берем только столбцы без None в заголовке.
+            # Строка с датой не бывает пустой, поэтому проверка на пустоту нужна только для остальных
+            if is_date:
+                sink[0](row)
+                row_count += 1
+            # Прерываем чтение при первой полностью пустой строке
+            elif is_mgt_row_empty(row):
+                break
+    finally:
+        rows.close()
+    if sink is None:
+        if fallback_sink is None:
+            return filial, period_display, pd.DataFrame(), 0, skipped
+        return filial, period_display, fallback_sink[1](fallback_count), fallback_count, skipped
+    return filial, period_display, sink[1](row_count), row_count, skipped
+
+def _read_mgt_workbook_full(file_path):
+    wb = openpyxl.load_workbook(file_path, data_only=True, read_only=False)
+    try:
+        ws = wb.active
+        filial = ws.cell(row = 3, column = 3).value
+        period_display = ws.cell(row = 2, column = 3).value
+        header_row = 0
+        for row_idx, row in enumerate(ws.iter_rows(), start=header_row-1):
+            row_data = [cell.value for cell in row]
+            if 'Дата' in row_data:
+                header_row = row_idx
+                break
+        # Коррекция: реальный номер строки = header_row + 2 (из-за start=header_row-1 при header_row=0)
+        real_header_row = header_row + 2
+        # Читаем строку заголовка и определяем столбцы БЕЗ None (столбцы с объединенными ячейками имеют None)
+        header_cells = ws[real_header_row]
+        keep_columns = [i for i, cell in enumerate(header_cells) if cell.value is not None]
+        headers = [header_cells[i].value for i in keep_columns]
+        data = []
+        for row in ws.iter_rows(min_row=real_header_row+1, values_only=True):
+            if is_mgt_row_empty(row):
+                break
+            if is_mgt_date_row(row):
+                data.append([row[i] if i < len(row) else None for i in keep_columns])
+    finally:
+        wb.close()
+    if data and headers:
+        return filial, period_display, pd.DataFrame(data, columns=headers)
+    return filial, period_display, pd.DataFrame()
+
+# === Замеры этапов: время, процессорное время, строки, пик памяти ===
+# Профиль - словарь со списком замеров spans; замер начинается profile_start и завершается profile_stop.
+# Вложенность замеров (этап -> файл) хранится в поле depth.
+
+PROFILE_FIELDS = ('name', 'depth', 'wall', 'cpu', 'rows', 'peak_rss', 'traced_peak')
+
+def peak_rss_bytes():
+    """Пиковый объём памяти процесса в байтах или None, если его не узнать"""
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', None) or info.rss
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт килобайты, macOS - байты
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                                                      'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                                                      'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+def new_profile(trace_memory=False, cprofile_stage=None, cprofile_path=None):
+    """
+    trace_memory=True - пик выделенной Python-памяти по этапам через tracemalloc (замедляет работу).
+    cprofile_stage / cprofile_path - снять cProfile этапа с этим именем в файл .prof.
+    """
+    return {'spans': [], 'stack': [], 'trace_memory': trace_memory, 'cprofile_stage': cprofile_stage, 'cprofile_path': cprofile_path}
+
+def profile_start(profile, name):
+    record = {'name': name, 'depth': len(profile['stack']), 'wall': 0.0, 'cpu': 0.0, 'rows': None, 'peak_rss': None, 'traced_peak': None}
+    profile['spans'].append(record)
+    state = {'record': record, 'wall': time.perf_counter(), 'cpu': time.process_time(), 'child_peak': 0, 'cprofile': None}
+    if tracemalloc.is_tracing():
+        state['traced'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    if name == profile['cprofile_stage'] and profile['cprofile_path']:
+        state['cprofile'] = cProfile.Profile()
+        state['cprofile'].enable()
+    profile['stack'].append(state)
+    return record
+
+def profile_stop(profile, rows=None):
+    """Завершает последний начатый замер; rows - число обработанных строк"""
+    state = profile['stack'].pop()
+    record = state['record']
+    if state['cprofile'] is not None:
+        state['cprofile'].disable()
+        state['cprofile'].dump_stats(profile['cprofile_path'])
+    record['wall'] = round(time.perf_counter() - state['wall'], 4)
+    record['cpu'] = round(time.process_time() - state['cpu'], 4)
+    record['rows'] = rows
+    record['peak_rss'] = peak_rss_bytes()
+    if 'traced' in state and tracemalloc.is_tracing():
+        # reset_peak во вложенных замерах сбрасывает общий пик, поэтому пики вложенных замеров поднимаются наверх
+        peak = max(tracemalloc.get_traced_memory()[1], state['child_peak'])
+        record['traced_peak'] = peak - state['traced']
+        if profile['stack']:
+            parent = profile['stack'][-1]
+            parent['child_peak'] = max(parent['child_peak'], peak)
+    return record
+
+def profile_add(profile, name, stats):
+    """Готовый замер (например, из процесса пула) как вложенный в текущий"""
+    record = {field: None for field in PROFILE_FIELDS}
+    record.update(stats, name=name, depth=len(profile['stack']))
+    profile['spans'].append(record)
+    return record
+
+def profile_timings(profile):
+    """Время этапов верхних уровней {имя: сек} для сводки запуска"""
+    return {record['name']: round(record['wall'], 3) for record in profile['spans'] if record['depth'] <= 1}
+
+def profile_log_lines(profile):
+    lines = ['Профиль этапов:']
+    for record in profile['spans']:
+        parts = [f"{record['wall']:.2f} сек"]
+        if record['cpu'] is not None:
+            parts.append(f"ЦП {record['cpu']:.2f} сек")
+        if record['rows'] is not None:
+            parts.append(f"строк {record['rows']}")
+        if record['peak_rss']:
+            parts.append(f"пик памяти {record['peak_rss'] / 2 ** 20:.0f} МБ")
+        if record['traced_peak'] is not None:
+            parts.append(f"tracemalloc +{record['traced_peak'] / 2 ** 20:.1f} МБ")
+        lines.append('  ' * (record['depth'] + 1) + f"{record['name']}: " + ', '.join(parts))
+    return lines
+
+def write_profile(profile, path):
+    """Профиль в файл: .csv - таблица замеров, иначе JSON"""
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS, extrasaction='ignore', delimiter=';')
+            writer.writeheader()
+            writer.writerows(profile['spans'])
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(profile['spans'], f, ensure_ascii=False, indent=2)
+
+# День использования ТС засчитывается при суммарных часах и пробеге за сутки не меньше этих значений
+MGT_MIN_HOURS = 2
+MGT_MIN_MILEAGE = 20
+
+# Типы столбцов агрегата МГТ: ключи и счётчики хранятся числами и категориями,
+# строки для гаражных номеров получаются только при записи Свода (garage_number_labels)
+MGT_FRAME_DTYPES = {'Гаражный номер ТС': 'int64', 'VIN': 'category', 'Количество по МГТ': 'int32', 'Филиал': 'category'}
+
+def garage_numbers(values):
+    """Гаражные номера как целые числа; 0 - номер не указан или не является числом"""
+    return pd.to_numeric(values, errors='coerce').fillna(0).astype('Int64').astype('int64')
+
+def garage_number_labels(numbers):
+    """Гаражные номера в виде отчёта: шесть цифр с ведущими нулями, пустая строка вместо 0"""
+    return numbers.astype(str).str.zfill(6).replace('000000', '')
+
+def concat_mgt_frames(frames):
+    """Объединяет агрегаты файлов МГТ с сохранением компактных типов (категории разных файлов объединяются)"""
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).astype(MGT_FRAME_DTYPES)
+
+def process_mgt_file(file_path, mgt_streaming=True, engine=None, daily=False, period=None):
+    """
+    Читает и агрегирует один файл МГТ.
+    Возвращает (филиал, период, DataFrame 'Гаражный номер ТС'/'VIN'/'Количество по МГТ'/'Филиал'
+    в компактных типах (см. MGT_FRAME_DTYPES),
+    сообщения для лога, признак успешного чтения, замер {wall, cpu, rows, peak_rss}).
+    daily=True - вместо числа дней по ТС возвращается суточное использование до фильтра по часам и пробегу:
+    'Дата' ('ДД.ММ.ГГГГ')/'Гаражный номер ТС'/'VIN'/'Часы'/'Пробег'/'Филиал' (для хранилища использования).
+    period=(начало, конец) - учитываются только дни периода (обычно - периода отчёта): строки вне периода
+    отбрасываются при чтении, файл с непересекающимся периодом в C2 пропускается.
+    Текстовые выгрузки (CSV/TSV) всегда читаются потоково.
+    Функция не трогает GUI, поэтому может выполняться в отдельном процессе.
+    """
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    stats = {'rows': 0}
+
+    def finish_stats():
+        stats.update(wall=round(time.perf_counter() - wall_start, 4), cpu=round(time.process_time() - cpu_start, 4), peak_rss=peak_rss_bytes())
+        return stats
+
+    messages = []
+    log = messages.append
+    filename = file_path.name
+    filial = None
+    period_display = ""
+    df = pd.DataFrame()
+    text_file = is_mgt_text_file(file_path)
+    try:
+        try:
+            if mgt_streaming or text_file:
+                # Строки сворачиваются в суммы по (Дата, ТС) ещё при чтении
+                filial, period_display, df, row_counter, skipped = aggregate_mgt_workbook(file_path, engine=engine, period=period)
+            else:
+                filial, period_display, df = read_mgt_workbook(file_path, streaming=False)
+                skipped = 0
+                if period is not None and not df.empty:
+                    # Полное чтение фильтруется после загрузки: по первому столбцу, как и строки с датами
+                    in_period = {value: mgt_date_in_period(value, period) for value in df.iloc[:, 0].unique()}
+                    inside = df.iloc[:, 0].map(in_period).astype(bool)
+                    skipped = int((~inside).sum())
+                    df = df[inside.to_numpy()]
+                row_counter = len(df)
+        except NATIVE_READER_ERRORS as e:
+            if not mgt_streaming or text_file or (engine or XLSX_ENGINE) != 'native':
+                raise
+            log(f"Быстрое чтение '{filename}' не удалось ({e}), используется openpyxl")
+            filial, period_display, df, row_counter, skipped = aggregate_mgt_workbook(file_path, engine='openpyxl', period=period)
+        if 'Организация: ' in filial:
+            filial = filial.split('Организация: ')[1]
+        if filial:
+            for key, value in short_names.items():
+                filial = filial.replace(key, value)
+            log(f"В файле с данными о филиале {filial}")
+        if period_display:
+            log(f"{period_display}")
+        stats['rows'] = row_counter
+        if period is not None and not mgt_period_overlaps(period_display, period):
+            log(f"Период файла {filename} не пересекается с периодом отчёта, файл пропущен")
+            return filial, period_display, pd.DataFrame(), messages, True, finish_stats()
+        if skipped:
+            log(f"Пропущено {skipped} строк с датами вне периода отчёта в файле {filename}")
+
+        if not df.empty:
+            log(f"Прочитано {row_counter} строк с датами из файла {filename}")
+
+            df = df.rename(columns=mgt_column_roles(df.columns))
+
+            # Приведение ключевых колонок сразу после переименования: номер и VIN - к строке,
+            # гаражный номер - к целому числу, VIN - к категории (группировка идёт по кодам)
+            for col in ['Номер', 'VIN']:
+                if col in df.columns:
+                    df[col] = df[col].astype(str).str.strip().replace('nan', '')
+            # Строки без гаражного номера в группировку не попадают (как и пустые ключи-строки раньше)
+            df = df[df['Гаражный номер ТС'].notna()]
+            df['Гаражный номер ТС'] = garage_numbers(df['Гаражный номер ТС'])
+            df['VIN'] = df['VIN'].astype('category')
+            df['Часы'] = pd.to_numeric(df['Часы'], errors='coerce')
+            df['Пробег'] = pd.to_numeric(df['Пробег'], errors='coerce')
+            df= df.groupby(['Дата','Гаражный номер ТС','VIN' ], observed=True).agg({'Часы':'sum', 'Пробег':'sum'})
+            if daily:
+                df = df.reset_index()
+                df['Дата'] = normalize_dates(df['Дата'])
+                df['Филиал'] = pd.Series(filial, index=df.index, dtype='category')
+                log(f"В файле {filename} есть суточные данные {df['VIN'].nunique()} ТС за {df['Дата'].nunique()} дн.")
+                return filial, period_display, df, messages, True, finish_stats()
+            df = df[(df['Часы'] >= MGT_MIN_HOURS) & (df['Пробег'] >= MGT_MIN_MILEAGE)].reset_index()[['Дата', 'Гаражный номер ТС', 'VIN']]
+            #log(f"По количеству часов и пробегу в файле {filename} есть {len(df)} строк")
+            #df = df[required[:3]].copy()
+            if 'Дата' in df.columns:
+                df['Дата'] = normalize_dates(df['Дата'])
+
+            #result = df.groupby(['Гаражный номер ТС', 'VIN']).size().reset_index(name='Количество по МГТ')
+
+            #df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN']).size()
+            #df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN'])['Дата'].transform('nunique')
+            df = df.groupby(['Гаражный номер ТС', 'VIN'], observed=True).size().reset_index(name='Количество по МГТ')
+            df['Количество по МГТ'] = df['Количество по МГТ'].astype('int32')
+            df['VIN'] = df['VIN'].cat.remove_unused_categories()
+            df['Филиал'] = pd.Series(filial, index=df.index, dtype='category')
+
+            # Альтернатива (ещё короче):
+            # df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN']).transform('size')
+            log(f"В файле {filename} есть информация о количестве дней использования {len(df)} ТС")
+
+        else:
+            df = pd.DataFrame()
+            
+            log(f"Не найдено строк с датами в файле {filename}")
+
+    except Exception as e2:
+        log(f"openpyxl не смог прочитать '{filename}': {e2}")
+        return filial, period_display, pd.DataFrame(), messages, False, finish_stats()
+    return filial, period_display, df, messages, True, finish_stats()
+
+def mgt_cache_key(file_path, period=None):
+    """Ключ кэша: sha256 содержимого файла + версия разбора (+ период, если строки отбирались по периоду)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    key = f"{digest.hexdigest()}_v{MGT_PARSER_VERSION}"
+    if period is not None:
+        key += f"_{period[0]:%Y%m%d}-{period[1]:%Y%m%d}"
+    return key
+
+def load_mgt_cache(key, cache_dir=None):
+    """Результат process_mgt_file из кэша или None"""
+    path = Path(cache_dir or MGT_CACHE_DIR) / f"{key}.pkl"
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+        # Отмечаем использование для вытеснения давно не нужных записей
+        os.utime(path)
+        return result
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+def store_mgt_cache(key, result, cache_dir=None):
+    cache_dir = Path(cache_dir or MGT_CACHE_DIR)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Временный файл свой у каждого процесса и потока: запись одного ключа не мешает другой
+        tmp_path = cache_dir / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_dir / f"{key}.pkl")
+    except OSError as e:
+        log_to_gui(f"Не удалось сохранить кэш: {e}")
+
+def evict_mgt_cache(cache_dir=None, max_bytes=None):
+    """Удаляет давно не использованные записи, пока размер кэша больше max_bytes"""
+    cache_dir = Path(cache_dir or MGT_CACHE_DIR)
+    max_bytes = MGT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not cache_dir.exists():
+        return
+    entries = []
+    for path in cache_dir.glob('*.pkl'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+            total -= size
+        except OSError:
+            pass
+
+def clear_mgt_cache(cache_dir=None):
+    """Полностью очищает кэш файлов МГТ, возвращает число удаленных записей"""
+    cache_dir = Path(cache_dir or MGT_CACHE_DIR)
+    removed = 0
+    if cache_dir.exists():
+        for path in list(cache_dir.glob('*.pkl')) + list(cache_dir.glob('*.tmp')):
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def collect_mgt_files(input_file_paths, mgt_streaming=True, mgt_workers=MGT_WORKERS, engine=None, use_cache=True, profile=None, period=None):
+    """
+    Обрабатывает файлы МГТ и возвращает список (филиал, период, DataFrame) в порядке входных файлов.
+    period=(начало, конец) - учитываются только дни периода (см. process_mgt_file).
+    mgt_workers=1 - последовательно в текущем процессе,
+    mgt_workers=None - пул процессов по числу ядер, иначе - пул из mgt_workers процессов.
+    use_cache=False - читать все файлы заново, не обращаясь к кэшу.
+    profile - профиль (new_profile), в который добавляются замеры по каждому файлу.
+    """
+    # Движок определяем здесь, чтобы дочерние процессы не зависели от своих значений по умолчанию
+    engine = engine or XLSX_ENGINE
+    results = [None] * len(input_file_paths)
+    cache_keys = [None] * len(input_file_paths)
+    if use_cache:
+        for i, file_path in enumerate(input_file_paths):
+            try:
+                cache_keys[i] = mgt_cache_key(file_path, period)
+            except OSError:
+                continue
+            load_start = time.perf_counter()
+            cached = load_mgt_cache(cache_keys[i])
+            if cached is None:
+                log_to_gui(f"Кэш: файла {file_path.name} нет в кэше, файл будет прочитан")
+                continue
+            log_to_gui(f"Кэш: данные файла {file_path.name} взяты из кэша")
+            filial, period_display, df, messages = cached
+            if profile is not None:
+                profile_add(profile, f"МГТ {file_path.name} (кэш)", {'wall': round(time.perf_counter() - load_start, 4), 'rows': len(df)})
+            for message in messages:
+                log_to_gui(message)
+            results[i] = (filial, period_display, df)
+            progress_step(f"Файл МГТ {file_path.name} взят из кэша")
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    def finish(i, result):
+        filial, period_display, df, messages, success, stats = result
+        if profile is not None:
+            profile_add(profile, f"МГТ {input_file_paths[i].name}", stats)
+        for message in messages:
+            log_to_gui(message)
+        results[i] = (filial, period_display, df)
+        if success and cache_keys[i]:
+            store_mgt_cache(cache_keys[i], (filial, period_display, df, messages))
+        progress_step(f"Прочитан файл МГТ {input_file_paths[i].name}")
+
+    if mgt_workers is None:
+        mgt_workers = min(len(pending), os.cpu_count() or 1)
+    if mgt_workers > 1 and len(pending) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=mgt_workers) as executor:
+                futures = {executor.submit(process_mgt_file, input_file_paths[i], mgt_streaming, engine, False, period): i for i in pending}
+                # Сообщения выводим по мере готовности файлов, а результаты собираем в исходном порядке
+                try:
+                    for future in as_completed(futures):
+                        finish(futures[future], future.result())
+                except ProcessingCancelled:
+                    # Ещё не начатые файлы снимаем; читаемые сейчас дочитываются при закрытии пула
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        except BrokenProcessPool as e:
+            log_to_gui(f"Пул процессов недоступен ({e}), файлы будут прочитаны последовательно")
+    for i in pending:
+        if results[i] is None:
+            finish(i, process_mgt_file(input_file_paths[i], mgt_streaming, engine, False, period))
+    if use_cache and pending:
+        evict_mgt_cache()
+    return results
+
+def _dedup_column_names(names):
+    """Уникальные имена столбцов по правилу pandas: повторы получают суффиксы .1, .2, ..."""
+    names = list(names)
+    counts = {}
+    for i, col in enumerate(names):
+        cur_count = counts.get(col, 0)
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f"{col}.{cur_count}"
+            cur_count = counts.get(col, 0)
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
+
+def report_frame_from_grid(grid, header_idx):
+    """
+    Блок данных листа отчёта с заголовком в строке header_idx сырой сетки.
+    Результат совпадает с pd.read_excel(..., skiprows=header_idx, dtype=str), но без повторного чтения листа.
+    """
+    names = [f"Unnamed: {i}" if pd.isna(value) else value for i, value in enumerate(grid.iloc[header_idx])]
+    df = grid.iloc[header_idx + 1:].reset_index(drop=True)
+    df.columns = _dedup_column_names(names)
+    return df
+
+def _is_report_period_text(cell_val):
+    return 'за период' in cell_val.lower() and 'по' in cell_val.lower() and 'г.' in cell_val
+
+def _report_grid_row(grid, idx):
+    """Строка сырой сетки как кортеж (пустые ячейки - None) для отпечатка раскладки"""
+    return tuple(None if pd.isna(value) else value for value in grid.iloc[idx])
+
+def known_report_layout(grid):
+    """
+    Раскладка листа отчёта из кэша REPORT_LAYOUTS: (строка периода, строка заголовка '№') или None.
+    Раскладка известна, если строка заголовка совпадает с запомненной, а в строке периода есть 'за период ...'.
+    """
+    first_col = grid.iloc[:, 0]
+    with LAYOUTS_LOCK:
+        layouts = list(REPORT_LAYOUTS.items())
+    for (header_idx, header), period_idx in layouts:
+        if header_idx < len(grid) and period_idx < len(grid) and first_col.iat[header_idx] == '№' and not pd.isna(first_col.iat[period_idx]) \
+                and _is_report_period_text(str(first_col.iat[period_idx]).strip()) and _report_grid_row(grid, header_idx) == header:
+            return period_idx, header_idx
+    return None
+
+def _report_grid_cell(value):
+    """Значение ячейки по правилам чтения pandas (openpyxl): пусто - '', целое число - int, ошибка Excel - NaN"""
+    if value is None:
+        return ''
+    if type(value) is float:
+        return int(value) if value.is_integer() else value
+    if type(value) is str and value in ERROR_CODES:
+        return numpy.nan
+    return value
+
+def report_sheet_grid(file_path, sheet_name, engine=None):
+    """
+    Сырая сетка листа - как pd.read_excel(file_path, sheet_name, header=None, dtype=str), но читается только
+    этот лист, потоково (iter_sheet_rows), без открытия книги через openpyxl. Строки приводятся так же, как
+    в pandas (_report_grid_cell, обрезка пустых хвостов), и разбираются тем же TextParser.
+    Отличия: текстовая ячейка, совпадающая с кодом ошибки Excel ('#N/A', '#DIV/0!' ...), тоже становится NaN;
+    после строки заголовка '№' (строки 3-12 листа) и хотя бы одной строки данных чтение останавливается на первой
+    полностью пустой строке - подвал листа (Итого, подписи) не читается.
+    При ошибке быстрого чтения лист читается через openpyxl.
+    """
+    engine = engine or XLSX_ENGINE
+    data = []
+    last_row_with_data = -1
+    header_seen = False
+    data_seen = False
+    try:
+        with closing(iter_sheet_rows(file_path, sheet_name, engine)) as rows:
+            for row_number, row in enumerate(rows):
+                converted_row = [_report_grid_cell(value) for value in row]
+                while converted_row and converted_row[-1] == '':
+                    converted_row.pop()
+                if not converted_row:
+                    if data_seen:
+                        break
+                elif header_seen:
+                    data_seen = True
+                elif 2 <= row_number < 12 and converted_row[0] == '№':
+                    header_seen = True
+                if converted_row:
+                    last_row_with_data = row_number
+                data.append(converted_row)
+    except NATIVE_READER_ERRORS:
+        if engine != 'native':
+            raise
+        return report_sheet_grid(file_path, sheet_name, 'openpyxl')
+    data = data[:last_row_with_data + 1]
+    if not data:
+        return pd.DataFrame()
+    max_width = max(len(data_row) for data_row in data)
+    data = [data_row + [''] * (max_width - len(data_row)) for data_row in data]
+    return TextParser(data, header=None, dtype=str, skip_blank_lines=False).read()
+
+def read_report_sheet(contract_path, sheet, engine=None):
+    """
+    Разбирает лист филиала в отчёте вигитон/антисон за одно чтение.
+    Сырая сетка листа читается один раз (report_sheet_grid - только этот лист), строка 'за период ...'
+    и строка заголовка '№' ищутся в памяти, блок данных вырезается из той же сетки. Для листа известной
+    раскладки (known_report_layout) поиск не выполняется: строки периода и заголовка берутся из кэша.
+    Возвращает ((начало, конец, текст периода) или None, DataFrame листа или None).
+    """
+    grid = report_sheet_grid(contract_path, sheet, engine)
+    if grid.empty:
+        return None, None
+    first_col = grid.iloc[:, 0]
+    layout = known_report_layout(grid)
+    if layout is not None:
+        period_idx, header_idx = layout
+        period = extract_period_from_merged_cells(str(first_col.iat[period_idx]).strip().lower())
+    else:
+        # Ищем строку с "за период"
+        period = None
+        for idx in first_col.index[first_col.notna()]:
+            cell_val = str(first_col.iat[idx]).strip()
+            if _is_report_period_text(cell_val):
+                period = extract_period_from_merged_cells(cell_val.lower())
+                period_idx = idx
+        # Без строки периода лист не считается листом отчёта
+        if period is None:
+            return None, None
+        # Заголовок - строка '№' среди строк 3-12 листа, иначе 2-я строка листа
+        header_idx = None
+        for i in range(2, min(12, len(grid))):
+            if first_col.iat[i] == '№':
+                header_idx = i
+        if header_idx is not None:
+            with LAYOUTS_LOCK:
+                REPORT_LAYOUTS[(header_idx, _report_grid_row(grid, header_idx))] = period_idx
+    trim_at_empty = header_idx is None
+    if header_idx is None:
+        header_idx = 1
+    if header_idx >= len(grid):
+        return period, None
+    df_sheet = report_frame_from_grid(grid, header_idx)
+    if 'Гаражный номер ТС' not in df_sheet.columns:
+        return period, None
+    if trim_at_empty:
+        # Остановка на первой полностью пустой строке
+        df_sheet = df_sheet.iloc[:first_empty_row(df_sheet)].copy()
+    df_sheet['Филиал'] = sheet
+    df_sheet = clean_columns(df_sheet)
+    return period, df_sheet
+
+# === Запись разницы с МГТ в копию отчёта ===
+# Сначала для каждого листа строится план записи {(строка, столбец): (значение, нужно ли форматирование)},
+# затем план применяется: правкой xml только изменяемых листов (WRITE_BACK_ENGINE='xml') или через openpyxl.
+# Модель листа: cells - {строка: {столбец: значение}}, merged - ячейки внутри объединений (кроме левой верхней),
+# max_row / max_column - как у openpyxl.
+
+WRITE_BACK_HEADERS = ('Разница в количестве с МГТ', 'Разница по сумме с МГТ')
+WRITE_BACK_ALIGNMENT = {'horizontal': 'center', 'vertical': 'center'}
+WRITE_BACK_FONT = {'name': 'Moscow Sans', 'size': 10}
+
+def plan_sheet_write_back(sheet, filial_data, total):
+    """
+    План записи для одного листа филиала.
+    Возвращает (план, число записанных строк) или None, если заголовок '№' не найден.
+    """
+    cells, merged = sheet['cells'], sheet['merged']
+    max_row, max_column = sheet['max_row'], sheet['max_column']
+    # Строка с заголовками: "№" в первых 10 строках и 9 столбцах
+    header_row = None
+    col_index_number = None
+    for r in range(1, min(11, max_row + 1)):
+        row_cells = cells.get(r, {})
+        for c in range(1, min(10, max_column + 1)):
+            if str(row_cells.get(c) or '').strip() == '№':
+                header_row = r
+                col_index_number = c
+                break
+        if header_row:
+            break
+    if not header_row:
+        return None
+    # Маппинг: номер услуги → номер строки в Excel (при повторах - последняя строка)
+    number_to_row = {}
+    for r in sorted(cells):
+        if r > header_row:
+            cell_val = str(cells[r].get(col_index_number) or '').strip()
+            if cell_val:
+                number_to_row[cell_val] = r
+    plan = {}
+
+    def put(r, c, value, styled):
+        previous = plan.get((r, c))
+        plan[(r, c)] = (value, styled or (previous is not None and previous[1]))
+        cells.setdefault(r, {})[c] = value
+
+    written_count = 0
+    for number, count_diff, sum_diff in zip(filial_data['№'], filial_data['Разница в количестве с МГТ'], filial_data['Разница по сумме с МГТ']):
+        target_row = number_to_row.get(str(number).strip())
+        if target_row is None:
+            continue
+        # Последний непустой столбец строки (с учётом уже записанных значений)
+        row_cells = cells.get(target_row, {})
+        last_col = max((c for c, v in row_cells.items() if v not in (None, '', ' ')), default=0)
+        put(header_row, last_col + 1, WRITE_BACK_HEADERS[0], False)
+        put(header_row, last_col + 2, WRITE_BACK_HEADERS[1], False)
+        # Столбцы для записи с обходом объединённых ячеек
+        result_col = last_col + 1
+        while (target_row, result_col) in merged:
+            result_col += 1
+        diff_col = result_col + 1
+        while (target_row, diff_col) in merged:
+            diff_col += 1
+        put(target_row, result_col, str(count_diff), True)
+        put(target_row, diff_col, sum_diff, True)
+        max_column = max(max_column, last_col + 2, diff_col)
+        written_count += 1
+    # Общая сумма разницы - в последний столбец строки written_count-2 (как и раньше);
+    # при меньше чем трёх записанных строках такой строки нет и запись пропускается
+    if written_count - 2 >= 1:
+        put(written_count - 2, max_column, total, False)
+    return plan, written_count
+
+def plan_report_write_back(sheet_names, load_sheet, checking, total):
+    """
+    Планы записи для листов отчёта, соответствующих филиалам из checking.
+    load_sheet(имя листа) возвращает модель листа и вызывается только для нужных листов.
+    Возвращает ({лист: план}, обработанные филиалы, сообщения для лога, {филиал: записано строк}).
+    """
+    target_filials = checking['Филиал'].unique().tolist()
+    plans = {}
+    processed_filials = []
+    messages = []
+    written = {}
+    for sheet_name in sheet_names:
+        # Проверяем, является ли лист нужным филиалом (регистронезависимо)
+        filial_name = next((tf for tf in target_filials if tf.lower() in sheet_name.lower()), None)
+        if filial_name is None:
+            continue
+        processed_filials.append(filial_name)
+        filial_data = checking[checking['Филиал'] == filial_name]
+        if filial_data.empty:
+            messages.append(f"  >> Филиал '{filial_name}' (лист '{sheet_name}'): нет данных для записи")
+            continue
+        planned = plan_sheet_write_back(load_sheet(sheet_name), filial_data, total)
+        if planned is None:
+            messages.append(f"   Не найден заголовок '№' в листе '{sheet_name}'")
+            continue
+        plans[sheet_name], written_count = planned
+        written[filial_name] = written.get(filial_name, 0) + written_count
+        messages.append(f"  >> Филиал '{filial_name}' (лист '{sheet_name}'): записано {written_count} строк")
+    return plans, processed_filials, messages, written
+
+def _openpyxl_sheet_model(ws):
+    cells = {}
+    merged = set()
+    max_row, max_column = ws.max_row, ws.max_column
+    for row in ws.iter_rows():
+        for cell in row:
+            if isinstance(cell, openpyxl.cell.cell.MergedCell):
+                merged.add((cell.row, cell.column))
+            elif cell.value is not None:
+                cells.setdefault(cell.row, {})[cell.column] = cell.value
+    return {'cells': cells, 'merged': merged, 'max_row': max_row, 'max_column': max_column}
+
+def write_back_openpyxl(src, dst, checking, total):
+    """Запись через openpyxl: книга загружается и сохраняется целиком"""
+    wb = openpyxl.load_workbook(src)
+    try:
+        plans, processed_filials, messages, written = plan_report_write_back(wb.sheetnames, lambda name: _openpyxl_sheet_model(wb[name]), checking, total)
+        # Общие объекты стилей для всех записываемых ячеек
+        alignment = openpyxl.styles.Alignment(**WRITE_BACK_ALIGNMENT)
+        font = openpyxl.styles.Font(**WRITE_BACK_FONT)
+        for sheet_name, plan in plans.items():
+            ws = wb[sheet_name]
+            for (r, c), (value, styled) in plan.items():
+                cell = ws.cell(row=r, column=c)
+                cell.value = value
+                if styled:
+                    cell.alignment = alignment
+                    cell.font = font
+        wb.save(dst)
+    finally:
+        wb.close()
+    return processed_filials, messages, written
+
+def read_xlsx_sheet_model(zf, sheet_path, shared_strings, date_styles, timedelta_styles, epoch):
+    """
+    Модель листа для планирования записи (значения как у openpyxl без data_only: формулы - строкой '=...').
+    Дополнительно возвращает стили ячеек листа {(строка, столбец): индекс cellXfs}.
+    """
+    cells, merged, styles = {}, set(), {}
+    max_row = max_column = 1
+    sheet_data = None
+    ns = None
+    column_cache = {}
+    with zf.open(sheet_path) as src:
+        for event, el in ET.iterparse(src, events=('start', 'end')):
+            tag = el.tag
+            if event == 'start':
+                if ns is None:
+                    ns = tag[:tag.index('}') + 1] if '}' in tag else ''
+                    row_tag, cell_tag, value_tag, formula_tag, inline_tag, text_tag = ns + 'row', ns + 'c', ns + 'v', ns + 'f', ns + 'is', ns + 't'
+                    sheet_data_tag, merge_tag = ns + 'sheetData', ns + 'mergeCell'
+                elif tag == sheet_data_tag:
+                    sheet_data = el
+                continue
+            if tag == row_tag:
+                for c in el.iterfind(cell_tag):
+                    coordinate = c.get('r')
+                    if not coordinate:
+                        # Без адресов ячеек xml листа не поправить точечно
+                        raise ValueError('Ячейка листа без адреса')
+                    letters = coordinate.rstrip('0123456789')
+                    col = column_cache.get(letters)
+                    if col is None:
+                        col = column_cache[letters] = column_index_from_string(letters)
+                    row = int(coordinate[len(letters):])
+                    max_row = max(max_row, row)
+                    max_column = max(max_column, col)
+                    style_id = int(c.get('s', 0))
+                    if style_id:
+                        styles[(row, col)] = style_id
+                    data_type = c.get('t', 'n')
+                    formula = c.find(formula_tag)
+                    if formula is not None:
+                        value = '=' + (formula.text or '')
+                    elif data_type == 'inlineStr':
+                        child = c.find(inline_tag)
+                        value = _xlsx_inline_string(child, text_tag) if child is not None else None
+                    else:
+                        value = c.findtext(value_tag)
+                        if value is not None:
+                            if data_type == 'n':
+                                value = _cast_xlsx_number(value)
+                                if style_id in date_styles:
+                                    try:
+                                        value = from_excel(value, epoch, timedelta=style_id in timedelta_styles)
+                                    except (OverflowError, ValueError):
+                                        value = '#VALUE!'
+                            elif data_type == 's':
+                                value = shared_strings[int(value)]
+                            elif data_type == 'b':
+                                value = bool(int(value))
+                            elif data_type == 'd':
+                                value = from_ISO8601(value)
+                    if value is not None:
+                        cells.setdefault(row, {})[col] = value
+                if sheet_data is not None:
+                    sheet_data.clear()
+            elif tag == merge_tag:
+                min_col, min_row, max_col, max_row_merged = range_boundaries(el.get('ref'))
+                for r in range(min_row, max_row_merged + 1):
+                    for c in range(min_col, max_col + 1):
+                        if (r, c) != (min_row, min_col):
+                            merged.add((r, c))
+                max_row = max(max_row, max_row_merged)
+                max_column = max(max_column, max_col)
+    return {'cells': cells, 'merged': merged, 'max_row': max_row, 'max_column': max_column}, styles
+
+_XML_ROW_RE = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_XML_CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>.*?</c>)', re.S)
+_XML_ROW_REF_RE = re.compile(r'(?:^|\s)r="(\d+)"')
+_XML_CELL_REF_RE = re.compile(r'(?:^|\s)r="([A-Z]+)\d+"')
+
+def _xml_escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def _xml_set_attr(attrs, name, value):
+    """Заменяет или добавляет атрибут в строке атрибутов открывающего тега"""
+    pattern = re.compile(rf'(\s){name}="[^"]*"')
+    if pattern.search(attrs):
+        return pattern.sub(lambda m: f'{m.group(1)}{name}="{value}"', attrs, count=1)
+    return f'{attrs} {name}="{value}"'
+
+def _xlsx_cell_body(value, style_id):
+    """Ячейка без адреса: всё, что следует за '<c r="..."'"""
+    style = f' s="{style_id}"' if style_id else ''
+    if isinstance(value, str):
+        space = ' xml:space="preserve"' if value != value.strip() else ''
+        return f'{style} t="inlineStr"><is><t{space}>{_xml_escape(value)}</t></is></c>'
+    data_type = ' t="b"' if isinstance(value, (bool, numpy.bool_)) else ''
+    # Числа - в том же виде, что пишет openpyxl; NaN и бесконечность - пустым значением
+    text = '%.16g' % value if numpy.isfinite(value) else ''
+    return f'{style}{data_type}><v>{text}</v></c>'
+
+def _xlsx_cell_xml(ref, value, style_id):
+    return f'<c r="{ref}"{_xlsx_cell_body(value, style_id)}'
+
+def _xml_find_element(xml, name):
+    """
+    Первый элемент name в xml - с префиксом пространства имён ('x:cellXfs') или без, в том числе пустой ('<cellXfs/>').
+    Возвращает (совпадение, префикс, атрибуты открывающего тега, содержимое) или None.
+    """
+    m = re.search(rf'<(\w+:|){name}\b([^>]*?)(?:/>|>(.*?)</\1{name}>)', xml, re.S)
+    if m is None:
+        return None
+    return m, m.group(1), m.group(2), m.group(3) or ''
+
+def patch_xlsx_styles(xml, base_styles):
+    """
+    Добавляет в styles.xml шрифт WRITE_BACK_FONT и копии стилей base_styles (cellXfs)
+    с этим шрифтом и выравниванием WRITE_BACK_ALIGNMENT - так же, как их меняет openpyxl.
+    Новые элементы пишутся с тем же префиксом пространства имён, что и у fonts / cellXfs.
+    Возвращает (новый xml, {исходный стиль: новый стиль}).
+    """
+    fonts = _xml_find_element(xml, 'fonts')
+    cell_xfs = _xml_find_element(xml, 'cellXfs')
+    if fonts is None or cell_xfs is None:
+        raise ValueError('В styles.xml нет шрифтов или стилей ячеек')
+    fonts, font_ns, fonts_attrs, fonts_content = fonts
+    cell_xfs, ns, xfs_attrs, xfs_content = cell_xfs
+    if fonts.start() > cell_xfs.start():
+        raise ValueError('В styles.xml шрифты следуют за стилями ячеек')
+    font_id = len(re.findall(rf'<{font_ns}font\b', fonts_content))
+    font_xml = (f'<{font_ns}font><{font_ns}sz val="{WRITE_BACK_FONT["size"]}"/>'
+                f'<{font_ns}name val="{WRITE_BACK_FONT["name"]}"/></{font_ns}font>')
+    alignment_xml = f'<{ns}alignment ' + ' '.join(f'{k}="{v}"' for k, v in WRITE_BACK_ALIGNMENT.items()) + '/>'
+    xfs = re.findall(rf'<{ns}xf\b[^>]*?(?:/>|>.*?</{ns}xf>)', xfs_content, re.S)
+    if not xfs:
+        # Пустой cellXfs ('<cellXfs count="0"/>'): стиль 0 - стиль по умолчанию, как его подставляет openpyxl
+        xfs = [f'<{ns}xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>']
+        xfs_content += xfs[0]
+    style_map = {}
+    new_xfs = []
+    for base in sorted(base_styles):
+        xf = re.match(rf'<{ns}xf\b([^>]*?)(?:/>|>(.*)</{ns}xf>)$', xfs[base], re.S)
+        attrs = xf.group(1)
+        for name, value in (('fontId', font_id), ('applyFont', 1), ('applyAlignment', 1)):
+            attrs = _xml_set_attr(attrs, name, value)
+        children = re.sub(rf'<{ns}alignment\b[^>]*?(?:/>|>.*?</{ns}alignment>)', '', xf.group(2) or '', flags=re.S)
+        style_map[base] = len(xfs) + len(new_xfs)
+        new_xfs.append(f'<{ns}xf{attrs}>{alignment_xml}{children}</{ns}xf>')
+    fonts_open = _xml_set_attr(fonts_attrs, 'count', font_id + 1)
+    xfs_open = _xml_set_attr(xfs_attrs, 'count', len(xfs) + len(new_xfs))
+    xml = (xml[:fonts.start()] + f'<{font_ns}fonts{fonts_open}>{fonts_content}{font_xml}</{font_ns}fonts>'
+           + xml[fonts.end():cell_xfs.start()] + f'<{ns}cellXfs{xfs_open}>{xfs_content}{"".join(new_xfs)}</{ns}cellXfs>'
+           + xml[cell_xfs.end():])
+    return xml, style_map
+
+# Элементы workbook.xml, которые по схеме следуют за calcPr: новый calcPr вставляется перед первым из них
+_XML_AFTER_CALC_PR = ('oleSize', 'customWorkbookViews', 'pivotCaches', 'smartTagPr', 'smartTagTypes', 'webPublishing',
+                      'fileRecoveryPr', 'webPublishObjects', 'extLst')
+
+def drop_xlsx_calc_chain(workbook_xml, rels_xml, content_types_xml, calc_chain_path):
+    """
+    Убирает цепочку вычислений (xl/calcChain.xml) из связей книги и [Content_Types].xml и включает
+    пересчёт формул при открытии (calcPr fullCalcOnLoad) - так же, как при сохранении через openpyxl.
+    Иначе Excel считает книгу повреждённой, если в цепочке осталась ячейка, где формулу заменило значение.
+    Возвращает (workbook.xml, связи книги, [Content_Types].xml).
+    """
+    rels_xml = re.sub(r'<(\w+:|)Relationship\b[^>]*?\sType="[^"]*/calcChain"[^>]*?(?:/>|>\s*</\1Relationship>)', '', rels_xml)
+    content_types_xml = re.sub(rf'<(\w+:|)Override\b[^>]*?\sPartName="/{re.escape(calc_chain_path)}"[^>]*?(?:/>|>\s*</\1Override>)', '',
+                               content_types_xml)
+    calc_pr = re.search(r'<(\w+:|)calcPr\b([^>]*?)(/?)>', workbook_xml)
+    if calc_pr is not None:
+        attrs = _xml_set_attr(calc_pr.group(2), 'fullCalcOnLoad', 1)
+        workbook_xml = workbook_xml[:calc_pr.start(2)] + attrs + workbook_xml[calc_pr.end(2):]
+    else:
+        root = re.search(r'<(\w+:|)workbook\b', workbook_xml)
+        ns = root.group(1) if root else ''
+        following = re.search(rf'<{ns}(?:{"|".join(_XML_AFTER_CALC_PR)})\b|</{ns}workbook>', workbook_xml)
+        if following is None:
+            raise ValueError('В workbook.xml нет закрывающего тега книги')
+        workbook_xml = workbook_xml[:following.start()] + f'<{ns}calcPr fullCalcOnLoad="1"/>' + workbook_xml[following.start():]
+    return workbook_xml, rels_xml, content_types_xml
+
+def _patch_row_cells(row_number, content, writes, styles, style_map):
+    """Содержимое <row>: существующие ячейки и записываемые ячейки в порядке столбцов"""
+    matches = list(_XML_CELL_RE.finditer(content))
+    head = content[:matches[0].start()] if matches else ''
+    tail = content[matches[-1].end():] if matches else content
+    row_cells = {}
+    for m in matches:
+        ref = _XML_CELL_REF_RE.search(m.group(1))
+        if ref is None:
+            raise ValueError(f'Ячейка без адреса в строке {row_number}')
+        row_cells[column_index_from_string(ref.group(1))] = m.group(0)
+    for col, (value, styled) in writes.items():
+        style_id = styles.get((row_number, col), 0)
+        if styled:
+            style_id = style_map[style_id]
+        row_cells[col] = _xlsx_cell_xml(f'{get_column_letter(col)}{row_number}', value, style_id)
+    return head + ''.join(row_cells[col] for col in sorted(row_cells)) + tail
+
+def patch_xlsx_sheet(xml, plan, styles, style_map):
+    """Вносит план записи в xml листа; строки без изменений остаются байт в байт"""
+    start = xml.find('<sheetData')
+    if start < 0:
+        raise ValueError('В листе нет sheetData')
+    open_end = xml.index('>', start) + 1
+    if xml[open_end - 2] == '/':
+        # Пустой лист: <sheetData/>
+        xml = xml[:start] + '<sheetData></sheetData>' + xml[open_end:]
+        open_end = start + len('<sheetData>')
+    end = xml.index('</sheetData>', open_end)
+    writes_by_row = {}
+    for (r, c), write in plan.items():
+        writes_by_row.setdefault(r, {})[c] = write
+    existing = {}
+    for m in _XML_ROW_RE.finditer(xml, open_end, end):
+        ref = _XML_ROW_REF_RE.search(m.group(1))
+        if ref is None:
+            raise ValueError('Строка листа без номера')
+        existing[int(ref.group(1))] = m
+    existing_rows = sorted(existing)
+    edits = []
+    for r in sorted(writes_by_row):
+        m = existing.get(r)
+        if m is not None:
+            attrs = re.sub(r'\sspans="[^"]*"', '', m.group(1))
+            content = _patch_row_cells(r, m.group(2) or '', writes_by_row[r], styles, style_map)
+            edits.append((m.start(), m.end(), f'<row{attrs}>{content}</row>'))
+        else:
+            # Новая строка - перед первой строкой с большим номером
+            following = next((row for row in existing_rows if row > r), None)
+            pos = existing[following].start() if following is not None else end
+            content = _patch_row_cells(r, '', writes_by_row[r], styles, style_map)
+            edits.append((pos, pos, f'<row r="{r}">{content}</row>'))
+    pieces = []
+    pos = 0
+    for edit_start, edit_end, text in sorted(edits, key=lambda edit: edit[0]):
+        pieces.append(xml[pos:edit_start])
+        pieces.append(text)
+        pos = edit_end
+    pieces.append(xml[pos:])
+    xml = ''.join(pieces)
+    # Границы листа в <dimension>
+    dimension = re.search(r'<dimension\b[^>]*?\sref="([^"]*)"', xml[:start])
+    if dimension:
+        min_col, min_row, max_col, max_row = range_boundaries(dimension.group(1))
+        max_col = max([max_col or 1] + [c for _, c in plan])
+        max_row = max([max_row or 1] + [r for r, _ in plan])
+        ref = f'{get_column_letter(min_col or 1)}{min_row or 1}:{get_column_letter(max_col)}{max_row}'
+        xml = xml[:dimension.start(1)] + ref + xml[dimension.end(1):]
+    return xml
+
+def read_xlsx_sheet_models(file_path):
+    """Модели всех листов книги для записи правкой xml: {лист: (модель, стили ячеек)} (см. read_xlsx_sheet_model)"""
+    with zipfile.ZipFile(file_path) as zf:
+        meta = read_xlsx_metadata(zf)
+        shared_strings = read_xlsx_shared_strings(zf, meta['shared_strings'])
+        date_styles, timedelta_styles = read_xlsx_date_styles(zf, meta['styles'])
+        return {name: read_xlsx_sheet_model(zf, path, shared_strings, date_styles, timedelta_styles, meta['epoch'])
+                for name, path in meta['sheets']}
+
+def write_back_xml(src, dst, checking, total, sheet_models=None):
+    """
+    Запись правкой xml: разбираются и переписываются только листы с планом записи и styles.xml,
+    остальные части книги копируются без изменений. Цепочка вычислений (calcChain.xml) удаляется (drop_xlsx_calc_chain).
+    sheet_models - модели листов, разобранные заранее (read_xlsx_sheet_models); остальные листы разбираются здесь.
+    """
+    sheet_models = sheet_models or {}
+    with zipfile.ZipFile(src) as zf:
+        meta = read_xlsx_metadata(zf)
+        sheet_paths = dict(meta['sheets'])
+        # Общие части книги нужны, только если какой-то лист разбирается здесь
+        shared_strings = date_styles = timedelta_styles = None
+        sheet_styles = {}
+
+        def load_sheet(sheet_name):
+            nonlocal shared_strings, date_styles, timedelta_styles
+            if sheet_name in sheet_models:
+                sheet, sheet_styles[sheet_name] = sheet_models[sheet_name]
+                return sheet
+            if shared_strings is None:
+                shared_strings = read_xlsx_shared_strings(zf, meta['shared_strings'])
+                date_styles, timedelta_styles = read_xlsx_date_styles(zf, meta['styles'])
+            sheet, sheet_styles[sheet_name] = read_xlsx_sheet_model(zf, sheet_paths[sheet_name], shared_strings, date_styles, timedelta_styles, meta['epoch'])
+            return sheet
+
+        plans, processed_filials, messages, written = plan_report_write_back([name for name, _ in meta['sheets']], load_sheet, checking, total)
+        patched = {}
+        base_styles = {sheet_styles[name].get(key, 0) for name, plan in plans.items() for key, (_, styled) in plan.items() if styled}
+        style_map = {}
+        if base_styles:
+            if not meta['styles']:
+                raise ValueError('В книге нет styles.xml')
+            styles_xml, style_map = patch_xlsx_styles(zf.read(meta['styles']).decode('utf-8'), base_styles)
+            patched[meta['styles']] = styles_xml.encode('utf-8')
+        for sheet_name, plan in plans.items():
+            path = sheet_paths[sheet_name]
+            patched[path] = patch_xlsx_sheet(zf.read(path).decode('utf-8'), plan, sheet_styles[sheet_name], style_map).encode('utf-8')
+        # Записанные значения могли заменить формулы из цепочки вычислений: цепочка удаляется, Excel строит её заново
+        dropped = set()
+        if plans and meta['calc_chain'] in zf.namelist():
+            rels_path = _xlsx_rels_path(meta['workbook'])
+            workbook_xml, rels_xml, content_types_xml = drop_xlsx_calc_chain(
+                zf.read(meta['workbook']).decode('utf-8'), zf.read(rels_path).decode('utf-8'),
+                zf.read('[Content_Types].xml').decode('utf-8'), meta['calc_chain'])
+            patched.update({meta['workbook']: workbook_xml.encode('utf-8'), rels_path: rels_xml.encode('utf-8'),
+                            '[Content_Types].xml': content_types_xml.encode('utf-8')})
+            dropped.add(meta['calc_chain'])
+        # Книга собирается только после успешной подготовки всех правок
+        with zipfile.ZipFile(dst, 'w') as out:
+            for info in zf.infolist():
+                if info.filename not in dropped:
+                    out.writestr(info, patched.get(info.filename) or zf.read(info.filename))
+    return processed_filials, messages, written
+
+def write_back_report(src, dst, checking, total, engine=None, sheet_models=None):
+    """
+    Создаёт копию отчёта dst с разницей в количестве и по сумме с МГТ на листах филиалов.
+    engine='xml' - правка xml изменяемых листов, engine='openpyxl' - загрузка и сохранение книги целиком.
+    По умолчанию используется WRITE_BACK_ENGINE; если xml листа не удаётся поправить - openpyxl.
+    sheet_models - модели листов для engine='xml', разобранные заранее (read_xlsx_sheet_models).
+    Возвращает (обработанные филиалы, сообщения для лога, {филиал: записано строк}).
+    """
+    engine = engine or WRITE_BACK_ENGINE
+    if engine == 'xml':
+        try:
+            return write_back_xml(src, dst, checking, total, sheet_models)
+        except NATIVE_READER_ERRORS as e:
+            processed_filials, messages, written = write_back_openpyxl(src, dst, checking, total)
+            return processed_filials, [f"Быстрая запись копии отчёта не удалась ({e}), используется openpyxl"] + messages, written
+    return write_back_openpyxl(src, dst, checking, total)
+
 def get_last_row_with_data(worksheet, col):
     for row in range(worksheet.max_row, 0, -1):
         if worksheet.cell(row=row, column=col).value not in (None, "", " "):
             return row
     return 1
 
+# Очередь сообщений для GUI: рабочий поток только кладёт в неё сообщения,
+# главный цикл Tk забирает их пачками через after() (см. start_gui). Без GUI очередь не создаётся.
+gui_queue = None
+# Период разбора очереди GUI, мс, и наибольшее число сообщений за один разбор
+GUI_POLL_MS = 100
+GUI_BATCH_SIZE = 500
+
 def log_to_gui(message):
-    if 'log_text' in globals() and log_text:
-        log_text.configure(state='normal')
-        log_text.insert(tk.END, message + "\n")
-        log_text.configure(state='disabled')
-        log_text.yview(tk.END)
+    if gui_queue is not None:
+        gui_queue.put(('log', message))
     else:
         print(message) 
 
-# Глобальная переменная для хранения пути к файлу отчета
+# Окна сообщений tkinter; задаются в start_gui, без GUI сообщения уходят в лог
+messagebox = None
+
+def notify_user(title, message, error=False):
+    if gui_queue is not None:
+        gui_queue.put(('notify', title, message, error))
+    elif messagebox is None:
+        log_to_gui(f"{title}: {message}")
+    elif error:
+        messagebox.showerror(title, message)
+    else:
+        messagebox.showinfo(title, message)
+
+# Отмена обработки: кнопка GUI устанавливает событие, обработка проверяет его между файлами и этапами
+cancel_event = threading.Event()
+
+class ProcessingCancelled(Exception):
+    pass
+
+# Ход обработки: выполнено шагов из total (файлы МГТ и этапы сверки).
+# Шаги могут отмечать несколько потоков (служба сверки), поэтому счётчик меняется под progress_lock
+progress_state = {'done': 0, 'total': 0}
+progress_lock = threading.Lock()
+
+def progress_start(total):
+    with progress_lock:
+        progress_state.update(done=0, total=total)
+    if gui_queue is not None:
+        gui_queue.put(('progress', 0, total, ''))
+
+def progress_step(label=''):
+    """Шаг обработки выполнен; если нажата отмена - ProcessingCancelled"""
+    with progress_lock:
+        progress_state['done'] = min(progress_state['done'] + 1, progress_state['total'])
+        done, total = progress_state['done'], progress_state['total']
+    if gui_queue is not None:
+        gui_queue.put(('progress', done, total, label))
+    if cancel_event.is_set():
+        raise ProcessingCancelled()
+
+def progress_finish(label=''):
+    with progress_lock:
+        progress_state['done'] = total = progress_state['total']
+    if gui_queue is not None:
+        gui_queue.put(('progress', total, total, label))
+
+# Глобальные переменные для хранения выбранных файлов отчета (первый и все выбранные)
 global_report_file = None
+global_report_files = []
 
 def start_gui():
-    global log_text, global_report_file
+    global log_text, global_report_file, global_report_files, messagebox, gui_queue
+    # tkinter импортируется только для GUI: пакетный режим работает без него
+    import tkinter as tk
+    from tkinter import Label, filedialog, scrolledtext, messagebox, ttk
     global_report_file = None  # Сброс при запуске
+    global_report_files = []
+    gui_queue = queue.Queue()
     
     root = tk.Tk()
     root.configure(background='lightblue', border = (10) )
     #root.BackgroundColor('blue')
     root.title("Сравнение данных МГТ с вигитон/антисон")
-    root.geometry("500x480")
+    root.geometry("500x540")
     log_text = scrolledtext.ScrolledText(root, state='disabled', wrap=tk.WORD, font=("Moscow Sans", 10))
     
     # Кнопка выбора файла отчета (вигитон/антисон)
     def on_select_report_file():
         nonlocal root
-        file_path = filedialog.askopenfilename(
-            title="Выберите файл отчета (вигитон/антисон)",
+        file_paths = filedialog.askopenfilenames(
+            title="Выберите файл(ы) отчета (вигитон/антисон)",
             filetypes=[("Excel files", "*.xlsx")]
         )
-        if file_path:
-            global global_report_file
-            global_report_file = Path(file_path)
-            log_to_gui(f"Выбран файл отчета: {global_report_file.name}")
+        if file_paths:
+            global global_report_file, global_report_files
+            global_report_files = [Path(file_path) for file_path in file_paths]
+            global_report_file = global_report_files[0]
+            if len(global_report_files) == 1:
+                log_to_gui(f"Выбран файл отчета: {global_report_file.name}")
+            else:
+                log_to_gui(f"Выбраны файлы отчетов: {', '.join(path.name for path in global_report_files)}.\n"
+                           f"Данные МГТ будут прочитаны один раз, результаты каждого отчёта - в папке с его именем")
         else:
             log_to_gui("Файл отчета не выбран.")
-    tk.Label(root, text='В данной программе в обработку берутся файлы:\n- "Отчет Вигитон.xlsx" или "Отчет Антисон.xlsx" - выбирается 1 файл\n- файл(ы) МГТ о ТС формата ".xlsx" - можно выбрать несколько', font=('Moscow Sans', 9)).pack(anchor='w', padx=10, pady=(10, 0), fill = tk.X)
+    tk.Label(root, text='В данной программе в обработку берутся файлы:\n- "Отчет Вигитон.xlsx" и/или "Отчет Антисон.xlsx" - можно выбрать несколько\n- файл(ы) МГТ о ТС формата ".xlsx" или выгрузки ".csv"/".tsv" - можно выбрать несколько', font=('Moscow Sans', 9)).pack(anchor='w', padx=10, pady=(10, 0), fill = tk.X)
     tk.Label(root, text='Нажав на кнопки ниже - откроется проводник\nдля выбора файла(ов).\n После выбора файла(ов) нажать на кнопку "Открыть" в правом нижнем углу', font=('Moscow Sans', 9)).pack(anchor='w', padx=15, pady=(15, 0), fill = tk.X)
     tk.Label(root, text = 'УКАЗАННЫЕ ФАЙЛЫ НЕ ДОЛЖНЫ БЫТЬ ОТКРЫТЫ НА МОМЕНТ ЧТЕНИЯ', font=('Moscow Sans', 9)).pack(padx= 15, pady=(15, 0), fill = tk.X)
     btn_report = tk.Button(root, text="Выбрать файл отчета (вигитон/антисон)", command=on_select_report_file, font=("Moscow Sans", 11), padx=15, pady=8, bg='#E0F7FA')
@@ -289,454 +2152,1459 @@ def start_gui():
     def on_select_files():
         nonlocal root
         file_paths = filedialog.askopenfilenames(
-            title="Выберите контрольные Excel-файлы (.xlsx)",
-            filetypes=[("Excel files", "*.xlsx")]
+            title="Выберите контрольные файлы (.xlsx, .csv, .tsv)",
+            filetypes=[("Excel files", "*.xlsx"), ("CSV/TSV files", "*.csv *.tsv"), ("All MGT files", "*.xlsx *.csv *.tsv")]
         )
         if file_paths:
             # Передаем оба параметра: контрольные файлы + файл отчета
-            threading.Thread(target=lambda: process_files(file_paths, global_report_file), daemon=True).start()
+            cancel_event.clear()
+            btn_files.configure(state='disabled')
+            btn_cancel.configure(state='normal')
+            threading.Thread(target=run_in_background, args=(file_paths, list(global_report_files), use_cache_var.get()), daemon=True).start()
         else:
             log_to_gui("Контрольные файлы не выбраны.")
+
+    def run_in_background(file_paths, report_files, use_cache):
+        try:
+            if len(report_files) > 1:
+                process_report_batch(file_paths, report_files, use_cache=use_cache)
+            else:
+                process_files(file_paths, report_files[0] if report_files else None, use_cache=use_cache)
+        except ProcessingCancelled:
+            log_to_gui("Обработка отменена")
+        except Exception as e:
+            log_to_gui(f"Ошибка обработки: {e}")
+            notify_user("Ошибка", f"Обработка прервана ошибкой:\n{e}", error=True)
+        finally:
+            gui_queue.put(('done',))
+
+    def on_cancel():
+        cancel_event.set()
+        btn_cancel.configure(state='disabled')
+        log_to_gui("Отмена: обработка остановится после текущего шага...")
     
     btn_files = tk.Button(root, text="Выбрать контрольные файлы", command=on_select_files, font=("Moscow Sans", 12), padx=20, pady=10, bg='#B3E5FC')
     btn_files.pack(pady=8)
+
+    # Кэш разобранных файлов МГТ: можно отключить или очистить
+    def on_clear_cache():
+        removed = clear_mgt_cache()
+        log_to_gui(f"Кэш файлов МГТ очищен, удалено записей: {removed}")
+    cache_frame = tk.Frame(root, bg='lightblue')
+    use_cache_var = tk.BooleanVar(value=True)
+    tk.Checkbutton(cache_frame, text="Использовать кэш файлов МГТ", variable=use_cache_var, font=("Moscow Sans", 9), bg='lightblue').pack(side=tk.LEFT)
+    tk.Button(cache_frame, text="Очистить кэш", command=on_clear_cache, font=("Moscow Sans", 9)).pack(side=tk.LEFT, padx=10)
+    cache_frame.pack(pady=2)
     
+    # Ход обработки и отмена
+    progress_frame = tk.Frame(root, bg='lightblue')
+    progress_bar = ttk.Progressbar(progress_frame, mode='determinate')
+    progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    btn_cancel = tk.Button(progress_frame, text="Отмена", command=on_cancel, font=("Moscow Sans", 9), state='disabled')
+    btn_cancel.pack(side=tk.LEFT, padx=(10, 0))
+    progress_frame.pack(padx=10, pady=(5, 0), fill=tk.X)
+    progress_label = tk.Label(root, text='', font=("Moscow Sans", 9), bg='lightblue', anchor='w')
+    progress_label.pack(padx=10, fill=tk.X)
+
+    def drain_gui_queue():
+        """Переносит накопленные сообщения рабочего потока в окно: текст лога добавляется одной вставкой"""
+        lines = []
+        try:
+            for _ in range(GUI_BATCH_SIZE):
+                item = gui_queue.get_nowait()
+                kind = item[0]
+                if kind == 'log':
+                    lines.append(item[1])
+                elif kind == 'progress':
+                    _, done, total, label = item
+                    progress_bar.configure(maximum=max(total, 1), value=done)
+                    if label:
+                        progress_label.configure(text=label)
+                elif kind == 'notify':
+                    # Окно сообщения модальное: сначала выводим уже накопленный лог
+                    flush_log(lines)
+                    lines = []
+                    _, title, message, error = item
+                    (messagebox.showerror if error else messagebox.showinfo)(title, message)
+                elif kind == 'done':
+                    btn_files.configure(state='normal')
+                    btn_cancel.configure(state='disabled')
+        except queue.Empty:
+            pass
+        flush_log(lines)
+        root.after(GUI_POLL_MS, drain_gui_queue)
+
+    def flush_log(lines):
+        if lines:
+            log_text.configure(state='normal')
+            log_text.insert('end', '\n'.join(lines) + '\n')
+            log_text.configure(state='disabled')
+            log_text.yview('end')
+
     log_text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+    root.after(GUI_POLL_MS, drain_gui_queue)
     root.mainloop()
 
-def process_files(file_paths, report_file_path=None):
+def read_report(contract_path, used_filials, sheets=None, engine=None):
+    """
+    Читает листы отчёта для филиалов used_filials: сначала потоково (read_report_sheet), при неудаче - через openpyxl.
+    Список листов берётся из описания книги, читаются только листы used_filials - остальные листы не разбираются.
+    sheets - листы, уже прочитанные заранее (read_report_sheets); тогда книга не открывается.
+    Возвращает (DataFrame строк отчёта всех найденных листов, (начало, конец, текст периода) или None).
+    """
+    contract_dataframes = pd.DataFrame()
+    period_extracted = False
+    # Попытка 1: потоковое чтение нужных листов
+    try:
+        if sheets is None:
+            sheetNames = xlsx_sheet_names(contract_path, engine)
+            read_sheet = lambda sheet: read_report_sheet(contract_path, sheet, engine)
+        else:
+            sheetNames = list(sheets)
+            read_sheet = sheets.get
+        for sheet in sheetNames:
+            if (sheet in used_filials):
+                period, df_sheet = read_sheet(sheet)
+                if period:
+                    period_start, period_end, period_display = period
+                    period_extracted=True
+                if df_sheet is not None:
+                    contract_dataframes= pd.concat([contract_dataframes,df_sheet],ignore_index =False)
+        if period_extracted:
+            log_to_gui('В отчете указаны данные '+period_display)
+    except Exception as e:
+        log_to_gui(f"pandas не смог прочитать отчёт: {e}")
+    # Попытка 2: openpyxl - если потоковое чтение не нашло строку периода ни на одном листе
+    if not period_extracted:
+        try:
+            wb = openpyxl.load_workbook(contract_path, data_only=True, read_only=True)
+            try:
+                for sheet_name in wb.sheetnames:
+                    if sheet_name not in used_filials:
+                        continue
+                    # Один проход по строкам листа: строка периода - среди первых 15 строк, заголовок с 'Гаражный номер ТС' -
+                    # среди первых 10, данные - от заголовка до первой строки, где '№' не целое число (пустая строка, Итого).
+                    # Ячейки - как в потоковой сетке листа
+                    header = None
+                    data = []
+                    for row_number, row in enumerate(wb[sheet_name].iter_rows(values_only=True), start=1):
+                        values = [_report_grid_cell(value) for value in row]
+                        if header is not None:
+                            if not values or not isinstance(values[0], int):
+                                break
+                            data.append(values)
+                            continue
+                        first = values[0] if values else ''
+                        if row_number <= 15 and isinstance(first, str) and _is_report_period_text(first.strip()):
+                            sheet_period = extract_period_from_merged_cells(first.strip().lower())
+                            if sheet_period[0] is not None:
+                                period_start, period_end, period_display = sheet_period
+                                period_extracted = True
+                        if row_number <= 10 and 'Гаражный номер ТС' in ''.join(str(value).strip() for value in values):
+                            header = values
+                        elif row_number >= 15:
+                            break
+                    if header is None or not data:
+                        continue
+                    width = max(len(values) for values in [header, *data])
+                    grid = TextParser([values + [''] * (width - len(values)) for values in [header, *data]], header=None, dtype=str, skip_blank_lines=False).read()
+                    df_sheet = report_frame_from_grid(grid, 0)
+                    df_sheet['Филиал'] = sheet_name
+                    df_sheet = clean_columns(df_sheet)
+                    contract_dataframes = pd.concat([contract_dataframes, df_sheet], ignore_index=False)
+            finally:
+                wb.close()
+            if period_extracted:
+                log_to_gui('В отчете указаны данные '+period_display)
+        except Exception as e:
+            log_to_gui(f"openpyxl не смог прочитать отчёт: {e}")
+    if not period_extracted:
+        return contract_dataframes, None
+    return contract_dataframes, (period_start, period_end, period_display)
+
+def read_report_sheets(contract_path, engine=None):
+    """
+    Все листы отчёта (read_report_sheet) без отбора по филиалам - для чтения отчёта, пока филиалы МГТ ещё не известны.
+    Возвращает {лист: ((начало, конец, текст периода) или None, DataFrame листа или None)}.
+    """
+    return {sheet: read_report_sheet(contract_path, sheet, engine) for sheet in xlsx_sheet_names(contract_path, engine)}
+
+# Строка 'за период ...' ищется в первом столбце первых строк листа отчёта
+REPORT_PERIOD_ROWS = 15
+
+def read_report_period(contract_path, engine=None):
+    """
+    Период отчёта без чтения данных: первые REPORT_PERIOD_ROWS строк листов по порядку, до первой строки 'за период ...'.
+    Нужен до чтения файлов МГТ, чтобы отбирать их строки по периоду отчёта.
+    Возвращает (начало, конец, текст периода) или None.
+    """
+    engine = engine or XLSX_ENGINE
+    try:
+        for sheet_name in xlsx_sheet_names(contract_path, engine):
+            rows = iter_sheet_rows(contract_path, sheet_name, engine)
+            try:
+                for row_idx, row in enumerate(rows, start=1):
+                    if row_idx > REPORT_PERIOD_ROWS:
+                        break
+                    cell_val = row[0] if row else None
+                    if isinstance(cell_val, str):
+                        text = cell_val.strip().lower()
+                        if 'за период' in text and 'по' in text and 'г.' in text:
+                            try:
+                                period = extract_period_from_merged_cells(text)
+                            except IndexError:
+                                # Строка 'за период' без дат
+                                continue
+                            if period[0] is not None:
+                                return period
+            finally:
+                rows.close()
+    except Exception as e:
+        if engine == 'native' and isinstance(e, NATIVE_READER_ERRORS):
+            log_to_gui(f"Быстрое чтение периода отчёта не удалось ({e}), используется openpyxl")
+            return read_report_period(contract_path, 'openpyxl')
+        log_to_gui(f"Период отчёта не определён: {e}")
+    return None
+
+def svod_frame(checking):
+    """
+    Таблица сверки в виде листа Свод: гаражный номер - шесть цифр с ведущими нулями,
+    количество по МГТ - текстом, 0 для ТС без данных МГТ (как в отчёте до перехода на числовые столбцы).
+    """
+    svod = checking.copy()
+    svod['Гаражный номер ТС'] = garage_number_labels(svod['Гаражный номер ТС'])
+    counts = svod['Количество по МГТ']
+    svod['Количество по МГТ'] = counts.astype(str).astype(object).where(counts.notna(), 0)
+    return svod
+
+def svod_data_frame(checking):
+    """
+    Таблица Свода для CSV и Parquet: гаражный номер - шесть цифр, количество по МГТ - целым числом
+    (0 для ТС без данных МГТ), столбцы отчёта со значениями разных типов - строками.
+    """
+    data = checking.copy()
+    data['Гаражный номер ТС'] = garage_number_labels(data['Гаражный номер ТС'])
+    data['Количество по МГТ'] = data['Количество по МГТ'].fillna(0).astype('int32')
+    for column in data.columns:
+        if data[column].dtype == object:
+            values = data[column].infer_objects()
+            data[column] = values if values.dtype != object else values.astype('string')
+    return data
+
+# Части книги Свод, кроме листа: один лист 'Свод', стили - обычный и дата со временем (как у pd.ExcelWriter)
+SVOD_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Свод" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="YYYY-MM-DD HH:MM:SS"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+SVOD_DATETIME_STYLE = 1
+# Наибольшее число строк листа Excel
+XLSX_MAX_ROWS = 1048576
+
+def _svod_cell_body(value):
+    """Ячейка листа Свод без адреса (_xlsx_cell_body); пустые значения (None, NaN, NA, пустая строка) не записываются"""
+    if isinstance(value, str):
+        value = ILLEGAL_CHARACTERS_RE.sub('', value)
+        return _xlsx_cell_body(value, 0) if value else ''
+    if value is None or pd.isna(value):
+        return ''
+    if isinstance(value, datetime):
+        return f' s="{SVOD_DATETIME_STYLE}"><v>{to_excel(value)}</v></c>'
+    if isinstance(value, (int, float, bool, numpy.number, numpy.bool_)):
+        return _xlsx_cell_body(value, 0)
+    return _xlsx_cell_body(str(value), 0)
+
+def _svod_column_cells(letter, column, row_numbers):
+    """
+    Ячейки столбца блока строк. Числовые столбцы numpy форматируются без разбора типа каждого значения,
+    у остальных разметка ячейки вычисляется один раз на значение: в Своде повторяются филиалы, VIN, услуги.
+    """
+    kind = column.dtype.kind if isinstance(column.dtype, numpy.dtype) else None
+    if kind in ('i', 'u'):
+        return [f'<c r="{letter}{r}"><v>{v}</v></c>' for r, v in zip(row_numbers, column.tolist())]
+    if kind == 'f':
+        return [f'<c r="{letter}{r}"><v>{"%.16g" % v}</v></c>' if numpy.isfinite(v) else ''
+                for r, v in zip(row_numbers, column.tolist())]
+    if kind == 'b':
+        return [f'<c r="{letter}{r}" t="b"><v>{int(v)}</v></c>' for r, v in zip(row_numbers, column.tolist())]
+    bodies = {}
+    cells = []
+    for r, v in zip(row_numbers, column.astype(object).tolist()):
+        # Ключ с типом: 1, 1.0 и True равны как ключи словаря, но пишутся по-разному
+        key = (type(v), v)
+        body = bodies.get(key)
+        if body is None:
+            body = bodies[key] = _svod_cell_body(v)
+        cells.append(f'<c r="{letter}{r}"{body}' if body else '')
+    return cells
+
+def write_svod_xlsx(path, svod, chunk_rows=SVOD_CHUNK_ROWS):
+    """
+    Лист Свод потоковой записью xml: строки форматируются и сжимаются блоками по chunk_rows,
+    книга целиком в памяти не собирается. Значения ячеек те же, что пишет pd.ExcelWriter.
+    """
+    if len(svod) + 1 > XLSX_MAX_ROWS:
+        raise ValueError(f'В Своде {len(svod)} строк, лист Excel вмещает {XLSX_MAX_ROWS - 1}')
+    letters = [get_column_letter(j + 1) for j in range(len(svod.columns))]
+    dimension = f'A1:{letters[-1]}{len(svod) + 1}' if letters else 'A1'
+    # Быстрое сжатие: на больших Сводах сжатие уровня по умолчанию - около 40% времени записи
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, xml in SVOD_XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as f:
+            header = ''.join(_xlsx_cell_xml(f'{letter}1', str(column), 0) for letter, column in zip(letters, svod.columns))
+            f.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                     f'<dimension ref="{dimension}"/><sheetData><row r="1">{header}</row>').encode('utf-8'))
+            for start in range(0, len(svod), chunk_rows):
+                block = svod.iloc[start:start + chunk_rows]
+                row_numbers = range(start + 2, start + 2 + len(block))
+                columns = [_svod_column_cells(letter, block.iloc[:, j], row_numbers) for j, letter in enumerate(letters)]
+                f.write(''.join(f'<row r="{r}">{"".join(cells)}</row>' for r, *cells in zip(row_numbers, *columns)).encode('utf-8'))
+            f.write(b'</sheetData></worksheet>')
+
+def write_svod(checking, output_dir, formats=None, engine=None):
+    """
+    Файлы Свода в output_dir в форматах formats (по умолчанию SVOD_FORMATS): xlsx - лист 'Свод'
+    (engine: 'xml' - потоковая запись, 'openpyxl' - pd.ExcelWriter; по умолчанию SVOD_ENGINE), csv и parquet - та же таблица.
+    Возвращает ({формат: путь}, сообщения для лога).
+    """
+    paths = {}
+    messages = []
+    for svod_format in formats or SVOD_FORMATS:
+        path = output_dir / f'Свод_по_собранным_данным.{svod_format}'
+        if svod_format == 'xlsx':
+            if (engine or SVOD_ENGINE) == 'xml':
+                write_svod_xlsx(path, svod_frame(checking))
+            else:
+                with pd.ExcelWriter(path) as writer:
+                    svod_frame(checking).to_excel(writer, index=False, sheet_name='Свод')
+        elif svod_format == 'csv':
+            svod_data_frame(checking).to_csv(path, index=False, sep=';', encoding='utf-8-sig')
+        elif svod_format == 'parquet':
+            if pyarrow is None:
+                messages.append("Для записи Свода в Parquet нужен модуль pyarrow - файл не создан")
+                continue
+            svod_data_frame(checking).to_parquet(path, index=False, engine='pyarrow')
+        else:
+            raise ValueError(f'Неизвестный формат Свода: {svod_format}')
+        paths[svod_format] = path
+        messages.append(f"\nСоздан файл '{path.name}', в котором хранится сводная таблица по данным из отчета, данных МГТ")
+    return paths, messages
+
+def build_mgt_index(combined_df):
+    """
+    Индекс данных МГТ для сверки: агрегат всех файлов с ключом (Филиал, VIN, Гаражный номер ТС),
+    приведённым к виду сверки (короткие имена филиалов, целые гаражные номера).
+    Строится один раз и не меняется при сверке, поэтому один индекс можно сверять с несколькими отчётами.
+    """
+    mgt_index = combined_df.copy()
+    filials = mgt_index['Филиал'].astype(str).str.strip().replace({'nan': ''})
+    # process_mgt_file уже разворачивает имена через short_names: полные имена филиалов остаются как есть
+    mgt_index['Филиал'] = filials.map(short_names).fillna(filials.where(filials.isin(set(short_names.values())))).fillna('Неизвестно')
+    mgt_index['Гаражный номер ТС'] = garage_numbers(mgt_index['Гаражный номер ТС'])
+    return mgt_index
+
+# Ключ сверки строк отчёта с данными МГТ
+RECONCILE_KEYS = ['Филиал', 'VIN', 'Гаражный номер ТС']
+
+def encode_join_keys(left, right, keys):
+    """
+    Составной ключ keys обеих таблиц как одно целое число с общими для обеих сторон кодами:
+    каждый столбец кодируется pd.factorize по объединённым значениям (пустые значения совпадают друг с другом,
+    как в pd.merge), коды столбцов складываются в позиционную запись.
+    Возвращает (коды строк left, коды строк right) - массивы int64.
+    """
+    codes = numpy.zeros(len(left) + len(right), dtype='int64')
+    size = 1
+    for key in keys:
+        key_codes, uniques = pd.factorize(pd.concat([left[key], right[key]], ignore_index=True), use_na_sentinel=False)
+        if size * len(uniques) >= 2 ** 62:
+            # Позиционная запись не помещается в int64: уже собранная часть ключа перекодируется плотно
+            codes, seen = pd.factorize(codes)
+            size = len(seen)
+        codes = codes * len(uniques) + key_codes
+        size *= max(len(uniques), 1)
+    return codes[:len(left)], codes[len(left):]
+
+def join_mgt_counts(report, mgt_index, keys=RECONCILE_KEYS):
+    """
+    Левое соединение строк отчёта с индексом МГТ без pd.merge: ключи кодируются целыми числами (encode_join_keys),
+    совпадения ищутся двоичным поиском по отсортированным кодам МГТ.
+    Строки - как у pd.merge(report, mgt_index, on=keys, how='left'): в порядке отчёта, при нескольких совпадениях
+    строка отчёта повторяется по числу совпадений в порядке mgt_index.
+    Возвращает (позиции строк report, позиции строк mgt_index или -1 без совпадения, маска строк mgt_index без пары в отчёте).
+    """
+    report_codes, mgt_codes = encode_join_keys(report, mgt_index, keys)
+    order = numpy.argsort(mgt_codes, kind='stable')
+    sorted_codes = mgt_codes[order]
+    start = numpy.searchsorted(sorted_codes, report_codes, 'left')
+    if not (sorted_codes[1:] == sorted_codes[:-1]).any():
+        # Ключи МГТ уникальны (обычный случай): не больше одного совпадения на строку отчёта
+        rows = numpy.arange(len(report))
+        found = start < len(sorted_codes)
+        found[found] = sorted_codes[start[found]] == report_codes[found]
+        positions = numpy.full(len(rows), -1, dtype='int64')
+        positions[found] = order[start[found]]
+    else:
+        matches = numpy.searchsorted(sorted_codes, report_codes, 'right') - start
+        repeats = numpy.maximum(matches, 1)
+        rows = numpy.repeat(numpy.arange(len(report)), repeats)
+        positions = numpy.full(len(rows), -1, dtype='int64')
+        found = numpy.repeat(matches, repeats) > 0
+        if found.any():
+            # Номер совпадения внутри группы строки отчёта
+            offsets = numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(repeats) - repeats, repeats)
+            positions[found] = order[(numpy.repeat(start, repeats) + offsets)[found]]
+    # Все совпадения каждой строки отчёта перечислены, поэтому строки МГТ без пары - те, что не попали в positions
+    unmatched_mgt = numpy.ones(len(mgt_codes), dtype=bool)
+    unmatched_mgt[positions[found]] = False
+    return rows, positions, unmatched_mgt
+
+def write_reconciliation(mgt_index, contract_dataframes, contract_path, contract_name, output_dir, summary, write_back_engine=None, profile=None, svod_formats=None, sheet_models=None):
+    """
+    Сверка данных отчёта с индексом МГТ (build_mgt_index): Свод (в форматах svod_formats) и копия отчёта с разницей в output_dir.
+    Результаты (число строк, разница по филиалам, пути файлов) добавляются в summary,
+    замеры этапов reconcile / svod / write_back - в profile.
+    sheet_models() - модели листов отчёта, разобранные заранее (см. start_report_prefetch), или None;
+    вызывается только перед записью копии, чтобы их ожидание не задерживало сверку и Свод.
+    """
+    profile = profile if profile is not None else new_profile()
+    profile_start(profile, 'reconcile')
+    # Категории ключей меняются только у копии: индекс остаётся общим для следующих отчётов
+    combined_df = mgt_index.copy(deep=False)
+    contract_dataframes['Гаражный номер ТС'] = garage_numbers(contract_dataframes['Гаражный номер ТС'])
+    contract_dataframes = contract_dataframes.iloc[( contract_dataframes['VIN']!='') & (contract_dataframes['Количество ед.']!= 0) & (contract_dataframes['Количество ед.']!= '0')]
+    # Ключи сверки с общими категориями: при кодировании ключа сравниваются коды категорий и целые номера, а не строки
+    join_keys = ['Филиал', 'VIN']
+    for key in join_keys:
+        categories = pd.api.types.union_categoricals([contract_dataframes[key].astype(str).astype('category'), combined_df[key].astype(str).astype('category')]).categories
+        contract_dataframes[key] = pd.Categorical(contract_dataframes[key], categories=categories)
+        combined_df[key] = pd.Categorical(combined_df[key], categories=categories)
+    report_rows, mgt_rows, unmatched_mgt = join_mgt_counts(contract_dataframes, combined_df)
+    checking = contract_dataframes.iloc[report_rows].reset_index(drop=True)
+    checking = checking[['№','Наименование услуги','Единица измерения','Количество ед.','Гаражный номер ТС','Государственный номер ТС','Цена 1 ед., руб.','Итого, руб.','VIN', 'Филиал']]
+    # Количество по МГТ остаётся числом; NA - ТС нет в данных МГТ
+    no_match = mgt_rows < 0
+    counts = numpy.zeros(len(mgt_rows), dtype='int32')
+    counts[~no_match] = combined_df['Количество по МГТ'].to_numpy(dtype='int32')[mgt_rows[~no_match]]
+    checking.insert(8, 'Количество по МГТ', pd.arrays.IntegerArray(counts, no_match))
+    # Несовпавшие ключи с обеих сторон: строки отчёта без данных МГТ и ТС МГТ без строки в отчёте;
+    # из последних отдельно - ТС филиалов, листа которых в отчёте нет
+    no_sheet = ~combined_df['Филиал'].isin(contract_dataframes['Филиал'].unique()).to_numpy()
+    summary['unmatched_report_rows'] = int(no_match.sum())
+    summary['unmatched_mgt_vehicles'] = int(unmatched_mgt.sum())
+    summary['unmatched_mgt_without_sheet'] = int((unmatched_mgt & no_sheet).sum())
+    log_to_gui(f"Строк отчёта без данных МГТ: {summary['unmatched_report_rows']}, ТС МГТ без строки в отчёте: {summary['unmatched_mgt_vehicles']}"
+               f" (из них филиалов без листа в отчёте: {summary['unmatched_mgt_without_sheet']})")
+    checking['Разница в количестве с МГТ'] = (pd.to_numeric(checking['Количество ед.'], errors='coerce').fillna(0).astype(int) - checking['Количество по МГТ'].fillna(0).astype(int))
+    log_to_gui("Идет подсчет разницы по сумме с МГТ...")
+    # Извлекаем число из "Разница в количестве с МГТ" (игнорируем ", стажер") и умножаем на цену
+    # Разница в количестве - целые числа без пропусков, поэтому extract_number_from_result сводится к отсечению снизу нулём
+    checking['Разница по сумме с МГТ'] = (checking['Разница в количестве с МГТ'].clip(lower=0) * pd.to_numeric(checking['Цена 1 ед., руб.'], errors='coerce').fillna(0)).round(2)
+    diif_sum = checking['Разница по сумме с МГТ'].sum()
+    log_to_gui("Разница в количестве с МГТ и разница по сумме подсчитаны")
+    summary['checking_rows'] = len(checking)
+    summary['total_difference'] = round(float(diif_sum), 2)
+    for filial, group in checking.groupby('Филиал', sort=False, observed=True):
+        summary['branches'][filial] = {
+            'rows': len(group),
+            'quantity_difference': int(group['Разница в количестве с МГТ'].sum()),
+            'sum_difference': round(float(group['Разница по сумме с МГТ'].sum()), 2),
+            'written_rows': 0,
+        }
+    profile_stop(profile, rows=len(checking))
+    progress_step("Разница с МГТ подсчитана")
+    profile_start(profile, 'svod')
+    #  Разница в количестве с МГТ
+    svod_paths, messages = write_svod(checking, output_dir, svod_formats)
+    for svod_format, svod_path in svod_paths.items():
+        summary['outputs']['svod' if svod_format == 'xlsx' else f'svod_{svod_format}'] = str(svod_path)
+    for message in messages:
+        log_to_gui(message)
+    profile_stop(profile, rows=len(checking))
+    progress_step("Свод сохранён")
+
+    if contract_path:
+        # Создаём копию отчёта
+        profile_start(profile, 'write_back')
+        new_file_name = output_dir / 'Копия_отчета.xlsx'
+        summary['outputs']['report_copy'] = str(new_file_name)
+        log_to_gui(f"\nСоздана копия отчёта '{contract_name}': {new_file_name}.\nВ этот файл будут внесены разница в количестве с МГТ, разница в сумме с МГТ:")
+        processed_filials, messages, written = write_back_report(contract_path, new_file_name, checking, diif_sum, engine=write_back_engine,
+                                                                 sheet_models=sheet_models() if sheet_models else None)
+        for message in messages:
+            log_to_gui(message)
+        for filial, written_count in written.items():
+            if filial in summary['branches']:
+                summary['branches'][filial]['written_rows'] += written_count
+        profile_stop(profile, rows=sum(written.values()))
+
+        log_to_gui(f"  Обработаны филиалы: {', '.join(processed_filials) if processed_filials else 'нет подходящих листов'}")
+    else:
+        log_to_gui("Файл отчёта не был загружен — запись в копию пропущена")
+
+def finish_profile(profile, summary, profile_path=None, stop_tracing=False):
+    """Завершает замер 'total', выводит профиль в лог, добавляет его в сводку и при необходимости в файл"""
+    profile_stop(profile, rows=summary['mgt_rows'])
+    if stop_tracing:
+        tracemalloc.stop()
+    summary['timings'] = profile_timings(profile)
+    summary['profile'] = profile['spans']
+    for line in profile_log_lines(profile):
+        log_to_gui(line)
+    if profile_path:
+        write_profile(profile, profile_path)
+        log_to_gui(f"Профиль этапов сохранён в {profile_path}")
+
+def new_run_summary():
+    return {'status': 'ok', 'mgt_files': 0, 'mgt_rows': 0, 'report_rows': 0, 'checking_rows': 0,
+            'total_difference': None, 'branches': {}, 'outputs': {}, 'timings': {}}
+
+def start_report_prefetch(report_paths, write_back_engine=None, engine=None):
+    """
+    Конвейер: запускает чтение отчётов в отдельных процессах, пока читаются файлы МГТ.
+    Для каждого отчёта читаются все листы (read_report_sheets): филиалы МГТ к этому моменту ещё не известны,
+    поэтому, в отличие от read_report, читаются и листы, которые не понадобятся - ценой времени свободного ядра,
+    а не времени сверки. При записи правкой xml читаются и модели листов для копии (read_xlsx_sheet_models) -
+    два независимых задания, выполняющихся одновременно.
+    engine - движок чтения листов отчёта (см. report_sheet_grid).
+    Возвращает список {'sheets': задание, 'sheet_models': задание или None, 'executor': пул} по отчётам
+    или None, если пул процессов недоступен или ядро одно (тогда отчёты читаются как без конвейера).
+    Пул закрывается через stop_report_prefetch.
+    """
+    if (os.cpu_count() or 1) < 2:
+        # На одном ядре фоновое чтение только отнимает время у файлов МГТ
+        return None
+    with_models = (write_back_engine or WRITE_BACK_ENGINE) == 'xml'
+    executor = None
+    try:
+        executor = ProcessPoolExecutor(max_workers=2 if with_models else 1)
+        return [{'sheets': executor.submit(read_report_sheets, path, engine or XLSX_ENGINE),
+                 'sheet_models': executor.submit(read_xlsx_sheet_models, path) if with_models else None,
+                 'executor': executor}
+                for path in report_paths]
+    except (OSError, BrokenProcessPool) as e:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        log_to_gui(f"Пул процессов недоступен ({e}), отчёт будет прочитан после файлов МГТ")
+        return None
+
+def stop_report_prefetch(prefetch):
+    """
+    Закрывает пул конвейера (start_report_prefetch) без ожидания: ещё не начатые задания снимаются,
+    выполняющиеся дорабатывают в фоне. Вызывается и после сверки, и при отмене или ошибке.
+    """
+    for report_prefetch in prefetch or ():
+        report_prefetch['executor'].shutdown(wait=False, cancel_futures=True)
+
+def prefetched_result(future):
+    """
+    Результат фонового задания конвейера (ожидает его завершения) или None, если задания нет или оно не удалось
+    из-за пула процессов или чтения книги: тогда этап выполняется заново в текущем процессе и сообщает об ошибке
+    как обычно. Прочие ошибки не перехватываются.
+    """
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except (BrokenProcessPool, OSError, *NATIVE_READER_ERRORS) as e:
+        log_to_gui(f"Фоновое чтение отчёта не удалось: {e}")
+        return None
+
+def process_files(file_paths, report_file_path=None, mgt_streaming=True, mgt_workers=MGT_WORKERS, xlsx_engine=None, use_cache=True, write_back_engine=None, svod_formats=None, output_dir=None, profile=None, profile_path=None):
+    """
+    Сверка файлов МГТ с отчётом. Результаты записываются в output_dir (по умолчанию - текущая папка),
+    Свод - в форматах svod_formats (по умолчанию SVOD_FORMATS).
+    profile - профиль замеров (new_profile), profile_path - файл .json/.csv для профиля.
+    Возвращает сводку запуска: статус, число строк, результаты по филиалам, общую разницу, время и замеры этапов.
+    Без файла отчёта (не выбран или не найден) файлы МГТ только читаются, статус сводки - 'no_report'.
+    """
     global log_text
     input_file_paths = []
+    contract_path = None
     contract_name = ''
-    combined_df = pd.DataFrame()
+    contract_dataframes = pd.DataFrame()
+    prefetch = None
+    output_dir = Path(output_dir or '')
+    summary = new_run_summary()
+    profile = profile if profile is not None else new_profile()
+    tracing = profile['trace_memory'] and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    profile_start(profile, 'total')
     
     # Обработка контрольных файлов
     for fp in file_paths:
         filename = Path(fp).name
-        if filename.lower().endswith('.xlsx'):
+        if is_mgt_file(fp):
             input_file_paths.append(Path(fp))
         else:
             log_to_gui(f"Пропущен файл: {filename}")
     
     # Обработка файла отчета (если выбран)
+    report_period = None
     if report_file_path and report_file_path.exists():
         contract_path = report_file_path
         contract_name = report_file_path.name
         log_to_gui(f"Файл отчета для сравнения: {contract_name}")
+        # Период отчёта нужен до чтения МГТ: строки вне периода отбрасываются уже при чтении файлов
+        profile_start(profile, 'report_period')
+        report_period = read_report_period(contract_path, xlsx_engine)
+        profile_stop(profile)
+        if report_period:
+            log_to_gui(f"Сверка {report_period[2]}: данные МГТ вне периода не учитываются")
     else:
         log_to_gui("Файл отчета (вигитон/антисон) не выбран. Будет выполнена только обработка контрольных файлов.")
     
     if not input_file_paths:
-        messagebox.showerror("Ошибка", "Не найдено подходящих контрольных файлов")
-        return
+        notify_user("Ошибка", "Не найдено подходящих контрольных файлов", error=True)
+        summary['status'] = 'no_input'
+        finish_profile(profile, summary, profile_path, tracing)
+        return summary
     log_to_gui(f"\nНайдено контрольных файлов: {len(input_file_paths)}")
-    startingTime = datetime.now()
-    log_to_gui(f'=== Начало чтения: {startingTime.strftime("%H:%M:%S")} ===')
+    summary['mgt_files'] = len(input_file_paths)
+    # Отчёт читается одновременно с файлами МГТ
+    prefetch_jobs = start_report_prefetch([contract_path], write_back_engine, xlsx_engine) \
+        if REPORT_PREFETCH and report_file_path and report_file_path.exists() else None
+    prefetch = prefetch_jobs[0] if prefetch_jobs else None
+    try:
+        # Шаги хода обработки: файлы МГТ, чтение отчёта, сверка, Свод, копия отчёта
+        progress_start(len(input_file_paths) + 4)
+        startingTime = datetime.now()
+        log_to_gui(f'=== Начало чтения: {startingTime.strftime("%H:%M:%S")} ===')
+        profile_start(profile, 'mgt')
+        results = collect_mgt_files(input_file_paths, mgt_streaming=mgt_streaming, mgt_workers=mgt_workers, engine=xlsx_engine, use_cache=use_cache, profile=profile,
+                                    period=report_period[:2] if report_period else None)
+        combined_df = concat_mgt_frames(df for filial, period_display, df in results)
+        summary['mgt_rows'] = len(combined_df)
+        profile_stop(profile, rows=len(combined_df))
+
+        if len(combined_df)>0:
+            log_to_gui('Данные из файлов из МГТ собраны')
+        else:
+            # Например, все файлы МГТ - за другой период
+            log_to_gui("Нет данных МГТ для сверки")
+            summary['status'] = 'no_input'
+            finish_profile(profile, summary, profile_path, tracing)
+            progress_finish("Обработка завершена")
+            return summary
+        used_filials = combined_df['Филиал'].unique().tolist()
+        if contract_path is None:
+            log_to_gui("Данные МГТ прочитаны; сверка не выполнялась - нет файла отчёта")
+            summary['status'] = 'no_report'
+            finish_profile(profile, summary, profile_path, tracing)
+            progress_finish("Обработка завершена")
+            notify_user('Обработка завершена', 'Данные МГТ прочитаны, сверка не выполнялась: файл отчёта не выбран или не найден')
+            return summary
+        profile_start(profile, 'report')
+        contract_dataframes, _ = read_report(contract_path, used_filials, prefetched_result(prefetch['sheets']) if prefetch else None, xlsx_engine)
+        if len(contract_dataframes)==0:
+            log_to_gui("Данные из отчёта не извлечены")
+            summary['status'] = 'no_report_data'
+        summary['report_rows'] = len(contract_dataframes)
+        profile_stop(profile, rows=len(contract_dataframes))
+        progress_step("Отчёт прочитан")
+    
+        log_to_gui("Идет подсчет разницы в количестве с МГТ...")
+        # Подготовка данных
+
+        if len(contract_dataframes)!=0:
+            write_reconciliation(build_mgt_index(combined_df), contract_dataframes, contract_path, contract_name, output_dir, summary, write_back_engine, profile, svod_formats,
+                                 (lambda: prefetched_result(prefetch['sheet_models'])) if prefetch else None)
+
+        endingTime = datetime.now()
+        timeDif = endingTime - startingTime
+
+        log_to_gui(f'\n=== Времени потрачено на чтение : {timeDif.total_seconds():.1f} сек ===')
+        finish_profile(profile, summary, profile_path, tracing)
+        progress_finish("Обработка завершена")
+        log_to_gui("Обработка завершена")
+        notify_user('Успех', 'Обработка завершена!\nРезультаты сохранены.')
+        return summary
+    finally:
+        # Пул конвейера закрывается и при отмене или ошибке: ещё не начатые чтения отчёта снимаются
+        stop_report_prefetch(prefetch_jobs)
+
+def report_output_dirs(report_paths, output_dir):
+    """Папка результатов для каждого отчёта пакета: output_dir/<имя файла отчёта>, при совпадении имён - с номером"""
+    dirs = []
+    used = set()
+    for report_path in report_paths:
+        name = Path(report_path).stem
+        candidate, n = name, 2
+        while candidate.lower() in used:
+            candidate, n = f"{name}_{n}", n + 1
+        used.add(candidate.lower())
+        dirs.append(Path(output_dir) / candidate)
+    return dirs
+
+def process_report_batch(file_paths, report_paths, mgt_streaming=True, mgt_workers=MGT_WORKERS, xlsx_engine=None, use_cache=True, write_back_engine=None, svod_formats=None, output_dir=None, profile=None, profile_path=None):
+    """
+    Сверка файлов МГТ с несколькими отчётами (например, вигитон и антисон за один месяц).
+    Файлы МГТ читаются один раз на каждый период отчётов в общий индекс (build_mgt_index), затем с ним сверяются
+    отчёты этого периода; Свод и копия отчёта записываются в отдельную папку для каждого отчёта (report_output_dirs).
+    Возвращает сводку пакета: данные МГТ, замеры и список сводок отчётов 'reports'.
+    """
+    output_dir = Path(output_dir or '')
+    report_paths = [Path(path) for path in report_paths]
+    summary = new_run_summary()
+    summary['reports'] = []
+    profile = profile if profile is not None else new_profile()
+    tracing = profile['trace_memory'] and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    profile_start(profile, 'total')
+    input_file_paths = []
+    for fp in file_paths:
+        if is_mgt_file(fp):
+            input_file_paths.append(Path(fp))
+        else:
+            log_to_gui(f"Пропущен файл: {Path(fp).name}")
+    if not input_file_paths:
+        notify_user("Ошибка", "Не найдено подходящих контрольных файлов", error=True)
+        summary['status'] = 'no_input'
+        finish_profile(profile, summary, profile_path, tracing)
+        return summary
+    log_to_gui(f"\nНайдено контрольных файлов: {len(input_file_paths)}, отчётов для сверки: {len(report_paths)}")
+    summary['mgt_files'] = len(input_file_paths)
+    # Периоды отчётов определяются до чтения МГТ: файлы МГТ читаются один раз на каждый период
+    profile_start(profile, 'report_period')
+    report_periods = [read_report_period(path, xlsx_engine) if path.is_file() else None for path in report_paths]
+    profile_stop(profile)
+    periods = list(dict.fromkeys(period[:2] if period else None for period in report_periods))
+    # Отчёты читаются одновременно с файлами МГТ
+    prefetch_jobs = start_report_prefetch([path for path in report_paths if path.is_file()], write_back_engine, xlsx_engine) if REPORT_PREFETCH else None
+    prefetch = dict(zip([path for path in report_paths if path.is_file()], prefetch_jobs)) if prefetch_jobs else {}
+    try:
+        # Шаги хода обработки: файлы МГТ каждого периода, затем чтение, сверка и Свод каждого отчёта, завершение
+        progress_start(len(periods) * len(input_file_paths) + 3 * len(report_paths) + 1)
+        profile_start(profile, 'mgt')
+        mgt_indexes = {}
+        for period in periods:
+            if period is not None:
+                log_to_gui(f"Чтение файлов МГТ за период {period[0]:%d.%m.%Y} - {period[1]:%d.%m.%Y}")
+            results = collect_mgt_files(input_file_paths, mgt_streaming=mgt_streaming, mgt_workers=mgt_workers, engine=xlsx_engine, use_cache=use_cache, profile=profile, period=period)
+            combined_df = concat_mgt_frames(df for filial, period_display, df in results)
+            summary['mgt_rows'] += len(combined_df)
+            if not combined_df.empty:
+                mgt_indexes[period] = (combined_df['Филиал'].unique().tolist(), len(combined_df), build_mgt_index(combined_df))
+            del combined_df
+        profile_stop(profile, rows=summary['mgt_rows'])
+        if not mgt_indexes:
+            log_to_gui("Нет данных МГТ для сверки")
+            summary['status'] = 'no_input'
+            finish_profile(profile, summary, profile_path, tracing)
+            return summary
+        log_to_gui('Данные из файлов из МГТ собраны')
+
+        total_difference = 0.0
+        for report_path, report_dir, report_period in zip(report_paths, report_output_dirs(report_paths, output_dir), report_periods):
+            used_filials, mgt_rows, mgt_index = mgt_indexes.get(report_period[:2] if report_period else None, ([], 0, None))
+            report_summary = new_run_summary()
+            del report_summary['timings']
+            report_summary.update(report=str(report_path), output_dir=str(report_dir), mgt_files=summary['mgt_files'], mgt_rows=mgt_rows)
+            summary['reports'].append(report_summary)
+            log_to_gui(f"\n=== Отчёт {report_path.name} ===")
+            # Этапы отчёта вложены в его собственный замер: в сводке времени - по строке на отчёт
+            profile_start(profile, f"отчёт {report_path.name}")
+            profile_start(profile, 'report')
+            report_prefetch = prefetch.pop(report_path, None)
+            report_frame, _ = read_report(report_path, used_filials, prefetched_result(report_prefetch['sheets']) if report_prefetch else None, xlsx_engine) \
+                if report_path.is_file() and mgt_index is not None else (pd.DataFrame(), None)
+            profile_stop(profile, rows=len(report_frame))
+            progress_step(f"Отчёт {report_path.name} прочитан")
+            report_summary['report_rows'] = len(report_frame)
+            if mgt_index is None:
+                log_to_gui(f"Нет данных МГТ за период отчёта {report_path.name}")
+                report_summary['status'] = 'no_input'
+                progress_step()
+                progress_step()
+            elif len(report_frame) == 0:
+                log_to_gui(f"Данные из отчёта {report_path.name} не извлечены")
+                report_summary['status'] = 'no_report_data'
+                progress_step()
+                progress_step()
+            else:
+                report_dir.mkdir(parents=True, exist_ok=True)
+                write_reconciliation(mgt_index, report_frame, report_path, report_path.name, report_dir, report_summary, write_back_engine, profile, svod_formats,
+                                     (lambda: prefetched_result(report_prefetch['sheet_models'])) if report_prefetch else None)
+                total_difference += report_summary['total_difference']
+            profile_stop(profile, rows=report_summary['checking_rows'])
+            summary['report_rows'] += report_summary['report_rows']
+            summary['checking_rows'] += report_summary['checking_rows']
+        summary['total_difference'] = round(total_difference, 2)
+        if any(report['status'] != 'ok' for report in summary['reports']):
+            summary['status'] = 'no_report_data'
+        finish_profile(profile, summary, profile_path, tracing)
+        progress_finish("Обработка завершена")
+        log_to_gui(f"Обработка завершена, сверено отчётов: {sum(report['status'] == 'ok' for report in summary['reports'])} из {len(report_paths)}")
+        notify_user('Успех', 'Обработка завершена!\nРезультаты сохранены.')
+        return summary
+    finally:
+        # Пул конвейера закрывается и при отмене или ошибке: ещё не начатые чтения отчёта снимаются
+        stop_report_prefetch(prefetch_jobs)
+
+# === Хранилище суточного использования ТС (SQLite) ===
+# Суточные суммы часов и пробега по (Дата, ТС) из всех загруженных файлов МГТ; ТС - (Филиал, Гаражный номер ТС, VIN)
+# в таблице vehicles. Таблица usage упорядочена по дате, поэтому период отчёта - один диапазон первичного ключа.
+# Файл МГТ загружается один раз (повторно - только при изменении содержимого), отчёт сверяется
+# одним запросом по диапазону дат своего периода, без чтения книг МГТ.
+# Если одни и те же сутки ТС есть в нескольких файлах, остаются данные последнего загруженного.
+
+USAGE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    content_key TEXT NOT NULL,
+    filial TEXT,
+    period TEXT,
+    rows INTEGER,
+    ingested TEXT
+);
+CREATE TABLE IF NOT EXISTS vehicles (
+    id INTEGER PRIMARY KEY,
+    filial TEXT NOT NULL,
+    garage INTEGER NOT NULL,
+    vin TEXT NOT NULL,
+    UNIQUE (filial, garage, vin)
+);
+CREATE TABLE IF NOT EXISTS usage (
+    date TEXT NOT NULL,
+    vehicle_id INTEGER NOT NULL REFERENCES vehicles (id),
+    hours REAL NOT NULL,
+    mileage REAL NOT NULL,
+    source_id INTEGER NOT NULL,
+    PRIMARY KEY (date, vehicle_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS usage_vehicle ON usage (vehicle_id, date);
+CREATE INDEX IF NOT EXISTS usage_source ON usage (source_id);
+"""
+
+def open_usage_store(path=None):
+    """Соединение с хранилищем (файл и таблицы создаются при первом обращении)"""
+    path = Path(path or USAGE_STORE_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(USAGE_STORE_SCHEMA)
+    return conn
+
+def usage_store_frame(daily):
+    """
+    Суточный DataFrame process_mgt_file(daily=True) в виде строк хранилища: filial/garage/vin/date/hours/mileage.
+    Даты - ISO ('ГГГГ-ММ-ДД'), чтобы период выбирался сравнением строк по первичному ключу.
+    """
+    daily = daily.assign(
+        date=pd.to_datetime(daily['Дата'], format='%d.%m.%Y', errors='coerce').dt.strftime('%Y-%m-%d'),
+        filial=daily['Филиал'].astype(str),
+        garage=daily['Гаражный номер ТС'].astype('int64'),
+        vin=daily['VIN'].astype(str))
+    # Строки без распознанной даты в выборку по периоду не попадут; разные записи одной даты суммируются
+    daily = daily[daily['date'].notna()]
+    return daily.groupby(['filial', 'garage', 'vin', 'date'], sort=False).agg(hours=('Часы', 'sum'), mileage=('Пробег', 'sum')).reset_index()
+
+def usage_vehicle_ids(conn, rows):
+    """Номера ТС хранилища для строк usage_store_frame (новые ТС добавляются в vehicles)"""
+    vehicles = rows[['filial', 'garage', 'vin']].drop_duplicates()
+    keys = list(zip(vehicles['filial'], vehicles['garage'].astype(int), vehicles['vin']))
+    conn.executemany('INSERT OR IGNORE INTO vehicles (filial, garage, vin) VALUES (?, ?, ?)', keys)
+    ids = {}
+    for filial in vehicles['filial'].unique():
+        ids.update(((filial, garage, vin), vehicle_id) for vehicle_id, garage, vin in
+                   conn.execute('SELECT id, garage, vin FROM vehicles WHERE filial = ?', (filial,)))
+    return [ids[key] for key in zip(rows['filial'], rows['garage'].astype(int), rows['vin'])]
+
+def ingest_mgt_files(conn, input_file_paths, mgt_workers=MGT_WORKERS, engine=None, profile=None):
+    """
+    Загружает в хранилище новые и изменённые файлы МГТ (по хэшу содержимого); уже загруженные пропускаются.
+    Возвращает число загруженных файлов.
+    """
+    engine = engine or XLSX_ENGINE
+    known = dict(conn.execute('SELECT path, content_key FROM sources'))
+    pending = []
     for file_path in input_file_paths:
-        filename = file_path.name    
-        period_display = ""
-        success = False
-        df = pd.DataFrame()
-        # Попытка 1: openpyxl
+        key = mgt_cache_key(file_path)
+        if known.get(str(file_path.resolve())) == key:
+            log_to_gui(f"Хранилище: файл {file_path.name} уже загружен")
+            progress_step(f"Файл МГТ {file_path.name} уже в хранилище")
+        else:
+            pending.append((file_path, key))
+
+    def store(file_path, key, result):
+        filial, period_display, daily, messages, success, stats = result
+        for message in messages:
+            log_to_gui(message)
+        if profile is not None:
+            profile_add(profile, f"МГТ {file_path.name}", stats)
+        if not success:
+            progress_step(f"Файл МГТ {file_path.name} не прочитан")
+            return False
+        with conn:
+            path = str(file_path.resolve())
+            row = conn.execute('SELECT id FROM sources WHERE path = ?', (path,)).fetchone()
+            if row:
+                conn.execute('DELETE FROM usage WHERE source_id = ?', row)
+                conn.execute('DELETE FROM sources WHERE id = ?', row)
+            source_id = conn.execute('INSERT INTO sources (path, content_key, filial, period, rows, ingested) VALUES (?, ?, ?, ?, ?, ?)',
+                                     (path, key, filial, period_display, stats['rows'], datetime.now().isoformat(timespec='seconds'))).lastrowid
+            rows = usage_store_frame(daily) if not daily.empty else None
+            if rows is not None and len(rows):
+                conn.executemany('INSERT OR REPLACE INTO usage (date, vehicle_id, hours, mileage, source_id) VALUES (?, ?, ?, ?, ?)',
+                                 zip(rows['date'], usage_vehicle_ids(conn, rows), rows['hours'].astype(float), rows['mileage'].astype(float),
+                                     [source_id] * len(rows)))
+        log_to_gui(f"Хранилище: файл {file_path.name} загружен")
+        progress_step(f"Файл МГТ {file_path.name} загружен в хранилище")
+        return True
+
+    ingested = 0
+    done = set()
+    if mgt_workers is None:
+        mgt_workers = min(len(pending), os.cpu_count() or 1)
+    if mgt_workers > 1 and len(pending) > 1:
         try:
-            wb = openpyxl.load_workbook(file_path, data_only=True, read_only=False)
-            ws = wb.active
-            filial = ws.cell(row = 3, column = 3).value
-            if 'Организация: ' in filial:
-                filial = filial.split('Организация: ')[1]
-            period_display =  ws.cell(row = 2, column = 3).value
-            #ws.unmerge_cells(start_row=1, start_column=2, end_row=2, end_column=5)
-            if filial:
-                for key, value in short_names.items():
-                    filial = filial.replace(key, value)
-                log_to_gui(f"В файле с данными о филиале {filial}")
-            if period_display:
-                log_to_gui(f"{period_display}")
-            #ws.unmerge_cells(start_row=6, start_column=1, end_row=6, end_column=12)
-            #ws.unmerge_cells(start_row=6, start_column=13, end_row=7, end_column=13)
-            #ws.unmerge_cells(start_row=6, start_column=14, end_row=7, end_column=14)
-            #ws.cell(row = 7, column = 13, value = ws.cell(row = 6, column = 13).value)
-            #ws.cell(row = 7, column = 14, value = ws.cell(row = 6, column = 14).value)
-            header_row = 0
-            for row_idx, row in enumerate(ws.iter_rows(), start=header_row-1):
-                row_data = [cell.value for cell in row]
-                if 'Дата' in row_data:
-                    header_row = row_idx
-                    break
-            #print(header_row)
-            # Коррекция: реальный номер строки = header_row + 2 (из-за start=header_row-1 при header_row=0)
-            real_header_row = header_row + 2
-            
-            # Читаем строку заголовка и определяем столбцы БЕЗ None (столбцы с объединенными ячейками имеют None)
-            header_cells = ws[real_header_row]
-            keep_columns = [i for i, cell in enumerate(header_cells) if cell.value is not None]
-            headers = [header_cells[i].value for i in keep_columns]
-            
-            # Собираем данные: только строки с точкой в первом столбце (даты в формате ДД.ММ.ГГГГ)
-            data = []
-            row_counter = 0
-            for row in ws.iter_rows(min_row=real_header_row+1, values_only=True):
-                # Прерываем чтение при первой полностью пустой строке
-                if all(cell is None or (isinstance(cell, str) and cell.strip() == '') for cell in row):
-                    break
-                # Фильтр: только строки с точкой в первом столбце (дата)
-                if row and len(row)>0 and isinstance(row[0], str): 
-                    dates_word = re.findall(r'\b\d{1,2}\.\d{1,2}\.\d{4}\b',row[0],re.IGNORECASE)
-                    #if row_counter>2070:
-                        #print('===')
-                        #print(row_counter)
-                        #print(dates_word)
-                        #print('==')
-                    if '.' in row[0] and len(dates_word)==1:
-                        #print('+')
-                        # Берем только столбцы без None в заголовке
-                        filtered_row = [row[i] if i < len(row) else None for i in keep_columns]
-                        data.append(filtered_row)
-                        row_counter += 1
-            
-            # Создаем DataFrame
-            if data and headers:
-                # Выравнивание строк по количеству заголовков
-                max_cols = len(headers)
-                aligned_data = []
-                for row in data:
-                    if len(row) < max_cols:
-                        row += [None] * (max_cols - len(row))
-                    aligned_data.append(row[:max_cols])
-                df = pd.DataFrame(aligned_data, columns=headers)
-                log_to_gui(f"Прочитано {row_counter} строк с датами из файла {filename}")
-
-                col_map = {}
-                for col in df.columns:
-                    col_str = str(col).strip().lower()
-                    if 'часы' in col_str or 'длительн' in col_str :
-                        col_map[col] = 'Часы'
-                    if 'гар.' in col_str or  'гаражн' in col_str:
-                        col_map[col] = 'Гаражный номер ТС'
-                    if 'vin' in col_str:
-                        col_map[col] = 'VIN'
-                    if 'пробег' in col_str or 'длин' in col_str:
-                        col_map[col] = 'Пробег'
-                    if 'дата' == col_str:
-                        col_map[col] = 'Дата'
-                    if 'номер' == col_str:
-                        col_map[col] = 'Номер'
-                df = df.rename(columns=col_map)
-
-                # Приведение ключевых колонок к строке сразу после переименования
-                for col in ['Гаражный номер ТС', 'Номер', 'VIN']:
-                    if col in df.columns:
-                        df[col] = df[col].astype(str).str.strip().replace('nan', '')
-                #required = ['Дата', 'Гаражный номер ТС', 'Номер', 'VIN', 'Часы', 'Пробег']
-                #if all(c in df.columns for c in required[:3]):
-                df['Часы'] = pd.to_numeric(df['Часы'], errors='coerce')
-                df['Пробег'] = pd.to_numeric(df['Пробег'], errors='coerce')
-                df= df.groupby(['Дата','Гаражный номер ТС','VIN' ]).agg({'Часы':'sum', 'Пробег':'sum'})
-                df = df[(df['Часы'] >= 2) & (df['Пробег'] >= 20)].reset_index()[['Дата', 'Гаражный номер ТС', 'VIN']]
-                #log_to_gui(f"По количеству часов и пробегу в файле {filename} есть {len(df)} строк")
-                #df = df[required[:3]].copy()
-                if 'Дата' in df.columns:
-                    df['Дата'] = df['Дата'].apply(normalize_date)
-
-                #result = df.groupby(['Гаражный номер ТС', 'VIN']).size().reset_index(name='Количество по МГТ')
-
-                #df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN']).size()
-                #df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN'])['Дата'].transform('nunique')
-                df = df.groupby(['Гаражный номер ТС', 'VIN']).size().reset_index(name='Количество по МГТ').astype(str)
-                df['Филиал'] = filial
-
-                # Альтернатива (ещё короче):
-                # df["Количество по МГТ"] = df.groupby(['Гаражный номер ТС', 'VIN']).transform('size')
-                log_to_gui(f"В файле {filename} есть информация о количестве дней использования {len(df)} ТС")
+            with ProcessPoolExecutor(max_workers=mgt_workers) as executor:
+                futures = {executor.submit(process_mgt_file, file_path, True, engine, True): (file_path, key) for file_path, key in pending}
+                try:
+                    for future in as_completed(futures):
+                        file_path, key = futures[future]
+                        ingested += store(file_path, key, future.result())
+                        done.add(file_path)
+                except ProcessingCancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        except BrokenProcessPool as e:
+            log_to_gui(f"Пул процессов недоступен ({e}), файлы будут прочитаны последовательно")
+    for file_path, key in pending:
+        if file_path not in done:
+            ingested += store(file_path, key, process_mgt_file(file_path, True, engine, True))
+    return ingested
 
+def query_usage_counts(conn, period_start, period_end, min_hours=MGT_MIN_HOURS, min_mileage=MGT_MIN_MILEAGE):
+    """
+    Число дней использования каждого ТС за период [period_start, period_end] одним запросом по индексу дат.
+    Возвращает DataFrame в виде агрегата МГТ ('Гаражный номер ТС'/'VIN'/'Количество по МГТ'/'Филиал').
+    """
+    # Дни считаются по номеру ТС в диапазоне первичного ключа (date, vehicle_id); имена ТС подставляются после группировки
+    df = pd.read_sql_query(
+        'SELECT v.garage AS "Гаражный номер ТС", v.vin AS "VIN", u.days AS "Количество по МГТ", v.filial AS "Филиал" '
+        'FROM (SELECT vehicle_id, COUNT(*) AS days FROM usage WHERE date BETWEEN ? AND ? AND hours >= ? AND mileage >= ? '
+        'GROUP BY vehicle_id) u JOIN vehicles v ON v.id = u.vehicle_id',
+        conn, params=(period_start.strftime('%Y-%m-%d'), period_end.strftime('%Y-%m-%d'), min_hours, min_mileage))
+    return df.astype(MGT_FRAME_DTYPES)
+
+def process_usage_store(file_paths, report_file_path, store_path=None, mgt_workers=MGT_WORKERS, xlsx_engine=None, write_back_engine=None, svod_formats=None, output_dir=None, profile=None, profile_path=None):
+    """
+    Сверка отчёта по хранилищу использования ТС: файлы МГТ из file_paths (если есть) загружаются в хранилище,
+    затем данные за период отчёта выбираются одним запросом и сверяются с отчётом.
+    Возвращает сводку запуска, как process_files, с периодом отчёта в 'period'.
+    """
+    output_dir = Path(output_dir or '')
+    report_file_path = Path(report_file_path)
+    summary = new_run_summary()
+    profile = profile if profile is not None else new_profile()
+    tracing = profile['trace_memory'] and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    profile_start(profile, 'total')
+    input_file_paths = [Path(fp) for fp in file_paths if is_mgt_file(fp)]
+    progress_start(len(input_file_paths) + 4)
+    with closing(open_usage_store(store_path)) as conn:
+        if input_file_paths:
+            profile_start(profile, 'ingest')
+            ingested = ingest_mgt_files(conn, input_file_paths, mgt_workers=mgt_workers, engine=xlsx_engine, profile=profile)
+            profile_stop(profile, rows=ingested)
+            log_to_gui(f"Загружено в хранилище файлов МГТ: {ingested} из {len(input_file_paths)}")
+        summary['mgt_files'] = conn.execute('SELECT COUNT(*) FROM sources').fetchone()[0]
+        filials = [row[0] for row in conn.execute('SELECT DISTINCT filial FROM vehicles')]
+        profile_start(profile, 'report')
+        contract_dataframes, report_period = read_report(report_file_path, filials, engine=xlsx_engine)
+        summary['report_rows'] = len(contract_dataframes)
+        profile_stop(profile, rows=len(contract_dataframes))
+        progress_step("Отчёт прочитан")
+        if report_period is None:
+            log_to_gui("В отчёте не найден период: сверка по хранилищу невозможна")
+            summary['status'] = 'no_report_data'
+        else:
+            period_start, period_end, period_display = report_period
+            summary['period'] = period_display
+            profile_start(profile, 'store_query')
+            counts = query_usage_counts(conn, period_start, period_end)
+            summary['mgt_rows'] = len(counts)
+            profile_stop(profile, rows=len(counts))
+            log_to_gui(f"Из хранилища выбраны данные {len(counts)} ТС {period_display}")
+            if len(contract_dataframes) == 0:
+                log_to_gui("Данные из отчёта не извлечены")
+                summary['status'] = 'no_report_data'
             else:
-                df = pd.DataFrame()
-                
-                log_to_gui(f"Не найдено строк с датами в файле {filename}")
-
-            wb.close()
-            success = True
-        except Exception as e2:
-            log_to_gui(f"openpyxl не смог прочитать '{filename}': {e2}")
-            success = False
-        except Exception as  e:
-            print(e)
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
-
-    if len(combined_df)>0:
-        log_to_gui('Данные из файлов из МГТ собраны')
-    #print(combined_df)
-    used_filials = combined_df['Филиал'].unique().tolist()
-    #print(used_filials)
-    if contract_path:
-        contract_dataframes = pd.DataFrame()
-        period_extracted = False
-        # Попытка 1: pandas (редко работает для многолистовых, но попробуем)
+                write_reconciliation(build_mgt_index(counts), contract_dataframes, report_file_path, report_file_path.name, output_dir, summary, write_back_engine, profile, svod_formats)
+    finish_profile(profile, summary, profile_path, tracing)
+    progress_finish("Обработка завершена")
+    log_to_gui("Обработка завершена")
+    notify_user('Успех', 'Обработка завершена!\nРезультаты сохранены.')
+    return summary
+
+# === Режим наблюдения за папкой МГТ ===
+
+# Период опроса папки, сек
+WATCH_INTERVAL = 10
+OUTPUT_FILE_NAMES = ('Свод_по_собранным_данным.xlsx', 'Копия_отчета.xlsx')
+
+def scan_mgt_folder(watch_dir, exclude=()):
+    """Подписи (mtime, размер) файлов МГТ папки (MGT_FILE_SUFFIXES); временные файлы Excel (~$...) и пути exclude пропускаются"""
+    signatures = {}
+    for path in sorted(Path(watch_dir).iterdir()):
+        if not is_mgt_file(path) or path.name.startswith('~$') or path.resolve() in exclude:
+            continue
         try:
-            xls = pd.ExcelFile(contract_path)
-            sheetNames = xls.sheet_names
-            for sheet in sheetNames:
-                if (sheet in used_filials):
-                    df_temp = pd.read_excel(xls, sheet_name=sheet, header=None, dtype=str)
-                    # Ищем строку с "за период"
-                    for idx, row in df_temp.iterrows():
-                        cell_val = str(row.iloc[0]).strip() if not pd.isna(row.iloc[0]) else ""
-                        if 'за период' in cell_val.lower() and 'по' in cell_val.lower() and 'г.' in cell_val:
-                            period_start, period_end, period_display = extract_period_from_merged_cells(cell_val.lower())
-                            contract_beg, contract_end = period_start, period_end
-                            period_extracted=True
-
-
-
-                            df_sheet = pd.read_excel(xls, sheet_name=sheet, skiprows=1, dtype=str)
-                            #print(sheet)
-                            if 'Гаражный номер ТС' in df_sheet.columns:
-                                # ← ДОБАВИТЬ ЭТОТ БЛОК:
-                                # Остановка на первой полностью ппустой строке
-                                #mask_empty = df_sheet.apply(lambda row: row.astype(str).str.strip().eq('').all(), axis=1)
-                                mask_empty = df_sheet.apply(lambda row: is_row_empty(row.values), axis=1)
-                                first_empty_idx = mask_empty.idxmax() if mask_empty.any() else len(df_sheet)
-                                df_sheet = df_sheet.iloc[:first_empty_idx].copy()
-            
-                                            # === КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ: ОБРЕЗКА ПО ПЕРВОЙ ПУСТОЙ СТРОКЕ ===
-            # Используем надёжную функцию is_row_empty
-
-                                #df_sheet = df_sheet[[ 'Количество ед.','Гаражный номер ТС', 'VIN']].copy()
-                                df_sheet['Филиал'] = sheet
-                                df_sheet = clean_columns(df_sheet)
-                                contract_dataframes= pd.concat([contract_dataframes,df_sheet],ignore_index =False)
-
-                            for i in range(0, 10):
-                                if df_sheet.iloc[i, 0]=='№':
-                                    header_row = i
-                                    df_sheet = pd.read_excel(xls, sheet_name=sheet, skiprows=2+i, dtype=str)
-                            if 'Гаражный номер ТС' in df_sheet.columns :
-                                #df_sheet = df_sheet[[ 'Количество ед.','Гаражный номер ТС', 'VIN']].copy()
-                                df_sheet['Филиал'] = sheet
-                                df_sheet = clean_columns(df_sheet)
-                                contract_dataframes= pd.concat([contract_dataframes,df_sheet],ignore_index =False)
-            if period_extracted:
-                log_to_gui('В отчете указаны данные '+period_display)
-            xls.close()
-            #log_to_gui(f"pandas смог прочитать отчёт: {period_display}")
-        except Exception as e:
-            log_to_gui(f"pandas не смог прочитать отчёт: {e}")
-        # Попытка 2: openpyxl (основной метод для отчёта)
-        if not period_extracted:
+            stat = path.stat()
+        except OSError:
+            continue
+        signatures[path] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+def watch_mgt_folder(watch_dir, report_path, output_dir=None, interval=WATCH_INTERVAL, mgt_workers=MGT_WORKERS,
+                     use_cache=True, write_back_engine=None, svod_formats=None, on_refresh=None, max_cycles=None):
+    """
+    Следит за папкой с файлами МГТ и пересчитывает сверку с отчётом при появлении, изменении или удалении файлов.
+    Разбираются только изменившиеся файлы: агрегат МГТ каждого файла хранится между опросами,
+    отчёт перечитывается только при его изменении или появлении новых филиалов.
+    Строки МГТ отбираются по периоду отчёта; если при изменении отчёта меняется период, все файлы читаются заново.
+    on_refresh(сводка) вызывается после каждого пересчёта; max_cycles ограничивает число опросов.
+    """
+    output_dir = Path(output_dir or '')
+    exclude = {Path(report_path).resolve()} | {(output_dir / name).resolve() for name in OUTPUT_FILE_NAMES}
+    ingested = {}   # путь -> подпись разобранной версии файла
+    results = {}    # путь -> агрегат МГТ файла
+    # Файлы, лежащие в папке при запуске, считаем готовыми; новые - когда подпись не меняется между двумя опросами
+    pending = scan_mgt_folder(watch_dir, exclude)
+    report_signature = None
+    report_frame = None
+    report_filials = None
+    report_period = None
+    log_to_gui(f"Наблюдение за папкой {watch_dir}, опрос каждые {interval} сек")
+    cycle = 0
+    while max_cycles is None or cycle < max_cycles:
+        if cycle:
+            time.sleep(interval)
+        cycle += 1
+        current = scan_mgt_folder(watch_dir, exclude)
+        ready = [path for path, signature in current.items() if ingested.get(path) != signature and pending.get(path) == signature]
+        pending = {path: signature for path, signature in current.items() if ingested.get(path) != signature}
+        removed = [path for path in results if path not in current]
+        for path in removed:
+            log_to_gui(f"Файл {path.name} удалён из папки, его данные исключены")
+            del results[path]
+            del ingested[path]
+        try:
+            stat = Path(report_path).stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        report_changed = signature is not None and signature != report_signature
+        if report_changed:
+            period = read_report_period(report_path)
+            period = period[:2] if period else None
+            if period != report_period:
+                report_period = period
+                # Агрегаты уже прочитанных файлов посчитаны за прежний период
+                ready = sorted(set(ready) | set(results))
+        if not (ready or removed or (report_changed and results)):
+            continue
+        summary = new_run_summary()
+        profile = new_profile()
+        profile_start(profile, 'total')
+        profile_start(profile, 'mgt')
+        if ready:
+            log_to_gui(f"\nНовые или изменённые файлы МГТ: {', '.join(path.name for path in ready)}")
+            for path, (filial, period_display, df) in zip(ready, collect_mgt_files(ready, mgt_workers=mgt_workers, use_cache=use_cache, profile=profile, period=report_period)):
+                results[path] = df
+                ingested[path] = current[path]
+        profile_stop(profile, rows=sum(len(results[path]) for path in ready))
+        summary['mgt_files'] = len(results)
+        frames = [results[path] for path in sorted(results) if not results[path].empty]
+        if not frames:
+            log_to_gui("Нет данных МГТ для сверки")
+            summary['status'] = 'no_input'
+        else:
+            combined_df = concat_mgt_frames(frames)
+            summary['mgt_rows'] = len(combined_df)
+            used_filials = set(combined_df['Филиал'].unique().tolist())
+            if report_changed or used_filials != report_filials:
+                profile_start(profile, 'report')
+                report_frame, _ = read_report(report_path, used_filials)
+                report_signature, report_filials = signature, used_filials
+                profile_stop(profile, rows=len(report_frame))
+            summary['report_rows'] = len(report_frame)
+            if len(report_frame) == 0:
+                log_to_gui("Данные из отчёта не извлечены")
+                summary['status'] = 'no_report_data'
+            else:
+                # Кэшированный отчёт не меняем: сверка приводит столбцы к строкам на месте
+                write_reconciliation(build_mgt_index(combined_df), report_frame.copy(), Path(report_path), Path(report_path).name, output_dir, summary, write_back_engine, profile, svod_formats)
+        finish_profile(profile, summary)
+        log_to_gui(f"Сверка обновлена за {summary['timings']['total']:.1f} сек")
+        if on_refresh:
+            on_refresh(summary)
+
+# === Служба сверки (локальный HTTP) ===
+# Долгоживущий процесс держит в памяти агрегаты файлов МГТ и собранные из них индексы (build_mgt_index) по периодам
+# отчётов. Отчёт присылается запросом POST /reconcile (тело - файл .xlsx, ?name= - имя файла), в ответ - zip со Сводом,
+# копией отчёта и JSON-сводкой. Повторная сверка за тот же период не читает ни одного файла МГТ; при изменении файлов
+# (по подписи mtime и размера) заново читаются только изменившиеся. GET /status - состояние службы.
+
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+# Число одновременно выполняемых запросов; остальные ждут в очереди пула
+SERVICE_WORKERS = 4
+SERVICE_MAX_REPORT_BYTES = 200 * 1024 * 1024
+
+def new_reconciliation_service(mgt_paths=(), watch_dir=None, mgt_workers=MGT_WORKERS, use_cache=True, xlsx_engine=None,
+                               write_back_engine=None, svod_formats=None):
+    """
+    Состояние службы сверки. Файлы МГТ - список mgt_paths или все файлы МГТ папки watch_dir
+    (папка просматривается при каждом запросе, поэтому новые файлы подхватываются без перезапуска).
+    """
+    return {'mgt_paths': [Path(path) for path in mgt_paths], 'watch_dir': watch_dir, 'mgt_workers': mgt_workers, 'use_cache': use_cache,
+            'xlsx_engine': xlsx_engine, 'write_back_engine': write_back_engine, 'svod_formats': svod_formats,
+            'frames': {},        # период -> {путь: (подпись файла, агрегат МГТ)}
+            'indexes': {},       # период -> (подписи файлов, (филиалы, строк МГТ, индекс МГТ) или None)
+            'period_locks': {},  # период -> блокировка сборки его индекса
+            'lock': threading.Lock(), 'started': datetime.now(), 'requests': 0}
+
+def service_mgt_signatures(service):
+    """Подписи (mtime, размер) текущих файлов МГТ службы"""
+    if service['watch_dir'] is not None:
+        return scan_mgt_folder(service['watch_dir'])
+    signatures = {}
+    for path in service['mgt_paths']:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        signatures[path] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+def service_mgt_index(service, period):
+    """
+    Данные МГТ за период (начало, конец) или None - период не известен: (число файлов, (филиалы, строк МГТ, индекс МГТ)),
+    вместо кортежа данных - None, если данных МГТ за период нет. Индекс периода собирается при первом запросе и хранится
+    в памяти; запросы за один период ждут его сборки, за другие периоды - нет.
+    """
+    signatures = service_mgt_signatures(service)
+    with service['lock']:
+        period_lock = service['period_locks'].setdefault(period, threading.Lock())
+        frames = service['frames'].setdefault(period, {})
+    with period_lock:
+        cached = service['indexes'].get(period)
+        if cached is not None and cached[0] == signatures:
+            return len(signatures), cached[1]
+        stale = [path for path in signatures if frames.get(path, (None,))[0] != signatures[path]]
+        if stale:
+            log_to_gui(f"Служба: чтение файлов МГТ{f' за период {period[0]:%d.%m.%Y} - {period[1]:%d.%m.%Y}' if period else ''}: "
+                       f"{', '.join(path.name for path in stale)}")
+            for path, (filial, period_display, df) in zip(stale, collect_mgt_files(stale, mgt_workers=service['mgt_workers'], engine=service['xlsx_engine'],
+                                                                                   use_cache=service['use_cache'], period=period)):
+                frames[path] = (signatures[path], df)
+        for path in [path for path in frames if path not in signatures]:
+            del frames[path]
+        data = [frames[path][1] for path in sorted(signatures) if not frames[path][1].empty]
+        entry = None
+        if data:
+            combined_df = concat_mgt_frames(data)
+            entry = (combined_df['Филиал'].unique().tolist(), len(combined_df), build_mgt_index(combined_df))
+        service['indexes'][period] = (signatures, entry)
+        return len(signatures), entry
+
+def service_reconcile(service, report_path, output_dir):
+    """Сверка отчёта с данными МГТ службы; Свод и копия отчёта - в output_dir. Возвращает сводку как process_files"""
+    summary = new_run_summary()
+    profile = new_profile()
+    profile_start(profile, 'total')
+    profile_start(profile, 'report_period')
+    report_period = read_report_period(report_path, service['xlsx_engine'])
+    profile_stop(profile)
+    profile_start(profile, 'mgt')
+    summary['mgt_files'], entry = service_mgt_index(service, report_period[:2] if report_period else None)
+    profile_stop(profile, rows=entry[1] if entry else 0)
+    if entry is None:
+        log_to_gui(f"Нет данных МГТ за период отчёта {report_path.name}")
+        summary['status'] = 'no_input'
+    else:
+        used_filials, summary['mgt_rows'], mgt_index = entry
+        profile_start(profile, 'report')
+        report_frame, _ = read_report(report_path, used_filials, None, service['xlsx_engine'])
+        profile_stop(profile, rows=len(report_frame))
+        summary['report_rows'] = len(report_frame)
+        if len(report_frame) == 0:
+            log_to_gui(f"Данные из отчёта {report_path.name} не извлечены")
+            summary['status'] = 'no_report_data'
+        else:
+            write_reconciliation(mgt_index, report_frame, report_path, report_path.name, output_dir, summary,
+                                 service['write_back_engine'], profile, service['svod_formats'])
+    finish_profile(profile, summary)
+    return summary
+
+def service_status(service):
+    with service['lock']:
+        indexes = dict(service['indexes'])
+    periods = [f"{period[0]:%d.%m.%Y} - {period[1]:%d.%m.%Y}" if period else None for period in indexes]
+    return {'status': 'ok', 'started': service['started'].isoformat(timespec='seconds'), 'requests': service['requests'],
+            'mgt_files': len(service_mgt_signatures(service)), 'periods': periods,
+            'mgt_rows': sum(entry[1] for signatures, entry in indexes.values() if entry)}
+
+def service_result_zip(summary):
+    """zip с файлами результатов сверки (summary['outputs']) и сводкой run_summary.json; пути в сводке - имена в архиве"""
+    buffer = io.BytesIO()
+    outputs = {}
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for key, path in summary['outputs'].items():
+            zf.write(path, Path(path).name)
+            outputs[key] = Path(path).name
+        zf.writestr('run_summary.json', json.dumps({**summary, 'outputs': outputs}, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
+
+class ReconciliationHandler(BaseHTTPRequestHandler):
+    server_version = 'MGTReconciliation/1.0'
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/status':
+            self.send_json(404, {'status': 'error', 'error': "неизвестный путь; доступны GET /status и POST /reconcile"})
+            return
+        self.send_json(200, service_status(self.server.service))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/reconcile':
+            self.send_json(404, {'status': 'error', 'error': "неизвестный путь; доступны GET /status и POST /reconcile"})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        name = Path(parse_qs(url.query).get('name', ['Отчет.xlsx'])[0]).name
+        if not length or not name.lower().endswith('.xlsx'):
+            self.send_json(400, {'status': 'error', 'error': "в теле запроса нужен файл отчёта .xlsx, в параметре name - его имя"})
+            return
+        if length > SERVICE_MAX_REPORT_BYTES:
+            self.send_json(413, {'status': 'error', 'error': f"файл отчёта больше {SERVICE_MAX_REPORT_BYTES // (1024 * 1024)} МБ"})
+            return
+        service = self.server.service
+        with service['lock']:
+            service['requests'] += 1
+        # Каждый запрос - в своей временной папке: имена файлов результатов у всех запросов одинаковые
+        with tempfile.TemporaryDirectory(prefix='mgt_service_') as workdir:
+            report_path = Path(workdir) / name
+            report_path.write_bytes(self.rfile.read(length))
+            output_dir = Path(workdir) / 'result'
+            output_dir.mkdir()
             try:
-                wb = openpyxl.load_workbook(contract_path, data_only=True, read_only=True)
-                for sheet_name in wb.sheetnames:
-                    if (sheet in used_filials):
-                        ws = wb[sheet_name]
-                        for row_idx in range(1, min(16, ws.max_row + 1)):
-                            cell_val = ws.cell(row=row_idx, column=1).value
-                            if cell_val and isinstance(cell_val, str):
-                                text = cell_val.strip()
-                                if 'за период' in text.lower() and 'по' in text.lower() and 'г.' in text:
-                                    period_start, period_end, period_display = extract_period_from_merged_cells(text.lower())
-                                    contract_beg, contract_end = period_start, period_end
-                                    period_extracted=True
-
-                            #if is_row_empty(row)== True:
-                                #break
-
-
-                        header_row = None
-                        headers = []
-                        for r in range(1, min(11, ws.max_row + 1)):
-                            row_vals = [str(ws.cell(row=r, column=c).value or '').strip() for c in range(1, 6)]
-                            if 'Гаражный номер ТС' in ''.join(row_vals) :
-                                header_row = r
-                                headers = row_vals
-                                break
-                        if header_row:
-                            rows = []
-                            for r in range(header_row + 1, ws.max_row + 1):
-
-                                vals = [ws.cell(row=r, column=c).value for c in range(1, len(headers) + 1)]
-                                if all(v is None or str(v).strip() == '' for v in vals):
-                                    break                                
-                                if is_row_empty(row)== True:
-                                    print('Сработала функция')
-                                    break
-                                if vals and  len(vals)>0 and vals[0]=='':
-                                    print('Сработало условие')
-                                    break
-                                if r>2070:
-                                    print('----')
-                                    print(r)
-                                    print(vals)
-                                    print('====')                                
-                                if not isinstance(vals[0], (int)):
-                                    break
-
-
-                                rows.append(vals)
-                            if rows:                                
-
-                                df_sheet = pd.DataFrame(rows, columns=headers)
-                                cols_map = {}
-                                for col in df_sheet.columns:
-                                    if 'количество' in col.lower():
-                                        cols_map[col] = 'Количество ед.'
-                                    elif ('гар.' in col.lower() and '№' in col.lower()) or ('гар' in col.lower() and 'ТС' in col.lower()):
-                                        cols_map[col] = 'Гаражный номер ТС'
-                                    elif 'vin' in col.lower():
-                                        cols_map[col] = 'VIN'
-                                if cols_map:
-                                    df_sheet = df_sheet[list(cols_map.keys())].rename(columns=cols_map)
-                                    df_sheet['Филиал'] = sheet_name
-                                    df_sheet = clean_columns(df_sheet)
-                                    print(df_sheet['Количество'].dtype)
-                                    #df_sheet = df_sheet[df_sheet['Количество']!= 0 and df_sheet['Количество']!= '' and df_sheet['Количество']!= '0']
-                                    contract_dataframes= pd.concat([contract_dataframes,df_sheet],ignore_index =False)
-                wb.close()
-                if period_extracted:
-                    log_to_gui('В отчете указаны данные '+period_display)
+                summary = service_reconcile(service, report_path, output_dir)
             except Exception as e:
-                log_to_gui(f"openpyxl не смог прочитать отчёт: {e}")
+                log_to_gui(f"Служба: ошибка сверки {name}: {e}")
+                self.send_json(500, {'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+                return
+            if summary['status'] != 'ok':
+                self.send_json(422, summary)
+                return
+            payload = service_result_zip(summary)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Content-Disposition', "attachment; filename=result.zip")
+        self.end_headers()
+        self.wfile.write(payload)
 
-        if len(contract_dataframes)==0:
-            log_to_gui("Данные из отчёта не извлечены")
-        #print(contract_dataframes.columns.to_list())
-    
-    log_to_gui("Идет подсчет разницы в количестве с МГТ...")
-    # Подготовка данных
-
-    if len(contract_dataframes)!=0:
-        combined_df['Филиал'] = (combined_df['Филиал'].astype(str).str.strip().replace({'nan': ''}))
-        combined_df['Филиал'] = combined_df['Филиал'].map(short_names).fillna('Неизвестно')
-        combined_df['Гаражный номер ТС'] = (pd.to_numeric(combined_df['Гаражный номер ТС'], errors='coerce').fillna(0).astype('Int64').astype(str).str.zfill(6).replace('000000', ''))
-        #used_filials = combined_df['Филиал'].unique().tolist()
-        #contract_dataframes = contract_dataframes[contract_dataframes['Филиал'] in used_filials]
-            # Фильтр по периоду
-        #if contract_beg and contract_end:
-            #combined_df['Дата'] = pd.to_datetime(combined_df['Дата'], format='%d.%m.%Y', errors='coerce')
-            #combined_df = combined_df[(combined_df['Дата'] >= period_start) & (combined_df['Дата'] <= period_end)]
-            #combined_df['Дата'] = combined_df['Дата'].dt.strftime('%d.%m.%Y')
-        contract_dataframes['Гаражный номер ТС'] = (pd.to_numeric(contract_dataframes['Гаражный номер ТС'], errors='coerce').fillna(0).astype('Int64').astype(str).str.zfill(6).replace('000000', ''))
-        contract_dataframes = contract_dataframes.iloc[( contract_dataframes['VIN']!='') & (contract_dataframes['Количество ед.']!= 0) & (contract_dataframes['Количество ед.']!= '0')]
-        checking = pd.merge(contract_dataframes, combined_df, left_on= ['Филиал', 'VIN', 'Гаражный номер ТС'], right_on=['Филиал','VIN','Гаражный номер ТС'], how = 'left', suffixes=['', 'CUB'])
-        checking = checking[['№','Наименование услуги','Единица измерения','Количество ед.','Гаражный номер ТС','Государственный номер ТС','Цена 1 ед., руб.','Итого, руб.','Количество по МГТ','VIN', 'Филиал']]
-        checking['Количество по МГТ'] = checking['Количество по МГТ'].fillna(0)
-        checking['Разница в количестве с МГТ'] = (pd.to_numeric(checking['Количество ед.'], errors='coerce').fillna(0).astype(int) - pd.to_numeric(checking['Количество по МГТ'], errors='coerce').fillna(0).astype(int))
-        #checking['Разница в количестве с МГТ'] = (str(checking['Разница в количестве с МГТ'])+', стажер') if checking['Дата выгрузки']=='' else (str(checking['Разница в количестве с МГТ']))
-        log_to_gui("Идет подсчет разницы по сумме с МГТ...")
-        # Извлекаем число из "Разница в количестве с МГТ" (игнорируем ", стажер") и умножаем на цену
-        checking['Разница по сумме с МГТ'] = (checking['Разница в количестве с МГТ'].apply(extract_number_from_result) * pd.to_numeric(checking['Цена 1 ед., руб.'], errors='coerce').fillna(0)).round(2)
-        #print(checking['Разница по сумме с МГТ'].dtype)
-        diif_sum = checking['Разница по сумме с МГТ'].sum()
-        log_to_gui("Разница в количестве с МГТ и разница по сумме подсчитаны")
-        #  Разница в количестве с МГТ
-        with pd.ExcelWriter('Свод_по_собранным_данным.xlsx') as writer:
-            checking.to_excel(writer, index=False, sheet_name='Свод')
-            #practice.to_excel(writer, index=False, sheet_name='стажировки')
-            #combined_df.to_excel(writer, index=False, sheet_name='КУБы')
-            #contract_dataframes.to_excel(writer, index=False, sheet_name='Контракты')
-        log_to_gui(f"\nСоздан файл 'Свод_по_собранным_данным.xlsx', в котором хранится сводная таблица по данным из отчета, данных МГТ")
-
-        if contract_path:
-            # Создаём копию отчёта
-            new_file_name = 'Копия_отчета.xlsx'
-            shutil.copyfile(contract_path, new_file_name)
-            log_to_gui(f"\nСоздана копия отчёта '{contract_name}': {new_file_name}.\nВ этот файл будут внесены разница в количестве с МГТ, разница в сумме с МГТ:")
-            # Открываем копию через openpyxl для сохранения стилей (БЕЗ read_only!)
-            wb = openpyxl.load_workbook(new_file_name)
-            # Филиалы для обработки (только нужные три)
-            #target_filials = combined_df['Филиал'].unique().tolist()
-            target_filials = checking['Филиал'].unique().tolist()
-            processed_filials = []
-            for sheet_name in wb.sheetnames:
-                # Проверяем, является ли лист нужным филиалом (регистронезависимо)
-                if any(tf.lower() in sheet_name.lower() for tf in target_filials):
-                    ws = wb[sheet_name]
-                    filial_name = next(tf for tf in target_filials if tf.lower() in sheet_name.lower())
-                    processed_filials.append(filial_name)
-                    # Фильтруем данные для этого филиала
-                    filial_data = checking[checking['Филиал'] == filial_name].copy()
-                    if filial_data.empty:
-                        log_to_gui(f"  >> Филиал '{filial_name}' (лист '{sheet_name}'): нет данных для записи")
-                        continue
-                    # Определяем строку с заголовками (ищем "№" в первых 10 строках)
-                    header_row = None
-                    col_index_number = None  # индекс столбца "№"
-                    col_index_number = None  # индекс столбца "№"
-                    for r in range(1, min(11, ws.max_row + 1)):
-                        for c in range(1, min(10, ws.max_column + 1)):
-                            cell_val = str(ws.cell(row=r, column=c).value or '').strip()
-                            if cell_val == '№':
-                                header_row = r
-                                col_index_number = c
-                                break
-                        if header_row:
-                            break
-                    if not header_row:
-                        log_to_gui(f"   Не найден заголовок '№' в листе '{sheet_name}'")
-                        continue
-                    # Собираем маппинг: номер услуги → номер строки в Excel
-                    number_to_row = {}
-                    for r in range(header_row + 1, ws.max_row + 1):
-                        cell_val = str(ws.cell(row=r, column=col_index_number).value or '').strip()
-                        if cell_val and cell_val != '':
-                            number_to_row[cell_val] = r
-                    # Записываем данные для каждой найденной услуги
-                    written_count = 0
-                    for _, row in filial_data.iterrows():
-                        service_num = str(row['№']).strip()
-                        result_val = str(row['Разница в количестве с МГТ'])
-                        diff_val = row['Разница по сумме с МГТ']
-                        if service_num in number_to_row:
-                            target_row = number_to_row[service_num]
-                            # Находим последний непустой столбец в строке
-                            last_col = ws.max_column
-                            while last_col >= 1 and ws.cell(row=target_row, column=last_col).value in (None, '', ' '):
-                                last_col -= 1
-                            ws.cell(row=header_row, column=last_col + 1, value='Разница в количестве с МГТ')
-                            ws.cell(row=header_row, column=last_col + 2, value='Разница по сумме с МГТ')
-                            # Определяем столбцы для записи с обходом объединённых ячеек
-                            # Начинаем со столбца после последнего заполненного
-                            result_col = last_col + 1
-                            # Сдвигаемся вправо, пока не найдём обычную ячейку (не MergedCell)
-                            while result_col <= ws.max_column + 10:  # +10 на случай длинных объединений
-                                cell = ws.cell(row=target_row, column=result_col)
-                                if not isinstance(cell, openpyxl.cell.cell.MergedCell):
-                                    break
-                                result_col += 1
-                            diff_col = result_col + 1
-                            while diff_col <= ws.max_column + 10:
-                                cell = ws.cell(row=target_row, column=diff_col)
-                                if not isinstance(cell, openpyxl.cell.cell.MergedCell):
-                                    break
-                                diff_col += 1
-                            # Записываем значения в найденные обычные ячейки
-                            ws.cell(row=target_row, column=result_col, value=result_val)
-                            ws.cell(row=target_row, column=diff_col, value=diff_val)
-                            # Применяем базовое форматирование (как в ваших требованиях)
-                            for col in [result_col, diff_col]:
-                                cell = ws.cell(row=target_row, column=col)
-                                cell.alignment = openpyxl.styles.Alignment(horizontal='center', vertical='center')
-                                cell.font = openpyxl.styles.Font(name='Moscow Sans', size=10)
-                        
-                            written_count += 1
-                    #print(diff_col)
-                    #print(header_row+written_count)
-                    ws.cell(row = written_count-2, column = ws.max_column, value = diif_sum)
-
-                    log_to_gui(f"  >> Филиал '{filial_name}' (лист '{sheet_name}'): записано {written_count} строк")
-            # Сохраняем изменения
-            wb.save(new_file_name)
-            wb.close()
-
-            log_to_gui(f"  Обработаны филиалы: {', '.join(processed_filials) if processed_filials else 'нет подходящих листов'}")
-        else:
-            log_to_gui("Файл отчёта не был загружен — запись в копию пропущена")
+    def send_json(self, code, data):
+        payload = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
 
-    endingTime = datetime.now()
-    timeDif = endingTime - startingTime
+    def log_message(self, format, *args):
+        log_to_gui(f"Служба: {self.address_string()} {format % args}")
 
-    log_to_gui(f'\n=== Времени потрачено на чтение : {timeDif.total_seconds():.1f} сек ===')
-    log_to_gui("Обработка завершена")
-    messagebox.showinfo('Успех', 'Обработка завершена!\nРезультаты сохранены.')
+class ReconciliationServer(ThreadingHTTPServer):
+    """HTTP-сервер службы: запросы выполняет пул из workers потоков, данные МГТ (service) у потоков общие"""
+
+    def __init__(self, address, service, workers=SERVICE_WORKERS):
+        super().__init__(address, ReconciliationHandler)
+        self.service = service
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+def serve_reconciliation(service, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, warm_reports=()):
+    """
+    Запускает службу и обслуживает запросы до остановки (Ctrl+C). warm_reports - отчёты, за периоды которых
+    данные МГТ читаются заранее, до первого запроса.
+    """
+    for report_path in warm_reports:
+        period = read_report_period(report_path, service['xlsx_engine'])
+        service_mgt_index(service, period[:2] if period else None)
+    server = ReconciliationServer((host, port), service, workers)
+    log_to_gui(f"Служба сверки: http://{host}:{server.server_port}/reconcile (POST файла отчёта), /status; запросов одновременно: {workers}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+# Коды завершения пакетного режима
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_NO_INPUT = 3
+EXIT_NO_REPORT_DATA = 4
+EXIT_NO_REPORT = 5
+EXIT_CODES = {'ok': EXIT_OK, 'no_input': EXIT_NO_INPUT, 'no_report_data': EXIT_NO_REPORT_DATA, 'no_report': EXIT_NO_REPORT}
+
+def expand_input_paths(patterns):
+    """Пути и маски файлов (*.xlsx, *.csv) в список файлов; маски раскрываем сами - оболочка Windows этого не делает"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            log_to_gui(f"По маске '{pattern}' файлы не найдены")
+        paths.extend(Path(path) for path in matches)
+    return paths
+
+def run_cli(argv=None):
+    """
+    Пакетный режим без GUI: сверка, файлы результатов в --output-dir и JSON-сводка запуска.
+    С --serve - служба сверки (serve_reconciliation) до остановки.
+    Возвращает код завершения (EXIT_*).
+    """
+    parser = argparse.ArgumentParser(description="Сравнение данных МГТ с вигитон/антисон без GUI")
+    parser.add_argument('--report', type=Path, nargs='+',
+                        help="файл отчета (вигитон/антисон); при нескольких файлах МГТ читаются один раз, "
+                             "результаты каждого отчёта - в подпапке --output-dir; с --serve - отчёты для прогрева данных МГТ")
+    inputs = parser.add_mutually_exclusive_group()
+    inputs.add_argument('--mgt', nargs='+', help="файлы МГТ (.xlsx, .csv, .tsv) или маски, например 'МГТ/*.xlsx'")
+    inputs.add_argument('--watch', type=Path, help="папка с файлами МГТ: следить за ней и обновлять сверку")
+    parser.add_argument('--store', type=Path, nargs='?', const=USAGE_STORE_PATH,
+                        help="сверка по хранилищу использования ТС (SQLite): файлы --mgt загружаются в хранилище, "
+                             f"отчёт сверяется с данными за свой период; без пути - {USAGE_STORE_PATH}")
+    parser.add_argument('--serve', type=int, nargs='?', const=SERVICE_PORT, metavar='PORT',
+                        help=f"служба сверки на http://{SERVICE_HOST}:PORT (по умолчанию {SERVICE_PORT}) с данными МГТ --mgt или папки --watch в памяти")
+    parser.add_argument('--service-workers', type=int, default=SERVICE_WORKERS, help="число одновременно выполняемых запросов службы")
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help="период опроса папки в режиме --watch, сек")
+    parser.add_argument('--output-dir', type=Path, default=Path('.'), help="папка для файлов результатов")
+    parser.add_argument('--svod-format', nargs='+', choices=['xlsx', 'csv', 'parquet'], default=list(SVOD_FORMATS),
+                        help="форматы файла Свод; parquet требует модуль pyarrow")
+    parser.add_argument('--summary', type=Path, help="файл JSON-сводки (по умолчанию run_summary.json в --output-dir)")
+    parser.add_argument('--workers', type=int, default=MGT_WORKERS, help="число процессов для чтения файлов МГТ")
+    parser.add_argument('--no-cache', action='store_true', help="не использовать кэш файлов МГТ")
+    parser.add_argument('--profile', type=Path, help="сохранить замеры этапов в файл .json или .csv")
+    parser.add_argument('--trace-memory', action='store_true', help="замерять пик памяти этапов через tracemalloc (медленнее)")
+    parser.add_argument('--cprofile', type=Path, help="снять cProfile этапа --cprofile-stage в файл .prof")
+    parser.add_argument('--cprofile-stage', default='mgt', choices=['mgt', 'ingest', 'report', 'store_query', 'reconcile', 'svod', 'write_back', 'total'],
+                        help="этап для cProfile; для 'mgt' файлы читаются в одном процессе")
+    args = parser.parse_args(argv)
+    args.report = args.report or []
+    if not (args.report or args.serve):
+        parser.error("нужен аргумент --report")
+    for report in args.report:
+        if not report.is_file():
+            parser.error(f"файл отчета не найден: {report}")
+    if args.watch and not args.watch.is_dir():
+        parser.error(f"папка не найдена: {args.watch}")
+    if args.watch and len(args.report) > 1 and not args.serve:
+        parser.error("в режиме --watch сверяется один отчёт")
+    if not (args.mgt or args.watch or args.store):
+        parser.error("нужен один из аргументов --mgt, --watch или --store")
+    if args.store and (args.watch or len(args.report) > 1):
+        parser.error("с --store сверяется один отчёт и без --watch")
+    if args.serve and args.store:
+        parser.error("служба --serve работает с файлами --mgt или папкой --watch, без --store")
+    if 'parquet' in args.svod_format and pyarrow is None:
+        parser.error("для --svod-format parquet нужен модуль pyarrow")
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = args.summary or args.output_dir / 'run_summary.json'
+    started = datetime.now()
+
+    def write_summary(summary, exit_code):
+        report = str(args.report[0]) if len(args.report) == 1 else [str(path) for path in args.report]
+        summary = {'report': report, 'started': started.isoformat(timespec='seconds'), **summary, 'exit_code': exit_code}
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if args.serve:
+        service = new_reconciliation_service(expand_input_paths(args.mgt or []), args.watch, mgt_workers=args.workers,
+                                             use_cache=not args.no_cache, svod_formats=args.svod_format)
+        try:
+            serve_reconciliation(service, port=args.serve, workers=args.service_workers, warm_reports=args.report)
+        except KeyboardInterrupt:
+            log_to_gui("Служба остановлена")
+        return EXIT_OK
+    if args.watch:
+        try:
+            watch_mgt_folder(args.watch, args.report[0], args.output_dir, interval=args.interval, mgt_workers=args.workers,
+                             use_cache=not args.no_cache, svod_formats=args.svod_format,
+                             on_refresh=lambda summary: write_summary(summary, EXIT_CODES.get(summary['status'], EXIT_ERROR)))
+        except KeyboardInterrupt:
+            log_to_gui("Наблюдение остановлено")
+        return EXIT_OK
+    profile = new_profile(trace_memory=args.trace_memory, cprofile_stage=args.cprofile_stage if args.cprofile else None, cprofile_path=args.cprofile)
+    # cProfile видит только текущий процесс: при замере чтения МГТ пул процессов не используется
+    workers = 1 if args.cprofile and args.cprofile_stage in ('mgt', 'ingest', 'total') else args.workers
+    try:
+        if args.store:
+            summary = process_usage_store(expand_input_paths(args.mgt or []), args.report[0], store_path=args.store, mgt_workers=workers,
+                                          svod_formats=args.svod_format, output_dir=args.output_dir, profile=profile, profile_path=args.profile)
+        elif len(args.report) > 1:
+            summary = process_report_batch(expand_input_paths(args.mgt), args.report, mgt_workers=workers,
+                                           use_cache=not args.no_cache, svod_formats=args.svod_format, output_dir=args.output_dir, profile=profile, profile_path=args.profile)
+        else:
+            summary = process_files(expand_input_paths(args.mgt), args.report[0], mgt_workers=workers,
+                                    use_cache=not args.no_cache, svod_formats=args.svod_format, output_dir=args.output_dir, profile=profile, profile_path=args.profile)
+        exit_code = EXIT_CODES.get(summary['status'], EXIT_ERROR)
+    except Exception as e:
+        log_to_gui(f"Ошибка обработки: {e}")
+        summary = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+        exit_code = EXIT_ERROR
+    write_summary(summary, exit_code)
+    return exit_code
 
 if __name__ == "__main__":
-    start_gui()
\ No newline at end of file
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(run_cli())
+    start_gui()
\ No newline at end of file